@@ -1,4 +1,4 @@
-from .advanced_text_filter import AdvancedTextFilter
+from .advanced_text_filter import AdvancedTextFilter, AdvancedTextFilterList, TextFilterRecipe
 from .text_input import TextInput
 from .text_scraper import TextScraper
 from .text_storage import NODE_CLASS_MAPPINGS as TEXT_STORAGE_CLASS_MAPPINGS
@@ -29,6 +29,8 @@ from .global_random_seed import register_available_prompt_server
 
 NODE_CLASS_MAPPINGS = {
     "AdvancedTextFilter": AdvancedTextFilter,
+    "AdvancedTextFilterList": AdvancedTextFilterList,
+    "TextFilterRecipe": TextFilterRecipe,
     "TextInput": TextInput,
     "TextScraper": TextScraper,
     "WildcardsNode": WildcardsNode,
@@ -41,6 +43,8 @@ NODE_CLASS_MAPPINGS = {
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "AdvancedTextFilter": "Advanced Text Filter",
+    "AdvancedTextFilterList": "Advanced Text Filter (List)",
+    "TextFilterRecipe": "Text Filter Recipe",
     "TextInput": "Text Input",
     "TextScraper": "Text Scraper",
     "WildcardsNode": "Wildcards Processor",
@@ -1,19 +1,2172 @@
+import bisect
+import csv
+import hashlib
+import json
+import os
+import pickle
+import queue
 import re
-from typing import Tuple, Optional, Any
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from importlib import import_module
+from functools import lru_cache
+from typing import Tuple, Optional, Any, Dict, List
+
+try:
+    from re import _constants as _regex_constants, _parser as _regex_parser
+except ImportError:  # Python 3.10
+    import sre_constants as _regex_constants
+    import sre_parse as _regex_parser
+
+try:
+    import re2 as _re2  # Optional linear-time engine (google-re2).
+except ImportError:
+    _re2 = None
+
+try:
+    import orjson as _orjson  # Optional fast JSON validation.
+except ImportError:
+    _orjson = None
+
+
+PLUGIN_RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "replacement_rules")
+USER_RULES_SUBDIR = os.path.join("ComfyUI_Text_Processor", "replacement_rules")
+RULE_FILE_EXTENSIONS = (".txt", ".tsv", ".csv")
+NO_RULES_FILE = "none"
+
+REGEX_CACHE_SIZE = 512
+RULE_SET_CACHE_SIZE = 64
+LIST_PARALLEL_MIN_ITEMS = 64
+RECIPE_CACHE_SIZE = 32
+OUTPUT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+REGEX_WORKER_START_TIMEOUT = 30.0
+TRANSLATE_MIN_CHARS = 16384
 
 
 class _IntentionalFilterError(ValueError):
     pass
 
 
-def _normalize_regex_matches(matches):
-    normalized = []
-    for match in matches:
-        if isinstance(match, tuple):
-            normalized.append(" | ".join("" if part is None else str(part) for part in match))
+class _RegexTimeout(Exception):
+    pass
+
+
+class _LinearRegexUnsupported(Exception):
+    pass
+
+
+_regex_backend = threading.local()
+
+
+@contextmanager
+def _linear_regex_backend():
+    """Compile regexes with RE2 on this thread; unsupported patterns raise _LinearRegexUnsupported."""
+    previous = getattr(_regex_backend, "linear", False)
+    _regex_backend.linear = True
+    try:
+        yield
+    finally:
+        _regex_backend.linear = previous
+
+
+def _compile_regex(pattern: str, flags: int):
+    # Always call positionally so both forms share one cache entry.
+    if getattr(_regex_backend, "linear", False):
+        return _compile_linear_regex(pattern, flags)
+    return _compile_python_regex(pattern, flags)
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _compile_python_regex(pattern: str, flags: int) -> "re.Pattern[str]":
+    return re.compile(pattern, flags)
+
+
+_LINEAR_INLINE_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"))
+_LINEAR_SUPPORTED_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL | re.UNICODE
+
+
+class _LinearPattern:
+    """re.Pattern-like view of an RE2 program; matching time is linear in the text length."""
+
+    def __init__(self, compiled: "re.Pattern[str]", program):
+        self.pattern = compiled.pattern
+        self.flags = compiled.flags
+        self.groups = compiled.groups
+        self._program = program
+
+    def __getattr__(self, name):
+        return getattr(self._program, name)
+
+
+def _has_end_anchor(items) -> bool:
+    for op, av in items:
+        if op is _regex_constants.AT and av is _regex_constants.AT_END:
+            return True
+        stack = [av]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, _regex_parser.SubPattern):
+                if _has_end_anchor(value):
+                    return True
+            elif isinstance(value, (tuple, list)):
+                stack.extend(value)
+    return False
+
+
+@lru_cache(maxsize=REGEX_CACHE_SIZE)
+def _compile_linear_regex(pattern: str, flags: int) -> _LinearPattern:
+    if _re2 is None:
+        raise _LinearRegexUnsupported("re2 is not installed")
+    # The Python compile validates the pattern and resolves inline flags; nothing is matched with it.
+    try:
+        compiled = _compile_python_regex(pattern, flags)
+        parsed = _regex_parser.parse(pattern, flags)
+        min_width = parsed.getwidth()[0]
+        end_anchor = not compiled.flags & re.MULTILINE and _has_end_anchor(parsed)
+    except (re.error, RecursionError) as e:
+        raise _LinearRegexUnsupported(str(e)) from e
+    if compiled.flags & ~_LINEAR_SUPPORTED_FLAGS:
+        raise _LinearRegexUnsupported("unsupported regex flags")
+    if min_width == 0:
+        # The re2 wrapper reports empty matches differently from re; keep those on the Python engine.
+        raise _LinearRegexUnsupported("pattern can match empty text")
+    if end_anchor:
+        # re's $ also matches before a trailing newline; RE2's only at the very end.
+        raise _LinearRegexUnsupported("pattern uses $ outside multiline mode")
+
+    inline = "".join(letter for flag, letter in _LINEAR_INLINE_FLAGS if flags & flag)
+    options = _re2.Options()
+    options.log_errors = False
+    try:
+        program = _re2.compile(f"(?{inline}){pattern}" if inline else pattern, options)
+    except _re2.error as e:
+        raise _LinearRegexUnsupported(str(e)) from e
+    return _LinearPattern(compiled, program)
+
+
+def regex_cache_info():
+    """Return hit/miss/size counters of the process-wide compiled-pattern cache."""
+    return _compile_python_regex.cache_info()
+
+
+def clear_regex_cache():
+    _compile_python_regex.cache_clear()
+    _compile_linear_regex.cache_clear()
+
+
+class _LRUCache:
+    """Thread-safe bounded LRU with hit/miss counters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+
+class _OutputCache:
+    """Thread-safe LRU of node results, bounded by the memory of the cached strings."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result: Tuple[str, str]):
+        size = sum(sys.getsizeof(value) for value in result)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_OUTPUT_CACHE = _OutputCache(OUTPUT_CACHE_MAX_BYTES)
+
+
+def _output_cache_key(inputs: dict) -> bytes:
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(inputs):
+        value = inputs[name]
+        # Length-prefixed, typed fields so no two input combinations share a byte stream.
+        encoded = (value if isinstance(value, str) else repr(value)).encode("utf-8", "surrogatepass")
+        digest.update(f"{name}:{type(value).__name__}:{len(encoded)}:".encode("ascii"))
+        digest.update(encoded)
+    return digest.digest()
+
+
+def output_cache_info():
+    """Return hit/miss/eviction counters and memory use of the opt-in result cache."""
+    return _OUTPUT_CACHE.stats()
+
+
+def clear_output_cache():
+    _OUTPUT_CACHE.clear()
+
+
+OPERATION_MODES = [
+    "find and remove (use optional_text)",
+    "find and replace (use optional_text, replace_with_text)",
+    "find all (extract) (use optional_text)",
+
+    "batch replace (use replacement_rules)",
+
+    "extract between",
+    "remove between",
+    "extract all between",
+    "remove all between",
+    "extract before start text",
+    "extract after start text",
+    "remove before start text",
+    "remove after start text",
+
+    "remove empty lines",
+    "remove newlines",
+    "strip lines (trim)",
+    "remove all whitespace (keep newlines)",
+    "normalize whitespace (trim, collapse spaces, remove empty lines)",
+
+    "tags: clean (dedupe, remove optional_text, alias replacement_rules)",
+    "tags: clean and sort (dedupe, remove optional_text, alias replacement_rules)",
+
+    "LLM: extract code block (```)",
+    "LLM: extract JSON object ({...})",
+    "LLM: extract all JSON ({...} / [...])",
+    "LLM: extract all valid JSON ({...} / [...])",
+    "LLM: clean markdown formatting",
+    "LLM: clean markdown formatting (keep code)",
+]
+
+BATCH_REPLACE_MODES = ["sequential (compatible)", "single pass"]
+IF_NOT_FOUND_POLICIES = ["return original text", "return empty string", "trigger error"]
+REGEX_ENGINES = ["python", "re2 (linear time)"]
+
+_TEMPLATE_GROUP_REF = re.compile(r"\\(?:g<[^>]*>|[0-9]{1,2})")
+
+
+def _parse_replacement_rules(replacement_rules: str):
+    rules = []
+    for line in replacement_rules.splitlines():
+        line = line.strip()
+        if not line or "->" not in line:
+            continue
+
+        find_str, repl_str = line.split("->", 1)
+        find_str = find_str.strip()
+        if find_str:
+            rules.append((find_str, repl_str.strip()))
+    return rules
+
+
+class _LiteralAutomaton:
+    """
+    Aho-Corasick automaton over literal rules.
+    replace() rewrites every non-overlapping match in one pass, choosing the
+    leftmost match and, among matches starting there, the longest one.
+    Duplicate find strings keep the replacement of the first rule.
+    """
+
+    def __init__(self, rules):
+        self.replacements = {}
+        self.goto = [{}]
+        self.fail = [0]
+        self.depth = [0]
+        self.terminal = [False]
+
+        for find_str, repl_str in rules:
+            if find_str in self.replacements:
+                continue
+            self.replacements[find_str] = repl_str
+            state = 0
+            for char in find_str:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.depth.append(self.depth[state] + 1)
+                    self.terminal.append(False)
+                state = next_state
+            self.terminal[state] = True
+
+        # out_len: length of the longest rule that ends in this state, via suffix links.
+        self.out_len = [0] * len(self.goto)
+        queue = list(self.goto[0].values())
+        for state in queue:
+            self.out_len[state] = self.depth[state] if self.terminal[state] else 0
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out_len[child] = self.depth[child] if self.terminal[child] else self.out_len[self.fail[child]]
+                queue.append(child)
+
+    def replace(self, text: str, view: Optional["_FoldedText"] = None) -> Tuple[str, int]:
+        """
+        Rewrite every match in text. With a casefolded view (and an automaton
+        built over casefolded rules), matching runs on view.folded and the
+        replacements are spliced into the original-case view.text.
+        """
+        goto, fail, depth, out_len = self.goto, self.fail, self.depth, self.out_len
+        replacements = self.replacements
+        source = text
+        if view is not None:
+            text, source = view.folded, view.text
+        pieces = []
+        count = 0
+        last = 0
+        state = 0
+        best_start = best_end = -1
+        index = 0
+        length = len(text)
+
+        while True:
+            if index < length:
+                char = text[index]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(char, 0)
+                index += 1
+
+                match_len = out_len[state]
+                if match_len:
+                    start = index - match_len
+                    if best_start < 0 or start < best_start or (start == best_start and index > best_end):
+                        best_start, best_end = start, index
+
+                # No live prefix can still start at or before best_start: the match is final.
+                if best_start < 0 or index - depth[state] <= best_start:
+                    continue
+            elif best_start < 0:
+                break
+
+            replacement = replacements[text[best_start:best_end]]
+            index = best_end
+            state = 0
+            if view is not None:
+                best_start, best_end = view.to_original(best_start), view.to_original(best_end)
+                if best_start == -1 or best_end == -1:
+                    best_start = best_end = -1
+                    continue
+            pieces.append(source[last:best_start])
+            pieces.append(replacement)
+            count += 1
+            last = best_end
+            best_start = best_end = -1
+
+        if not count:
+            return source, 0
+        pieces.append(source[last:])
+        return "".join(pieces), count
+
+
+_UNBUILT = object()
+_PREFIX_TRIE_DEPTH = 32
+
+
+def _regex_literal_prefix(items) -> Tuple[str, bool]:
+    """Return (literal text every match must start with, whether items were all literal)."""
+    prefix = []
+    for op, av in items:
+        if op is _regex_constants.LITERAL:
+            prefix.append(chr(av))
+        elif op is _regex_constants.AT:
+            continue
+        elif op is _regex_constants.SUBPATTERN and not av[1] and not av[2]:
+            inner, complete = _regex_literal_prefix(av[3])
+            prefix.append(inner)
+            if not complete:
+                return "".join(prefix), False
+        else:
+            return "".join(prefix), False
+    return "".join(prefix), True
+
+
+def _regex_tail(items) -> list:
+    """Parsed items left after the literal prefix read by _regex_literal_prefix."""
+    for position, (op, av) in enumerate(items):
+        if op is _regex_constants.LITERAL or op is _regex_constants.AT:
+            continue
+        if op is _regex_constants.SUBPATTERN and not av[1] and not av[2]:
+            inner = _regex_tail(av[3])
+            if inner:
+                return inner + list(items[position + 1:])
+            continue
+        return list(items[position:])
+    return []
+
+
+_REGEX_CONTAINER_OPS = frozenset(
+    getattr(_regex_constants, name)
+    for name in ("SUBPATTERN", "BRANCH", "MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT", "ATOMIC_GROUP", "GROUPREF_EXISTS")
+    if hasattr(_regex_constants, name)
+)
+
+
+def _regex_can_consume(items, char: str) -> bool:
+    """Whether any part of the parsed pattern may match char; unknown constructs answer True."""
+    code = ord(char)
+    for op, av in items:
+        if op is _regex_constants.LITERAL:
+            if av == code:
+                return True
+        elif op is _regex_constants.NOT_LITERAL:
+            if av != code:
+                return True
+        elif op is _regex_constants.IN:
+            for set_op, set_av in av:
+                if set_op is _regex_constants.LITERAL:
+                    if set_av == code:
+                        return True
+                elif set_op is _regex_constants.RANGE:
+                    if set_av[0] <= code <= set_av[1]:
+                        return True
+                else:
+                    return True
+        elif op is _regex_constants.AT or op is _regex_constants.ASSERT or op is _regex_constants.ASSERT_NOT:
+            continue
+        elif op in _REGEX_CONTAINER_OPS:
+            stack = [av]
+            while stack:
+                value = stack.pop()
+                if isinstance(value, _regex_parser.SubPattern):
+                    if _regex_can_consume(value, char):
+                        return True
+                elif isinstance(value, (tuple, list)):
+                    stack.extend(value)
+        else:
+            return True
+    return False
+
+
+_WORD_CHAR = re.compile(r"\w")
+_WORD_BOUNDARY_ASSERTIONS = frozenset((("at", _regex_constants.AT_BOUNDARY), ("at", _regex_constants.AT_NON_BOUNDARY)))
+
+
+def _is_word_char(char: str) -> bool:
+    return _WORD_CHAR.match(char) is not None
+
+
+def _regex_assertions(items) -> set:
+    """
+    Zero-width assertions in the parsed pattern, as ("at", code) and ("op", lookaround op)
+    pairs; the two code families share integer values, so they are never mixed bare.
+    """
+    found = set()
+    for op, av in items:
+        if op is _regex_constants.AT:
+            found.add(("at", av))
+        elif op is _regex_constants.ASSERT or op is _regex_constants.ASSERT_NOT:
+            found.add(("op", op))
+        stack = [av]
+        while stack:
+            value = stack.pop()
+            if isinstance(value, _regex_parser.SubPattern):
+                found |= _regex_assertions(value)
+            elif isinstance(value, (tuple, list)):
+                stack.extend(value)
+    return found
+
+
+class _RegexRuleShape:
+    """What the single-pass merge needs to know about one regex rule and its replacement."""
+
+    __slots__ = ("items", "prefix", "complete", "tail", "assertions", "starts_at_boundary", "ends_at_boundary",
+                 "segments", "has_groups", "keeps_word_edges")
+
+    def __init__(self, items, repl_str: str):
+        boundary = (_regex_constants.AT, _regex_constants.AT_BOUNDARY)
+        self.items = items
+        self.prefix, self.complete = _regex_literal_prefix(items)
+        self.tail = _regex_tail(items)
+        self.assertions = _regex_assertions(items)
+        self.starts_at_boundary = bool(items) and tuple(items[0]) == boundary
+        self.ends_at_boundary = self.complete and bool(items) and tuple(items[-1]) == boundary
+        pieces = _TEMPLATE_GROUP_REF.split(repl_str)
+        self.segments = [segment for segment in pieces if segment]
+        self.has_groups = len(pieces) > 1
+        # Whether the output keeps the word/non-word kind of the matched text at both edges,
+        # so \b and \B next to it test the same as in the original text.
+        self.keeps_word_edges = (
+            self.complete and bool(self.prefix) and pieces[0] != "" and pieces[-1] != ""
+            and _is_word_char(pieces[0][0]) == _is_word_char(self.prefix[0])
+            and _is_word_char(pieces[-1][-1]) == _is_word_char(self.prefix[-1])
+        )
+
+
+class _OverlapIndex:
+    """
+    Strings owned by rule indexes, answering whether any of them can begin at an
+    offset of a text and agree with it up to the shorter end, without comparing
+    every pair of rules. Flagged strings must start at a word boundary.
+    """
+
+    def __init__(self, entries):
+        entries = list(entries)
+        self.exact = {}
+        self.heads = {}
+        self.owners = {}
+        for string, owner, flagged in entries:
+            self.owners.setdefault(string, []).append(owner)
+            self._add(self.exact, string, owner, flagged)
+            for length in range(1, len(string)):
+                self._add(self.heads, string[:length], owner, flagged)
+        self.lengths = sorted({len(string) for string, _, _ in entries})
+
+    @staticmethod
+    def _add(table, key, owner, flagged):
+        # [earliest, latest, earliest unflagged, latest unflagged]
+        record = table.setdefault(key, [owner, owner, None, None])
+        record[0] = min(record[0], owner)
+        record[1] = max(record[1], owner)
+        if not flagged:
+            record[2] = owner if record[2] is None else min(record[2], owner)
+            record[3] = owner if record[3] is None else max(record[3], owner)
+
+    def overlaps(self, text, first_offset, before=None, after=None, at_boundary_only=lambda offset: False):
+        """
+        Whether a string owned by an index < before (or > after) agrees with text at
+        some offset >= first_offset; where at_boundary_only(offset) is true, flagged
+        strings cannot start there.
+        """
+        for offset in range(first_offset, len(text)):
+            rest = text[offset:]
+            records = [self.heads.get(rest), self.exact.get(rest)]
+            records.extend(self.exact.get(rest[:length]) for length in self.lengths if length < len(rest))
+            earliest, latest = (2, 3) if at_boundary_only(offset) else (0, 1)
+            for record in records:
+                if record is None:
+                    continue
+                if before is not None and record[earliest] is not None and record[earliest] < before:
+                    return True
+                if after is not None and record[latest] is not None and record[latest] > after:
+                    return True
+        return False
+
+    def occurring_in(self, text):
+        """Owners of the strings that occur in text."""
+        found = set()
+        for offset in range(len(text)):
+            for length in self.lengths:
+                if offset + length > len(text):
+                    break
+                found.update(self.owners.get(text[offset:offset + length], ()))
+        return found
+
+
+def _single_pass_conflicts(compiled, shapes) -> bool:
+    """
+    Whether one left-to-right scan could give a different result than applying the
+    rules in order. Each check asks whether a later-listed rule can see text that an
+    earlier rule changed, or reach over text an earlier rule would have replaced.
+    """
+    prefixes = _OverlapIndex((shape.prefix, index, shape.starts_at_boundary) for index, shape in enumerate(shapes))
+    segments = _OverlapIndex(
+        (segment, index, False) for index, shape in enumerate(shapes) for segment in shape.segments
+    )
+
+    # In sequential mode the earlier rule runs first, but in one scan a later rule
+    # matching from further left consumes the text the earlier rule would replace.
+    for later, shape in enumerate(shapes):
+        prefix = shape.prefix
+        same_kind = lambda offset: _is_word_char(prefix[offset - 1]) == _is_word_char(prefix[offset])
+        if prefixes.overlaps(prefix, 1, before=later, at_boundary_only=same_kind):
+            return True
+        # An earlier rule's output (or part of it) inside a later rule's literal start.
+        if segments.overlaps(prefix, 1, before=later):
+            return True
+
+    # Latest rule whose pattern continues past its literal start and can consume each char.
+    first_chars = {shape.prefix[0] for shape in shapes} | {segment[0] for shape in shapes for segment in shape.segments}
+    last_tail_consumer = {}
+    for index, shape in enumerate(shapes):
+        if shape.tail:
+            for char in first_chars:
+                if _regex_can_consume(shape.tail, char):
+                    last_tail_consumer[char] = index
+
+    later_tail = later_assertions = later_other_assertions = False
+    later_chars = set()
+    later_splits = set()
+    for earlier in range(len(shapes) - 1, -1, -1):
+        shape = shapes[earlier]
+        if earlier < len(shapes) - 1:
+            # Assertions in a later rule look at the neighbours of the earlier rule's output.
+            if later_other_assertions or (later_assertions and not shape.keeps_word_edges):
+                return True
+            if last_tail_consumer.get(shape.prefix[0], -1) > earlier:
+                return True
+            # A later rule may match across the edges of the earlier rule's output,
+            # or across the gap a deletion leaves, which the original text never offered.
+            if not shape.segments and not shape.has_groups:
+                if later_tail:
+                    return True
+                for before_kind, after_kind in later_splits:
+                    if shape.starts_at_boundary and before_kind == _is_word_char(shape.prefix[0]):
+                        continue
+                    if shape.ends_at_boundary and after_kind == _is_word_char(shape.prefix[-1]):
+                        continue
+                    return True
+            for segment in shape.segments:
+                same_kind = lambda offset: offset > 0 and _is_word_char(segment[offset - 1]) == _is_word_char(segment[offset])
+                if prefixes.overlaps(segment, 0, after=earlier, at_boundary_only=same_kind):
+                    return True
+                if last_tail_consumer.get(segment[0], -1) > earlier:
+                    return True
+            # Group references copy matched text into the output; a later rule may start in it.
+            if shape.has_groups and (later_tail or any(_regex_can_consume(shape.items, char) for char in later_chars)):
+                return True
+            # A later rule matching the earlier rule's output outright.
+            literal_output = "".join(shape.segments)
+            if any(compiled[later][0].search(literal_output) for later in prefixes.occurring_in(literal_output) if later > earlier):
+                return True
+
+        later_tail = later_tail or bool(shape.tail)
+        later_assertions = later_assertions or bool(shape.assertions)
+        later_other_assertions = later_other_assertions or bool(shape.assertions - _WORD_BOUNDARY_ASSERTIONS)
+        later_chars.update(shape.prefix)
+        later_splits.update(
+            (_is_word_char(shape.prefix[split - 1]), _is_word_char(shape.prefix[split])) for split in range(1, len(shape.prefix))
+        )
+    return False
+
+
+def _trie_regex(words) -> str:
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class _CombinedRegexRules:
+    """
+    Applies every regex rule in one left-to-right scan.
+    Each rule is indexed by the literal text its matches must start with; one
+    trie-shaped regex finds candidate positions, and only rules whose prefix is
+    present there are tried. At a position the first listed rule wins, and
+    replaced text is never rescanned.
+    """
+
+    def __init__(self, compiled, prefixes):
+        self.compiled = compiled
+        self.rules_by_prefix = {}
+        for index, prefix in enumerate(prefixes):
+            self.rules_by_prefix.setdefault(prefix, []).append(index)
+        self.scanner = _compile_regex(_trie_regex(self.rules_by_prefix), re.DOTALL)
+
+    @classmethod
+    def build(cls, compiled) -> Optional["_CombinedRegexRules"]:
+        if len(compiled) < 2:
+            return None
+
+        shapes = []
+        for pattern, repl_str in compiled:
+            if pattern.flags & (re.IGNORECASE | re.VERBOSE):
+                return None
+            try:
+                shape = _RegexRuleShape(_regex_parser.parse(pattern.pattern, pattern.flags), repl_str)
+            except (re.error, RecursionError):
+                return None
+            if not shape.prefix:
+                return None
+            shapes.append(shape)
+
+        if _single_pass_conflicts(compiled, shapes):
+            return None
+
+        return cls(compiled, [shape.prefix[:_PREFIX_TRIE_DEPTH] for shape in shapes])
+
+    def replace(self, text: str) -> Tuple[str, int]:
+        compiled, rules_by_prefix = self.compiled, self.rules_by_prefix
+        search = self.scanner.search
+        pieces = []
+        count = 0
+        last = 0
+        position = 0
+
+        while True:
+            candidate = search(text, position)
+            if candidate is None:
+                break
+            start = candidate.start()
+            found = candidate.group()
+            indexes = []
+            for length in range(1, len(found) + 1):
+                indexes.extend(rules_by_prefix.get(found[:length], ()))
+            if len(indexes) > 1:
+                indexes.sort()
+
+            for index in indexes:
+                pattern, repl_str = compiled[index]
+                match = pattern.match(text, start)
+                if match is not None:
+                    pieces.append(text[last:start])
+                    pieces.append(match.expand(repl_str) if "\\" in repl_str else repl_str)
+                    count += 1
+                    last = position = match.end()
+                    break
+            else:
+                position = start + 1
+
+        if not count:
+            return text, 0
+        pieces.append(text[last:])
+        return "".join(pieces), count
+
+
+class _ReplacementRuleSet:
+    """Parsed replacement_rules with their compiled regexes and literal automaton."""
+
+    def __init__(self, rules, use_regex: bool):
+        self.rules = rules
+        self.use_regex = use_regex
+        self.compiled = [(_compile_regex(find_str, re.DOTALL), repl_str) for find_str, repl_str in rules] if use_regex else []
+        self._automaton = None
+        self._folded_automaton = None
+        self._combined = _UNBUILT
+        self._tag_aliases = None
+
+    @property
+    def automaton(self) -> _LiteralAutomaton:
+        if self._automaton is None:
+            self._automaton = _LiteralAutomaton(self.rules)
+        return self._automaton
+
+    @property
+    def folded_automaton(self) -> _LiteralAutomaton:
+        """Automaton over casefolded find strings, for case-insensitive single pass."""
+        if self._folded_automaton is None:
+            self._folded_automaton = _LiteralAutomaton([(find_str.casefold(), repl_str) for find_str, repl_str in self.rules])
+        return self._folded_automaton
+
+    @property
+    def tag_aliases(self) -> Dict[str, List[str]]:
+        """Normalized tag -> replacement tags; the first rule for a tag wins."""
+        if self._tag_aliases is None:
+            aliases = {}
+            for find_str, repl_str in self.rules:
+                aliases.setdefault(_tag_key(find_str), [tag.strip() for tag in repl_str.split(",") if tag.strip()])
+            self._tag_aliases = aliases
+        return self._tag_aliases
+
+    @property
+    def combined(self) -> Optional["_CombinedRegexRules"]:
+        """Single-scan matcher over all regex rules, or None when they cannot be merged."""
+        if self._combined is _UNBUILT:
+            self._combined = _CombinedRegexRules.build(self.compiled)
+        return self._combined
+
+    def apply(self, text: str, batch_replace_mode: str, ignore_case: bool = False) -> Tuple[str, int]:
+        match_count = 0
+        if self.use_regex:
+            if batch_replace_mode == "single pass" and self.combined is not None:
+                return self.combined.replace(text)
+            for pattern, repl_str in self.compiled:
+                text, count = pattern.subn(repl_str, text)
+                match_count += count
+        elif batch_replace_mode == "single pass":
+            if self.rules and ignore_case:
+                text, match_count = self.folded_automaton.replace(text, _FoldedText(text))
+            elif self.rules:
+                text, match_count = self.automaton.replace(text)
+        elif ignore_case:
+            for find_str, repl_str in self.rules:
+                found, text = _FoldedText(text).scan(find_str, repl_str)
+                match_count += len(found)
+        else:
+            for find_str, repl_str in self.rules:
+                count = text.count(find_str)
+                if count:
+                    text = text.replace(find_str, repl_str)
+                    match_count += count
+        return text, match_count
+
+
+_RULE_SET_CACHE = _LRUCache(RULE_SET_CACHE_SIZE)
+
+
+def _get_rule_set(replacement_rules: str, use_regex: bool) -> _ReplacementRuleSet:
+    digest = hashlib.blake2b(replacement_rules.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    key = (digest, bool(use_regex), getattr(_regex_backend, "linear", False))
+    rule_set = _RULE_SET_CACHE.get(key)
+    if rule_set is None:
+        rule_set = _ReplacementRuleSet(_parse_replacement_rules(replacement_rules), bool(use_regex))
+        _RULE_SET_CACHE.put(key, rule_set)
+    return rule_set
+
+
+def rule_set_cache_info():
+    """Return hit/miss/size counters of the parsed replacement-rule cache."""
+    return _RULE_SET_CACHE.stats()
+
+
+def _parse_rule_file(path: str):
+    """Read find/replace pairs: tab-separated (.tsv), two CSV columns (.csv), or find -> replace lines."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if extension == ".txt":
+            return _parse_replacement_rules(f.read())
+        rows = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE) if extension == ".tsv" else csv.reader(f)
+        rules = []
+        for row in rows:
+            if len(row) < 2:
+                continue
+            find_str = row[0].strip()
+            if find_str:
+                rules.append((find_str, row[1].strip()))
+        return rules
+
+
+# Set inside the regex worker process, which cannot import folder_paths: the
+# rule directories of the parent process that sent the current request.
+_worker_rule_dirs = None
+
+
+def get_rule_dirs():
+    """Return rule-file search roots in precedence order: the ComfyUI user directory, then the plugin folder."""
+    if _worker_rule_dirs is not None:
+        return list(_worker_rule_dirs)
+    roots = []
+    try:
+        get_user_directory = getattr(import_module("folder_paths"), "get_user_directory", None)
+        if callable(get_user_directory) and get_user_directory():
+            roots.append(os.path.join(get_user_directory(), USER_RULES_SUBDIR))
+    except Exception:
+        pass
+    roots.append(PLUGIN_RULES_DIR)
+
+    unique_roots = []
+    for root in roots:
+        real_root = os.path.realpath(root)
+        if real_root not in unique_roots:
+            unique_roots.append(real_root)
+    return unique_roots
+
+
+def get_rule_files():
+    """List rule files in all rule directories as forward-slash names relative to their root."""
+    names = set()
+    for root_dir in get_rule_dirs():
+        for root, dirs, files in os.walk(root_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for file in files:
+                if file.lower().endswith(RULE_FILE_EXTENSIONS):
+                    names.add(os.path.relpath(os.path.join(root, file), root_dir).replace("\\", "/"))
+    return sorted(names)
+
+
+def resolve_rule_file(name: str) -> Optional[str]:
+    name = str(name).strip().replace("\\", "/")
+    parts = name.split("/")
+    if not name.lower().endswith(RULE_FILE_EXTENSIONS) or os.path.isabs(name) or any(part in {"", ".", ".."} for part in parts):
+        return None
+    for root in get_rule_dirs():
+        candidate = os.path.realpath(os.path.join(root, *parts))
+        # Rule file names come from the workflow; never read outside the rule directories.
+        try:
+            inside = os.path.commonpath([candidate, root]) == root
+        except ValueError:
+            inside = False
+        if inside and os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def _rule_file_stamp(path: str):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+_RULE_FILE_CACHE = _LRUCache(RULE_SET_CACHE_SIZE)
+
+
+def _get_file_rule_set(path: str, use_regex: bool) -> _ReplacementRuleSet:
+    """Parse and compile a rule file once; a changed mtime or size reloads it."""
+    stamp = _rule_file_stamp(path)
+    key = (path, bool(use_regex), getattr(_regex_backend, "linear", False))
+    entry = _RULE_FILE_CACHE.get(key)
+    if entry is None or entry[0] != stamp:
+        entry = (stamp, _ReplacementRuleSet(_parse_rule_file(path), bool(use_regex)))
+        _RULE_FILE_CACHE.put(key, entry)
+    return entry[1]
+
+
+def rule_file_cache_info():
+    """Return hit/miss/size counters of the compiled rule-file cache."""
+    return _RULE_FILE_CACHE.stats()
+
+
+def _match_text(match, groups: int) -> str:
+    # Same text re.findall would report: the full match, the only group, or all groups joined.
+    if groups == 0:
+        return match.group()
+    if groups == 1:
+        return match.group(1) or ""
+    return " | ".join(match.groups(""))
+
+
+def _split_matches(parts, groups: int):
+    stride = groups + 1
+    if groups <= 1:
+        found = parts[1::stride]
+        # Non-participating optional groups come back as None.
+        return [part or "" for part in found] if None in found else found
+    return [
+        " | ".join(part or "" for part in parts[index:index + groups])
+        for index in range(1, len(parts), stride)
+    ]
+
+
+def _regex_scan(compiled, text: str, replacement: str):
+    """
+    Scan text once with a compiled pattern.
+    Returns (findall-style match texts, text with every match replaced).
+    """
+    groups = compiled.groups
+    if "\\" not in replacement:
+        splitter = compiled
+        if groups == 0:
+            # A capture around the whole pattern makes split() return the matches too.
+            try:
+                splitter = _compile_regex(f"({compiled.pattern})", compiled.flags)
+                groups_in_split = 1
+            except re.error:
+                splitter = None
+        else:
+            groups_in_split = groups
+
+        if splitter is not None:
+            parts = splitter.split(text)
+            if len(parts) == 1:
+                return [], text
+            return _split_matches(parts, groups_in_split), replacement.join(parts[0::groups_in_split + 1])
+
+    # match.expand() only sees the template when something matches; validate it
+    # up front so an invalid group reference is an error for every input.
+    _compile_python_regex(compiled.pattern, compiled.flags).sub(replacement, "")
+    found = []
+    pieces = []
+    last = 0
+    for match in compiled.finditer(text):
+        found.append(_match_text(match, groups))
+        pieces.append(text[last:match.start()])
+        pieces.append(match.expand(replacement))
+        last = match.end()
+    if not found:
+        return found, text
+    pieces.append(text[last:])
+    return found, "".join(pieces)
+
+
+def _literal_scan(text: str, pattern: str, replacement: str) -> Tuple[int, str]:
+    """Count and replace a literal pattern with one scan of text."""
+    parts = text.split(pattern)
+    if len(parts) == 1:
+        return 0, text
+    return len(parts) - 1, replacement.join(parts)
+
+
+@lru_cache(maxsize=1)
+def _fold_expanding_chars() -> "re.Pattern[str]":
+    """Characters whose casefold() is longer than one character, such as 'ß' -> 'ss'."""
+    chars = [char for char in map(chr, range(sys.maxunicode + 1)) if len(char.casefold()) != 1]
+    return re.compile("[" + re.escape("".join(chars)) + "]")
+
+
+class _FoldedText:
+    """
+    Casefolded view of a text for case-insensitive literal matching.
+    Matches are located in the folded copy and mapped back to offsets in the
+    original, so results keep the original casing. Offsets are identical
+    unless a character folds to several (ß -> ss); a match that starts or
+    ends inside such an expansion is not a match in the original text.
+    """
+
+    __slots__ = ("text", "folded", "_fold_starts", "_orig_starts", "_shifts")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.folded = folded = text.casefold()
+        self._fold_starts = None
+        if len(folded) != len(text):
+            # For every expanding character: its folded offset, original offset,
+            # and the folded-minus-original shift after it.
+            fold_starts, orig_starts, shifts = [], [], []
+            shift = 0
+            for match in _fold_expanding_chars().finditer(text):
+                index = match.start()
+                fold_starts.append(index + shift)
+                orig_starts.append(index)
+                shift += len(match.group().casefold()) - 1
+                shifts.append(shift)
+            self._fold_starts, self._orig_starts, self._shifts = fold_starts, orig_starts, shifts
+
+    def to_original(self, offset: int) -> int:
+        """Original offset of a folded offset, or -1 inside an expanded character."""
+        if self._fold_starts is None:
+            return offset
+        k = bisect.bisect_right(self._fold_starts, offset) - 1
+        if k < 0:
+            return offset
+        start = self._fold_starts[k]
+        if offset == start:
+            return self._orig_starts[k]
+        if offset < start + self._shifts[k] - (self._shifts[k - 1] if k else 0) + 1:
+            return -1
+        return offset - self._shifts[k]
+
+    def to_folded(self, offset: int) -> int:
+        if self._fold_starts is None:
+            return offset
+        k = bisect.bisect_left(self._orig_starts, offset) - 1
+        return offset + (self._shifts[k] if k >= 0 else 0)
+
+    def spans(self, pattern: str, start_from: int = 0):
+        """Yield original (start, end) of non-overlapping case-insensitive matches."""
+        needle = pattern.casefold()
+        folded, size = self.folded, len(needle)
+        position = self.to_folded(start_from)
+        while True:
+            index = folded.find(needle, position)
+            if index == -1:
+                return
+            start, end = self.to_original(index), self.to_original(index + size)
+            if start == -1 or end == -1:
+                position = index + 1
+                continue
+            yield start, end
+            position = index + size if size else index + 1
+
+    def find(self, pattern: str, start_from: int = 0) -> Tuple[int, int]:
+        return next(self.spans(pattern, start_from), (-1, -1))
+
+    def scan(self, pattern: str, replacement: str) -> Tuple[List[str], str]:
+        """Original-case matches of pattern and the text with each one replaced, in one pass."""
+        text = self.text
+        found, pieces = [], []
+        last = 0
+        for start, end in self.spans(pattern):
+            found.append(text[start:end])
+            pieces.append(text[last:start])
+            last = end
+        if not found:
+            return found, text
+        pieces.append(text[last:])
+        return found, replacement.join(pieces)
+
+
+_JSON_OPENERS = re.compile(r"[{\[]")
+_JSON_STRUCTURE = re.compile(r'[{}\[\]"]')
+_JSON_STRING_END = re.compile(r'["\\\n]')
+_JSON_CLOSERS = {"}": "{", "]": "["}
+
+
+def _scan_json_spans(text: str):
+    """
+    Find balanced {...} and [...] blocks in one left-to-right scan.
+    Brackets inside JSON strings are ignored. Returns top-level
+    (start, end, children) spans; children holds the nested spans one level down.
+    A mismatched bracket, or a newline inside a string, abandons the open blocks
+    and keeps the complete blocks found inside them.
+    """
+    spans = []
+    stack = []  # (opener, start, children)
+
+    def abandon():
+        for _, _, children in stack:
+            spans.extend(children)
+        stack.clear()
+
+    position = 0
+    length = len(text)
+    while position < length:
+        if not stack:
+            match = _JSON_OPENERS.search(text, position)
+            if match is None:
+                break
+            stack.append((match.group(), match.start(), []))
+            position = match.end()
+            continue
+
+        match = _JSON_STRUCTURE.search(text, position)
+        if match is None:
+            break
+        char = match.group()
+        position = match.end()
+        if char == '"':
+            while True:
+                end = _JSON_STRING_END.search(text, position)
+                if end is None or end.group() == "\n":
+                    abandon()
+                    position = length if end is None else end.end()
+                    break
+                position = end.end()
+                if end.group() == '"':
+                    break
+                position += 1  # Skip the escaped character.
+        elif char in _JSON_CLOSERS:
+            if stack[-1][0] != _JSON_CLOSERS[char]:
+                abandon()
+                continue
+            _, start, children = stack.pop()
+            (stack[-1][2] if stack else spans).append((start, position, children))
+        else:
+            stack.append((char, match.start(), []))
+
+    abandon()
+    return spans
+
+
+def _reject_json_constant(name):
+    raise ValueError(f"{name} is not valid JSON")
+
+
+def _is_valid_json(candidate: str) -> bool:
+    if _orjson is not None:
+        try:
+            _orjson.loads(candidate)
+            return True
+        except ValueError:
+            pass  # orjson is stricter about a few inputs json accepts; let json decide.
+    try:
+        json.loads(candidate, parse_constant=_reject_json_constant)
+        return True
+    except (ValueError, RecursionError):
+        return False
+
+
+def _extract_json_blocks(text: str, validate: bool):
+    """Return (start, end) of every top-level JSON block; invalid blocks are replaced by their valid children."""
+    blocks = []
+    pending = list(reversed(_scan_json_spans(text)))
+    while pending:
+        start, end, children = pending.pop()
+        if not validate or _is_valid_json(text[start:end]):
+            blocks.append((start, end))
+        else:
+            pending.extend(reversed(children))
+    return blocks
+
+
+_MARKDOWN_MARKERS = re.compile(r"[`~#\[*_]")
+_MARKDOWN_FENCE = re.compile(
+    r"(`{3,}|~{3,})[^`\n]*(?:\n|\Z)((?s:.*?))(?:^[ \t]*\1[ \t]*(?:\n|\Z)|\Z)", re.MULTILINE
+)
+# "](destination)" with an optional "title": the destination is <anything on the line>,
+# or free of spaces with at most one level of balanced parentheses.
+_MARKDOWN_LINK_DESTINATION = (
+    r"\]\((?:<[^<>\n]*>|(?:[^()\s]|\([^()\s]*\))*)"
+    r"""(?:[ \t]+(?:"[^"\n]*"|'[^'\n]*'|\([^()\n]*\)))?[ \t]*\)"""
+)
+_MARKDOWN_LINK_TEXT = re.compile(r"[^\[\]\n]*" + _MARKDOWN_LINK_DESTINATION)
+_MARKDOWN_LINK_END = re.compile(_MARKDOWN_LINK_DESTINATION)
+# One token per marker run or construct; every branch starts with a literal so the regex
+# engine can skip the plain text between tokens. Emphasis that opens after a space and
+# closes after a letter or digit, with no other markers inside, pairs under the flanking
+# rules no matter what came before, so it is matched whole, as are links with plain text
+# and single-backtick code spans. Runs that can never open or close are not tokens: stars
+# with spaces on both sides (2 * 3) and underscores between letters or digits (snake_case).
+_MARKDOWN_TOKENS = re.compile(
+    r"\*(?<!\S\*)(?P<stars>\**)(?!\s)(?P<starred>[^*_`\[\]\n]*?[^\W_])\*(?P=stars)(?![\w*])"
+    r"|_(?<!\S_)(?P<underscores>_*)(?!\s)(?P<underscored>[^*_`\[\]\n]*?[^\W_])_(?P=underscores)(?![\w*])"
+    r"|`(?<!``)(?!`)(?P<code>[^`\n]+)`(?!`)"
+    r"|\*(?<!\*\*)\**(?![\s*])|\*(?<![\s*]\*)\**|_(?<!\w_)_*|__*(?!\w)|``*|~~~~*|##*[ \t]+"
+    r"|!\[(?P<alt>[^\[\]\n*_`]*)" + _MARKDOWN_LINK_DESTINATION +
+    r"|\[(?P<label>[^\[\]\n*_`]*)" + _MARKDOWN_LINK_DESTINATION + r"|\[|\]"
+)
+
+
+_MARKDOWN_SPACE, _MARKDOWN_PUNCTUATION, _MARKDOWN_WORD = 0, 1, 2
+_markdown_char_classes = {}
+
+
+def _markdown_char_class(char: str) -> int:
+    char_class = _markdown_char_classes.get(char)
+    if char_class is None:
+        if char.isspace():
+            char_class = _MARKDOWN_SPACE
+        elif char.isalnum():
+            char_class = _MARKDOWN_WORD
+        else:
+            char_class = _MARKDOWN_PUNCTUATION
+        if len(_markdown_char_classes) < 4096:
+            _markdown_char_classes[char] = char_class
+    return char_class
+
+
+def _find_code_span_end(text: str, position: int, ticks: str, line_end: int) -> int:
+    """Index of the backtick run of exactly len(ticks) closing an inline code span on this line, or -1."""
+    size = len(ticks)
+    while True:
+        index = text.find(ticks, position, line_end)
+        if index < 0:
+            return -1
+        run_end = index + size
+        while run_end < line_end and text[run_end] == "`":
+            run_end += 1
+        if run_end - index == size:
+            return index
+        position = run_end
+
+
+def _clean_markdown(text: str, keep_code: bool) -> str:
+    """
+    Strip markdown formatting in one scan: headings, links, code, and emphasis.
+    Emphasis delimiters are removed only when they pair up, using CommonMark's
+    flanking rules, so snake_case names, *args, and "a * b" are left alone.
+    Code is copied verbatim: fenced blocks and inline spans lose their fences,
+    or are kept whole with keep_code.
+    """
+    if _MARKDOWN_MARKERS.search(text) is None:
+        return text
+
+    pieces = []
+    runs = []  # [piece index, run length, delimiters removed]
+    star_openers = []  # [run, delimiters still unmatched]
+    underscore_openers = []
+    open_links = 0
+    last = position = 0
+    length = len(text)
+    line_end = -1  # End of the line holding the last code span checked.
+
+    def emit(start):
+        nonlocal open_links
+        gap = text[last:start]
+        if "\n\n" in gap:
+            # Emphasis and links never span a blank line.
+            star_openers.clear()
+            underscore_openers.clear()
+            open_links = 0
+        pieces.append(gap)
+
+    # Each search resumes after whatever the last token consumed (code, a link destination).
+    search = _MARKDOWN_TOKENS.search
+    token = search(text)
+    while token is not None:
+        start, end = token.span()
+        char = text[start]
+        position = end
+        kind = token.lastgroup
+
+        if kind is not None:
+            # Paired emphasis, a plain link or image, or a code span matched whole.
+            emit(start)
+            last = end
+            pieces.append(text[start:end] if kind == "code" and keep_code else token.group(kind))
+
+        elif char == "*" or char == "_":
+            emit(start)
+            last = end
+
+            # CommonMark flanking rules decide whether the run can open and/or close emphasis.
+            before = _markdown_char_class(text[start - 1]) if start else _MARKDOWN_SPACE
+            after = _markdown_char_class(text[end]) if end < length else _MARKDOWN_SPACE
+            left = after != _MARKDOWN_SPACE and (after == _MARKDOWN_WORD or before != _MARKDOWN_WORD)
+            right = before != _MARKDOWN_SPACE and (before == _MARKDOWN_WORD or after != _MARKDOWN_WORD)
+            if char == "_":
+                can_open = left and (not right or before == _MARKDOWN_PUNCTUATION)
+                can_close = right and (not left or after == _MARKDOWN_PUNCTUATION)
+                stack = underscore_openers
+            else:
+                can_open, can_close = left, right
+                stack = star_openers
+
+            unmatched = end - start
+            run = [len(pieces), unmatched, 0]
+            runs.append(run)
+            pieces.append(text[start:end])
+            if can_close:
+                while unmatched and stack:
+                    opener = stack[-1]
+                    used = min(opener[1], unmatched)
+                    opener[0][2] += used
+                    opener[1] -= used
+                    run[2] += used
+                    unmatched -= used
+                    if not opener[1]:
+                        stack.pop()
+            if can_open and unmatched:
+                stack.append([run, unmatched])
+
+        elif char == "`" or char == "~":
+            fence = None
+            if end - start >= 3:
+                # Only the gap since the last token can hold this line's indentation.
+                line_start = text.rfind("\n", last, start) + 1 or last
+                if (not line_start or text[line_start - 1] == "\n") and not text[line_start:start].strip(" \t"):
+                    fence = _MARKDOWN_FENCE.match(text, start)
+            if fence is not None:
+                emit(line_start)
+                last = position = fence.end()
+                star_openers.clear()
+                underscore_openers.clear()
+                pieces.append(text[line_start:position] if keep_code else fence.group(2))
+            elif char == "`":
+                if line_end < end:
+                    line_end = text.find("\n", end)
+                    if line_end < 0:
+                        line_end = length
+                close = _find_code_span_end(text, end, text[start:end], line_end)
+                if close >= 0:
+                    emit(start)
+                    last = position = close + end - start
+                    pieces.append(text[start:position] if keep_code else text[end:close])
+
+        elif char == "#":
+            if not start or text[start - 1] == "\n":
+                emit(start)
+                last = end
+                star_openers.clear()
+                underscore_openers.clear()
+
+        elif char == "[":
+            if _MARKDOWN_LINK_TEXT.match(text, end):
+                if start > last and text[start - 1] == "!":
+                    start -= 1
+                emit(start)
+                last = end
+                open_links += 1
+
+        elif open_links:  # "]"
+            link_end = _MARKDOWN_LINK_END.match(text, start)
+            if link_end is not None and text.find("\n\n", last, start) < 0:
+                emit(start)
+                last = position = link_end.end()
+                open_links -= 1
+
+        token = search(text, position)
+
+    pieces.append(text[last:])
+    for index, run_length, removed in runs:
+        if removed:
+            pieces[index] = pieces[index][:run_length - removed]
+    return "".join(pieces)
+
+
+_TAG_OPENERS = "([{"
+_TAG_CLOSERS = ")]}"
+_TAG_WEIGHT = re.compile(r":\s*[-+]?(?:\d+(?:\.\d*)?|\.\d+)\s*$")
+
+
+def _tag_key(tag: str) -> str:
+    """Comparison form of a tag: case-folded, underscores as spaces, whitespace collapsed."""
+    return " ".join(tag.replace("_", " ").split()).casefold()
+
+
+def _split_prompt_tags(text: str) -> List[str]:
+    """Split on commas, keeping a comma inside an open (group), [group], or {group} in its tag."""
+    pieces = text.split(",")
+    if not any(opener in text for opener in _TAG_OPENERS):
+        return pieces
+
+    tags = []
+    pending = None
+    depth = 0
+    for piece in pieces:
+        if pending is None and "(" not in piece and "[" not in piece and "{" not in piece:
+            tags.append(piece)
+            continue
+        pending = piece if pending is None else f"{pending},{piece}"
+        depth += sum(piece.count(opener) for opener in _TAG_OPENERS) - sum(piece.count(closer) for closer in _TAG_CLOSERS)
+        if "\\" in piece:
+            # Escaped brackets such as "artist \(style\)" never open or close a group.
+            depth -= sum(piece.count("\\" + opener) for opener in _TAG_OPENERS)
+            depth += sum(piece.count("\\" + closer) for closer in _TAG_CLOSERS)
+        if depth <= 0:
+            tags.append(pending)
+            pending = None
+            depth = 0
+    if pending is not None:
+        tags.append(pending)
+    return tags
+
+
+def _split_tag_weight(tag: str) -> Tuple[str, str, str]:
+    """Split "((tag:1.2))" into ("((", "tag", ":1.2))"); a bare tag has empty wrappers."""
+    opened = len(tag) - len(tag.lstrip(_TAG_OPENERS))
+    if not opened:
+        return "", tag, ""
+    closed = 0
+    end = len(tag)
+    while closed < opened and end > opened and tag[end - 1] in _TAG_CLOSERS and tag[end - 2] != "\\":
+        closed += 1
+        end -= 1
+    if not closed:
+        return "", tag, ""
+    core = tag[closed:end]
+    weight = _TAG_WEIGHT.search(core)
+    if weight is not None:
+        return tag[:closed], core[:weight.start()], core[weight.start():] + tag[end:]
+    return tag[:closed], core, tag[end:]
+
+
+def _normalize_prompt_tags(text: str, blacklist: str, alias_sets, sort: bool) -> Tuple[str, str, int]:
+    """
+    Rewrite a comma-separated tag prompt in one pass over its tags.
+    Aliases are applied first, then blacklisted and repeated tags are dropped;
+    weights and brackets stay on the surviving tag.
+    Returns (kept tags, dropped tags, number of dropped tags), the tags joined with ", ".
+    """
+    blocked = {_tag_key(tag) for tag in blacklist.split(",")}
+    blocked.discard("")
+    kept = []
+    dropped = []
+    seen = set()
+
+    for raw in _split_prompt_tags(text):
+        tag = raw.strip()
+        if not tag:
+            continue
+        prefix, core, suffix = _split_tag_weight(tag) if tag[0] in _TAG_OPENERS else ("", tag, "")
+        key = _tag_key(core)
+        cores = None
+        for aliases in alias_sets:
+            cores = aliases.get(key)
+            if cores is not None:
+                break
+        if cores is None:
+            entries = ((key, tag),)
+        elif not cores:
+            dropped.append(tag)
+            continue
+        else:
+            entries = [(_tag_key(alias), f"{prefix}{alias}{suffix}") for alias in cores]
+
+        for key, tag in entries:
+            if key in blocked or key in seen:
+                dropped.append(tag)
+            else:
+                seen.add(key)
+                kept.append((key, tag))
+
+    if sort:
+        kept.sort(key=lambda item: item[0])
+    return ", ".join(tag for _, tag in kept), ", ".join(dropped), len(dropped)
+
+
+# str.translate only has a fast path for ASCII text and a fixed setup cost, so
+# it pays off for long ASCII texts. Whitespace removal on ASCII text goes through
+# bytes.translate, whose 256-byte table beats str.split() per line at any size.
+_DELETE_NEWLINES = str.maketrans("", "", "\r\n")
+_ASCII_LINE_BREAKS = b"\x0b\x0c\r\x1c\x1d\x1e"
+_ASCII_BREAKS_TO_NEWLINE = bytes.maketrans(_ASCII_LINE_BREAKS, b"\n" * len(_ASCII_LINE_BREAKS))
+_ASCII_INLINE_WHITESPACE = b"\t\x1f "
+
+
+def _remove_newlines(text: str) -> str:
+    if len(text) >= TRANSLATE_MIN_CHARS and text.isascii():
+        return text.translate(_DELETE_NEWLINES)
+    return text.replace("\r", "").replace("\n", "")
+
+
+def _remove_whitespace(text: str) -> str:
+    """Delete all whitespace but line breaks; same result as joining line.split() per splitlines() line."""
+    if not text.isascii():
+        return "\n".join(map("".join, map(str.split, text.splitlines())))
+    if "\r\n" in text:
+        text = text.replace("\r\n", "\n")
+    processed = text.encode("ascii").translate(_ASCII_BREAKS_TO_NEWLINE, _ASCII_INLINE_WHITESPACE).decode("ascii")
+    # splitlines() yields no empty line after a trailing break.
+    if text and text[-1] in "\n\x0b\x0c\r\x1c\x1d\x1e":
+        processed = processed[:-1]
+    return processed
+
+
+def _strip_lines(text: str) -> str:
+    return "\n".join(map(str.strip, text.splitlines()))
+
+
+def _remove_empty_lines(text: str) -> str:
+    return "\n".join(filter(str.strip, text.splitlines()))
+
+
+def _normalize_whitespace(text: str) -> str:
+    """Trim every line, collapse whitespace runs to one space, and drop blank lines in one pass."""
+    return "\n".join(filter(None, map(" ".join, map(str.split, text.splitlines()))))
+
+
+_LINE_CLEANERS = {
+    "strip lines (trim)": _strip_lines,
+    "remove empty lines": _remove_empty_lines,
+    "remove all whitespace (keep newlines)": _remove_whitespace,
+    "normalize whitespace (trim, collapse spaces, remove empty lines)": _normalize_whitespace,
+}
+STREAM_LINE_OPERATIONS = tuple(_LINE_CLEANERS)
+STREAM_LITERAL_OPERATIONS = (
+    "find and remove (use optional_text)",
+    "find and replace (use optional_text, replace_with_text)",
+)
+
+
+def _iter_text_chunks(pieces, chunk_size: int, line_aligned: bool):
+    """
+    Yield the concatenation of pieces as consecutive chunks of about chunk_size.
+    With line_aligned, every chunk but the last ends right after a newline, so
+    splitlines() and lower() give the same result per chunk as on the whole text.
+    """
+    pending = ""
+    for piece in pieces:
+        start, length = 0, len(piece)
+        while start < length:
+            window_end = start + max(chunk_size - len(pending), 1)
+            if window_end >= length:
+                pending += piece[start:]
+                break
+            cut = window_end
+            if line_aligned:
+                cut = piece.rfind("\n", start, window_end) + 1 or piece.find("\n", window_end) + 1
+                if not cut:
+                    pending += piece[start:]
+                    break
+            yield pending + piece[start:cut]
+            pending = ""
+            start = cut
+    if pending:
+        yield pending
+
+
+def _stream_literal_replace(chunks, pattern: str, replacement: str, counts: list):
+    """Replace pattern across chunks; counts receives the number of replacements when the stream ends."""
+    # A match can straddle a chunk boundary only within the last len(pattern) - 1 unmatched characters.
+    keep = len(pattern) - 1
+    carry = ""
+    count = 0
+    for chunk in chunks:
+        parts = (carry + chunk).split(pattern)
+        count += len(parts) - 1
+        tail = parts[-1]
+        cut = max(len(tail) - keep, 0)
+        carry = tail[cut:]
+        parts[-1] = tail[:cut]
+        yield replacement.join(parts)
+    yield carry
+    counts.append(count)
+
+
+def _uses_user_regex(operation: str) -> bool:
+    return (
+        operation == "batch replace (use replacement_rules)"
+        or operation.startswith("find")
+        or "start text" in operation
+        or "between" in operation
+    )
+
+
+def _read_worker_responses(stream, responses: "queue.Queue"):
+    try:
+        while True:
+            responses.put(pickle.load(stream))
+    except Exception:  # EOF: the worker exited or was killed.
+        responses.put(None)
+
+
+class _RegexWorker:
+    """
+    Reusable child process that runs guarded regex operations.
+    Regex matching cannot be interrupted inside a thread, so a request that
+    exceeds its time budget kills the child; the next request starts a new one.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.starts = 0
+        self._process = None
+        self._responses = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--regex-worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        self._responses = queue.Queue()
+        threading.Thread(
+            target=_read_worker_responses,
+            args=(self._process.stdout, self._responses),
+            daemon=True,
+        ).start()
+        self.starts += 1
+        try:
+            ready = self._responses.get(timeout=REGEX_WORKER_START_TIMEOUT)
+        except queue.Empty:
+            ready = None
+        if ready != ("ready",):
+            self._stop()
+            raise RuntimeError("[AdvancedTextFilter] regex worker failed to start")
+
+    def _stop(self):
+        process, self._process = self._process, None
+        if process is not None:
+            process.kill()
+            process.wait()
+            process.stdin.close()
+            process.stdout.close()
+
+    def run(self, options: dict, timeout: float) -> Tuple[Tuple[str, str], int]:
+        """Return the node outputs for options and the match count the worker recorded for them."""
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self._start()
+            self.calls += 1
+            try:
+                pickle.dump((options, get_rule_dirs()), self._process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+                self._process.stdin.flush()
+            except OSError:
+                self._stop()
+                raise RuntimeError("[AdvancedTextFilter] regex worker exited unexpectedly")
+
+            try:
+                response = self._responses.get(timeout=timeout)
+            except queue.Empty:
+                self.timeouts += 1
+                self._stop()
+                raise _RegexTimeout(f"Regex did not finish within {timeout:g}s and was stopped")
+            if response is None:
+                self._stop()
+                raise RuntimeError("[AdvancedTextFilter] regex worker exited unexpectedly")
+
+        status, payload = response
+        if status == "error":
+            raise _IntentionalFilterError(payload)
+        return payload
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "timeouts": self.timeouts,
+                "starts": self.starts,
+                "running": self._process is not None and self._process.poll() is None,
+            }
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+
+_REGEX_WORKER = _RegexWorker()
+_missing_re2_warned = False
+
+
+def _warn_missing_re2():
+    global _missing_re2_warned
+    if not _missing_re2_warned:
+        _missing_re2_warned = True
+        print("[AdvancedTextFilter] regex_engine 're2' requested but the re2 package is not installed; using Python re")
+
+
+def regex_worker_info():
+    """Return call/timeout/start counters of the guarded-regex worker process."""
+    return _REGEX_WORKER.stats()
+
+
+def _regex_worker_main():
+    global _worker_rule_dirs
+    requests, responses = sys.stdin.buffer, sys.stdout.buffer
+    sys.stdout = sys.stderr  # Node log lines must not corrupt the response stream.
+
+    def send(message):
+        pickle.dump(message, responses, protocol=pickle.HIGHEST_PROTOCOL)
+        responses.flush()
+
+    send(("ready",))
+    node = AdvancedTextFilter()
+    while True:
+        try:
+            options, _worker_rule_dirs = pickle.load(requests)
+        except EOFError:
+            return
+        # This process's counters are never read otherwise; reset them so they hold just this call.
+        _OPERATION_STATS.clear()
+        try:
+            result = node.process(**options)
+            send(("ok", (result, sum(entry["matches"] for entry in _OPERATION_STATS.stats().values()))))
+        except _IntentionalFilterError as e:
+            send(("error", str(e)))
+
+
+class _OperationStats:
+    """Process-wide per-operation call counts, input sizes, match counts, and timings."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation: str, input_chars: int, matches: int, seconds: float):
+        with self._lock:
+            entry = self._entries.get(operation)
+            if entry is None:
+                entry = self._entries[operation] = {
+                    "calls": 0,
+                    "input_chars": 0,
+                    "matches": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "max_input_chars": 0,
+                }
+            entry["calls"] += 1
+            entry["input_chars"] += input_chars
+            entry["matches"] += matches
+            entry["total_seconds"] += seconds
+            if seconds > entry["max_seconds"]:
+                entry["max_seconds"] = seconds
+                entry["max_input_chars"] = input_chars
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {operation: dict(entry) for operation, entry in self._entries.items()}
+
+
+_OPERATION_STATS = _OperationStats()
+
+
+def operation_stats():
+    """Return per-operation counters: calls, input_chars, matches, total/max seconds, and the input size of the slowest call."""
+    return _OPERATION_STATS.stats()
+
+
+def reset_operation_stats():
+    _OPERATION_STATS.clear()
+
+
+def dump_operation_stats() -> str:
+    """Return the operation counters as JSON, slowest operation first."""
+    stats = sorted(_OPERATION_STATS.stats().items(), key=lambda item: item[1]["total_seconds"], reverse=True)
+    return json.dumps(dict(stats), indent=2)
+
+
+class _FilterRequest:
+    """Prepared inputs of one AdvancedTextFilter call, shared by the operation handlers."""
+
+    __slots__ = (
+        "text", "operation", "start_text", "end_text", "optional_text_input", "replace_with_text",
+        "use_regex", "if_not_found", "replacement_rules", "batch_replace_mode", "rules_file", "ignore_case",
+        "matches",
+    )
+
+    def __init__(self, operation, if_not_found, start_text, end_text, optional_text_input, replace_with_text,
+                 use_regex, replacement_rules, batch_replace_mode, rules_file, ignore_case=False):
+        self.text = ""
+        self.operation = operation
+        self.if_not_found = if_not_found
+        self.start_text = start_text
+        self.end_text = end_text
+        self.optional_text_input = optional_text_input
+        self.replace_with_text = replace_with_text
+        self.use_regex = use_regex
+        self.replacement_rules = replacement_rules
+        self.batch_replace_mode = batch_replace_mode
+        self.rules_file = rules_file
+        # Case-insensitive matching applies to literal search only; regex patterns use (?i).
+        self.ignore_case = bool(ignore_case) and not use_regex
+        self.matches = 0
+
+    def not_found(self, original: str, reason: str) -> Tuple[str, str]:
+        if self.if_not_found == "trigger error":
+            raise _IntentionalFilterError(f"[AdvancedTextFilter] {reason}")
+        # Extracting operations return nothing as their target; the others pass the text through.
+        operation = self.operation
+        if "extract" in operation or "find all" in operation or "LLM" in operation:
+            return ("", original)
+        return (original, "")
+
+    def rules_path(self) -> Optional[str]:
+        """Resolved rules_file path; raises _RulesFileMissing when a selected file cannot be found."""
+        if not self.rules_file or self.rules_file == NO_RULES_FILE:
+            return None
+        path = resolve_rule_file(self.rules_file)
+        if path is None:
+            raise _RulesFileMissing(f"Rules file '{self.rules_file}' not found")
+        return path
+
+
+class _RulesFileMissing(Exception):
+    pass
+
+
+_OPERATION_HANDLERS = {}
+
+
+def _operation(*names):
+    """Register a handler for one or more OPERATION_MODES entries."""
+    def register(handler):
+        for name in names:
+            _OPERATION_HANDLERS[name] = handler
+        return handler
+    return register
+
+
+@_operation("batch replace (use replacement_rules)")
+def _run_batch_replace(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    rule_sets = []
+    try:
+        rules_path = request.rules_path()
+    except _RulesFileMissing as e:
+        return request.not_found(text, str(e))
+    if rules_path is not None:
+        rule_sets.append(_get_file_rule_set(rules_path, request.use_regex))
+    if request.replacement_rules:
+        rule_sets.append(_get_rule_set(request.replacement_rules, request.use_regex))
+    if not rule_sets:
+        return request.not_found(text, "No replacement rules provided")
+
+    processed, match_count = text, 0
+    for rule_set in rule_sets:
+        processed, count = rule_set.apply(processed, request.batch_replace_mode, request.ignore_case)
+        match_count += count
+
+    request.matches = match_count
+    if match_count == 0:
+        return request.not_found(text, "No batch rules matched")
+    return (processed, "")
+
+
+@_operation(
+    "tags: clean (dedupe, remove optional_text, alias replacement_rules)",
+    "tags: clean and sort (dedupe, remove optional_text, alias replacement_rules)",
+)
+def _run_clean_tags(request: _FilterRequest) -> Tuple[str, str]:
+    # Inline aliases take precedence over the rules file.
+    alias_sets = []
+    if request.replacement_rules:
+        alias_sets.append(_get_rule_set(request.replacement_rules, False).tag_aliases)
+    try:
+        rules_path = request.rules_path()
+    except _RulesFileMissing as e:
+        return request.not_found(request.text, str(e))
+    if rules_path is not None:
+        alias_sets.append(_get_file_rule_set(rules_path, False).tag_aliases)
+    processed, dropped, request.matches = _normalize_prompt_tags(
+        request.text, request.optional_text_input, alias_sets, sort="sort" in request.operation
+    )
+    return (processed, dropped)
+
+
+@_operation(*_LINE_CLEANERS)
+def _run_line_cleanup(request: _FilterRequest) -> Tuple[str, str]:
+    return (_LINE_CLEANERS[request.operation](request.text), "")
+
+
+@_operation("remove newlines")
+def _run_remove_newlines(request: _FilterRequest) -> Tuple[str, str]:
+    return (_remove_newlines(request.text), "")
+
+
+@_operation("LLM: extract code block (```)")
+def _run_extract_code_block(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    pattern = _compile_regex(r"```[\w]*\n?(.*?)```", re.DOTALL)
+    matches = pattern.findall(text)
+    request.matches = len(matches)
+    if not matches:
+        return request.not_found(text, "No code blocks found")
+
+    extracted_code = "\n\n".join(matches)
+    remaining = pattern.sub("", text)
+    return (extracted_code.strip(), remaining.strip())
+
+
+@_operation("LLM: extract JSON object ({...})")
+def _run_extract_json_object(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    start_idx = text.find("{")
+    end_idx = text.rfind("}")
+    if start_idx == -1 or end_idx == -1 or end_idx < start_idx:
+        return request.not_found(text, "No valid JSON brackets found")
+    request.matches = 1
+    return (text[start_idx:end_idx + 1], text[:start_idx] + text[end_idx + 1:])
+
+
+@_operation("LLM: extract all JSON ({...} / [...])", "LLM: extract all valid JSON ({...} / [...])")
+def _run_extract_all_json(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    blocks = _extract_json_blocks(text, validate="valid" in request.operation)
+    request.matches = len(blocks)
+    if not blocks:
+        return request.not_found(text, "No JSON objects or arrays found")
+
+    remaining_parts = []
+    last = 0
+    for start, end in blocks:
+        remaining_parts.append(text[last:start])
+        last = end
+    remaining_parts.append(text[last:])
+    return ("\n".join(text[start:end] for start, end in blocks), "".join(remaining_parts))
+
+
+@_operation("LLM: clean markdown formatting", "LLM: clean markdown formatting (keep code)")
+def _run_clean_markdown(request: _FilterRequest) -> Tuple[str, str]:
+    return (_clean_markdown(request.text, keep_code="keep code" in request.operation), "")
+
+
+@_operation("find all (extract) (use optional_text)")
+def _run_find_extract(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    if not request.optional_text_input:
+        return request.not_found(text, "optional_text_input is empty")
+    patterns = [p.strip() for p in request.optional_text_input.split(',') if p.strip()]
+    if not patterns:
+        return request.not_found(text, "No valid patterns provided")
+
+    all_found_matches = []
+    remaining_output = text
+    view = _FoldedText(text) if request.ignore_case else None
+    for pattern in patterns:
+        # Matches are always collected from the full text; while earlier
+        # patterns removed nothing, one scan yields both outputs.
+        if request.use_regex:
+            compiled = _compile_regex(pattern, re.DOTALL)
+            found, stripped = _regex_scan(compiled, text, "")
+            if remaining_output is not text:
+                stripped = compiled.sub("", remaining_output)
+            all_found_matches.extend(found)
+        elif view is not None:
+            found, stripped = view.scan(pattern, "")
+            if remaining_output is not text:
+                _, stripped = _FoldedText(remaining_output).scan(pattern, "")
+            all_found_matches.extend(found)
+        else:
+            count, stripped = _literal_scan(text, pattern, "")
+            if remaining_output is not text:
+                stripped = remaining_output.replace(pattern, "")
+            all_found_matches.extend([pattern] * count)
+        remaining_output = stripped
+
+    request.matches = len(all_found_matches)
+    if not all_found_matches:
+        return request.not_found(text, "Pattern not found")
+    return ("\n".join(all_found_matches), remaining_output)
+
+
+@_operation("find and remove (use optional_text)", "find and replace (use optional_text, replace_with_text)")
+def _run_find_replace(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    if not request.optional_text_input:
+        return request.not_found(text, "optional_text_input is empty")
+    patterns = [p.strip() for p in request.optional_text_input.split(',') if p.strip()]
+    if not patterns:
+        return request.not_found(text, "No valid patterns provided")
+
+    all_found_matches = []
+    temp_processed_text = text
+    replace_str = request.replace_with_text if "replace" in request.operation else ""
+    for pattern in patterns:
+        if request.use_regex:
+            found, temp_processed_text = _regex_scan(
+                _compile_regex(pattern, re.DOTALL), temp_processed_text, replace_str
+            )
+            all_found_matches.extend(found)
+        elif request.ignore_case:
+            found, temp_processed_text = _FoldedText(temp_processed_text).scan(pattern, replace_str)
+            all_found_matches.extend(found)
         else:
-            normalized.append(str(match))
-    return normalized
+            count, temp_processed_text = _literal_scan(temp_processed_text, pattern, replace_str)
+            all_found_matches.extend([pattern] * count)
+
+    request.matches = len(all_found_matches)
+    if not all_found_matches:
+        return request.not_found(text, "Pattern not found for replacement")
+    return (temp_processed_text, "\n".join(all_found_matches))
+
+
+def _find_marker(text: str, marker: str, use_regex: bool, start_from: int = 0,
+                 view: Optional[_FoldedText] = None) -> Tuple[int, int]:
+    if view is not None:
+        return view.find(marker, start_from)
+    if use_regex:
+        match = _compile_regex(marker, re.DOTALL).search(text, start_from)
+        if not match:
+            return -1, -1
+        return match.start(), match.end()
+    index = text.find(marker, start_from)
+    if index == -1:
+        return -1, -1
+    return index, index + len(marker)
+
+
+@_operation(
+    "extract before start text",
+    "extract after start text",
+    "remove before start text",
+    "remove after start text",
+)
+def _run_split_at_start(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    if not request.start_text:
+        return request.not_found(text, "start_text input is missing")
+
+    view = _FoldedText(text) if request.ignore_case else None
+    s_start, _ = _find_marker(text, request.start_text, request.use_regex, view=view)
+    if s_start == -1:
+        return request.not_found(text, f"Start text '{request.start_text}' not found")
+
+    request.matches = 1
+    part_before = text[:s_start]
+    part_after = text[s_start:]
+    if request.operation in ("extract before start text", "remove after start text"):
+        return (part_before, part_after)
+    return (part_after, part_before)
+
+
+@_operation("extract between", "remove between")
+def _run_between(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    if not request.start_text or not request.end_text:
+        return request.not_found(text, "start_text or end_text missing")
+
+    view = _FoldedText(text) if request.ignore_case else None
+    s_start, s_end = _find_marker(text, request.start_text, request.use_regex, view=view)
+    if s_start == -1:
+        return request.not_found(text, f"Start text '{request.start_text}' not found")
+
+    e_start, _ = _find_marker(text, request.end_text, request.use_regex, start_from=s_end, view=view)
+    if e_start == -1:
+        return request.not_found(text, f"End text '{request.end_text}' not found after start")
+
+    request.matches = 1
+    target_text = text[s_end:e_start]
+    kept_text = text[:s_end] + text[e_start:]
+    if request.operation == "extract between":
+        return (target_text, kept_text)
+    return (kept_text, target_text)
+
+
+@_operation("extract all between", "remove all between")
+def _run_all_between(request: _FilterRequest) -> Tuple[str, str]:
+    text = request.text
+    start_text, end_text, use_regex = request.start_text, request.end_text, request.use_regex
+    if not start_text or not end_text:
+        return request.not_found(text, "start_text or end_text missing")
+
+    # One forward walk: each start marker is searched from the end of the previous pair.
+    segments, kept_parts = [], []
+    position = kept_from = 0
+    view = _FoldedText(text) if request.ignore_case else None
+    while position <= len(text):
+        s_start, s_end = _find_marker(text, start_text, use_regex, start_from=position, view=view)
+        if s_start == -1:
+            break
+        e_start, e_end = _find_marker(text, end_text, use_regex, start_from=s_end, view=view)
+        if e_start == -1:
+            break
+        segments.append(text[s_end:e_start])
+        kept_parts.append(text[kept_from:s_end])
+        kept_from = e_start
+        # Empty start and end matches at one spot would never advance.
+        position = e_end if e_end > s_start else e_end + 1
+
+    request.matches = len(segments)
+    if not segments:
+        return request.not_found(text, f"No '{start_text}' ... '{end_text}' pair found")
+
+    kept_parts.append(text[kept_from:])
+    if request.operation == "extract all between":
+        return ("\n".join(segments), "".join(kept_parts))
+    return ("".join(kept_parts), "\n".join(segments))
 
 
 class AdvancedTextFilter:
@@ -29,30 +2182,6 @@ class AdvancedTextFilter:
 
     @classmethod
     def INPUT_TYPES(cls):
-        operation_modes = [
-            "find and remove (use optional_text)",
-            "find and replace (use optional_text, replace_with_text)",
-            "find all (extract) (use optional_text)",
-            
-            "batch replace (use replacement_rules)",
-            
-            "extract between",
-            "remove between",
-            "extract before start text",
-            "extract after start text",
-            "remove before start text",
-            "remove after start text",
-            
-            "remove empty lines",
-            "remove newlines",
-            "strip lines (trim)",
-            "remove all whitespace (keep newlines)",
-            
-            "LLM: extract code block (```)",
-            "LLM: extract JSON object ({...})",
-            "LLM: clean markdown formatting"
-        ]
-        
         return {
             "required": {
                 "text": ("STRING", {
@@ -67,7 +2196,7 @@ class AdvancedTextFilter:
                     },
                 ),
                 "operation": (
-                    operation_modes,
+                    OPERATION_MODES,
                     {"tooltip": "Text filtering, extraction, replacement, or cleanup operation to run."},
                 ),
                 
@@ -105,7 +2234,7 @@ class AdvancedTextFilter:
                 ),
                 
                 "if_not_found": (
-                    ["return original text", "return empty string", "trigger error"],
+                    IF_NOT_FOUND_POLICIES,
                     {
                         "default": "return original text",
                         "tooltip": "Result policy when the requested marker or pattern is not found.",
@@ -123,6 +2252,49 @@ class AdvancedTextFilter:
                     "placeholder": "Syntax:\nfind_text -> replace_text\nbad_tag -> good_tag\n(One rule per line)",
                     "tooltip": "One find_text -> replace_text rule per line for batch replacement.",
                 }),
+                "batch_replace_mode": (
+                    BATCH_REPLACE_MODES,
+                    {
+                        "default": "sequential (compatible)",
+                        "tooltip": "Sequential applies rules one after another. Single pass rewrites the text in one scan: literal rules prefer the longest match, regex rules prefer the first listed rule.",
+                    },
+                ),
+                "regex_timeout": ("FLOAT", {
+                    "default": 0.0,
+                    "min": 0.0,
+                    "max": 600.0,
+                    "step": 0.1,
+                    "tooltip": "Seconds a regex operation may run before it is stopped and handled like a missing match; 0 disables the guard.",
+                }),
+                "regex_engine": (
+                    REGEX_ENGINES,
+                    {
+                        "default": "python",
+                        "tooltip": "re2 matches in linear time when the re2 package is installed; it uses ASCII \\w, \\d, and \\b classes and falls back to Python for patterns it cannot run.",
+                    },
+                ),
+                "chunk_size_kb": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 1048576,
+                    "step": 64,
+                    "tooltip": "Process line cleanup, remove newlines, and literal find/remove/replace in chunks of this many KB to limit memory on very large texts; 0 processes the whole text at once.",
+                }),
+                "rules_file": (
+                    [NO_RULES_FILE] + get_rule_files(),
+                    {
+                        "default": NO_RULES_FILE,
+                        "tooltip": "Rule file from the replacement_rules folder (.tsv, .csv, or find -> replace .txt) applied by batch replace before any inline replacement_rules.",
+                    },
+                ),
+                "cache_results": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Reuse the result of an earlier run with identical text and settings instead of processing again; the shared cache holds up to 64 MB of results.",
+                }),
+                "ignore_case": ("BOOLEAN", {
+                    "default": False,
+                    "tooltip": "Match literal search text, markers, and batch rules regardless of case while keeping the original casing in the output; regex patterns use (?i) instead.",
+                }),
             }
         }
 
@@ -144,226 +2316,431 @@ class AdvancedTextFilter:
                 use_regex: bool, case_conversion: str, 
                 if_not_found: str,
                 external_text: Optional[Any] = None,
-                replacement_rules: str = "") -> Tuple[str, str]:
+                replacement_rules: str = "",
+                batch_replace_mode: str = "sequential (compatible)",
+                regex_timeout: float = 0.0,
+                regex_engine: str = "python",
+                chunk_size_kb: int = 0,
+                rules_file: str = NO_RULES_FILE,
+                cache_results: bool = False,
+                ignore_case: bool = False) -> Tuple[str, str]:
+
+        if cache_results:
+            inputs = dict(
+                text="" if text is None else str(text), concat_mode=concat_mode, operation=operation,
+                start_text=start_text, end_text=end_text,
+                optional_text_input=optional_text_input, replace_with_text=replace_with_text,
+                use_regex=use_regex, case_conversion=case_conversion, if_not_found=if_not_found,
+                external_text=None if external_text is None else str(external_text),
+                replacement_rules=replacement_rules, batch_replace_mode=batch_replace_mode,
+                regex_timeout=regex_timeout, regex_engine=regex_engine, chunk_size_kb=chunk_size_kb,
+                rules_file=rules_file, ignore_case=ignore_case,
+            )
+            rules_path = resolve_rule_file(rules_file) if rules_file != NO_RULES_FILE else None
+            # An edited rule file must not be answered from results computed with its old contents.
+            try:
+                rules_stamp = _rule_file_stamp(rules_path) if rules_path else None
+            except OSError:
+                rules_stamp = None
+            key = _output_cache_key(dict(inputs, rules_file_stamp=rules_stamp))
+            cached = _OUTPUT_CACHE.get(key)
+            if cached is not None:
+                return cached
+            result = self.process(**inputs)
+            # A timeout depends on machine load, not on the inputs.
+            if not result[1].startswith("REGEX TIMEOUT"):
+                _OUTPUT_CACHE.put(key, result)
+            return result
 
         if text is None: text = ""
         text_to_process = str(text)
+        request = _FilterRequest(
+            operation, if_not_found, start_text, end_text, optional_text_input, replace_with_text,
+            use_regex, replacement_rules, batch_replace_mode, rules_file, ignore_case,
+        )
 
+        pieces = (text_to_process,)
         if external_text is not None and concat_mode != "disabled":
             external_text_str = str(external_text)
             if concat_mode == "prepend_external_text":
-                text_to_process = external_text_str + text_to_process
+                pieces = (external_text_str, text_to_process)
             elif concat_mode == "append_external_text":
-                text_to_process = text_to_process + external_text_str
+                pieces = (text_to_process, external_text_str)
+
+        if chunk_size_kb and chunk_size_kb > 0:
+            started = time.perf_counter()
+            streamed = self._process_streaming(
+                pieces, chunk_size_kb * 1024, operation, optional_text_input,
+                replace_with_text, use_regex, case_conversion, request,
+            )
+            if streamed is not None:
+                _OPERATION_STATS.record(
+                    operation, sum(len(piece) for piece in pieces), request.matches, time.perf_counter() - started
+                )
+                return streamed
+
+        if len(pieces) > 1:
+            text_to_process = "".join(pieces)
         
         if case_conversion == "to UPPERCASE":
             text_to_process = text_to_process.upper()
         elif case_conversion == "to lowercase":
             text_to_process = text_to_process.lower()
 
-        original_text_input = text_to_process
-        
-        def handle_not_found(original: str, reason: str):
-            if if_not_found == "trigger error":
-                raise _IntentionalFilterError(f"[AdvancedTextFilter] {reason}")
-            elif if_not_found == "return empty string":
-                if "extract" in operation or "find all" in operation or "LLM" in operation:
-                    return ("", original)
-                return (original, "") 
-            else: # return original text
-                if "extract" in operation or "find all" in operation or "LLM" in operation:
-                    return ("", original) 
-                return (original, "")
+        request.text = original_text_input = text_to_process
 
         try:
-            if operation == "batch replace (use replacement_rules)":
-                if not replacement_rules:
-                    return handle_not_found(text_to_process, "No replacement rules provided")
-                
-                lines = replacement_rules.splitlines()
-                processed = text_to_process
-                match_count = 0
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line or "->" not in line:
-                        continue
-                    
-                    parts = line.split("->", 1)
-                    find_str = parts[0].strip()
-                    repl_str = parts[1].strip()
-                    
-                    if not find_str: continue
-
-                    if use_regex:
-                        processed, count = re.subn(find_str, repl_str, processed, flags=re.DOTALL)
-                        match_count += count
-                    else:
-                        count = processed.count(find_str)
-                        processed = processed.replace(find_str, repl_str)
-                        match_count += count
-                
-                if match_count == 0:
-                     return handle_not_found(original_text_input, "No batch rules matched")
-
-                return (processed, "")
-
-            elif operation == "remove empty lines":
-                processed_lines = [line for line in text_to_process.splitlines() if line.strip()]
-                return ("\n".join(processed_lines), "")
-
-            elif operation == "remove newlines":
-                processed = text_to_process.replace("\r", "").replace("\n", "")
-                return (processed, "")
-
-            elif operation == "strip lines (trim)":
-                processed_lines = [line.strip() for line in text_to_process.splitlines()]
-                return ("\n".join(processed_lines), "")
-
-            elif operation == "remove all whitespace (keep newlines)":
-                processed_lines = ["".join(line.split()) for line in text_to_process.splitlines()]
-                return ("\n".join(processed_lines), "")
-            
-            elif operation == "LLM: extract code block (```)":
-                pattern = r"```[\w]*\n?(.*?)```"
-                matches = re.findall(pattern, text_to_process, re.DOTALL)
-                if not matches:
-                    return handle_not_found(text_to_process, "No code blocks found")
-                
-                extracted_code = "\n\n".join(matches)
-                remaining = re.sub(pattern, "", text_to_process, flags=re.DOTALL)
-                return (extracted_code.strip(), remaining.strip())
-
-            elif operation == "LLM: extract JSON object ({...})":
-                start_idx = text_to_process.find("{")
-                end_idx = text_to_process.rfind("}")
-                if start_idx == -1 or end_idx == -1 or end_idx < start_idx:
-                    return handle_not_found(text_to_process, "No valid JSON brackets found")
-                json_content = text_to_process[start_idx:end_idx+1]
-                remaining = text_to_process[:start_idx] + text_to_process[end_idx+1:]
-                return (json_content, remaining)
-
-            elif operation == "LLM: clean markdown formatting":
-                cleaned = text_to_process
-                cleaned = re.sub(r'\*\*|__|\*|_', '', cleaned)
-                cleaned = re.sub(r'^#+\s+', '', cleaned, flags=re.MULTILINE)
-                cleaned = re.sub(r'\[([^\]]+)\]\([^\)]+\)', r'\1', cleaned)
-                cleaned = re.sub(r'`', '', cleaned)
-                return (cleaned, "")
-
-            elif operation.startswith("find"):
-                if not optional_text_input:
-                    return handle_not_found(original_text_input, "optional_text_input is empty")
-
-                patterns = [p.strip() for p in optional_text_input.split(',') if p.strip()]
-                if not patterns:
-                     return handle_not_found(original_text_input, "No valid patterns provided")
-
-                all_found_matches = []
-                
-                if "extract" in operation:
-                    remaining_output = text_to_process
-                    for pattern in patterns:
-                        if use_regex:
-                            found = _normalize_regex_matches(re.findall(pattern, text_to_process, re.DOTALL))
-                            all_found_matches.extend(found)
-                            remaining_output = re.sub(pattern, "", remaining_output, flags=re.DOTALL)
-                        else:
-                            count = text_to_process.count(pattern)
-                            if count > 0:
-                                all_found_matches.extend([pattern] * count)
-                            remaining_output = remaining_output.replace(pattern, "")
-                    
-                    if not all_found_matches:
-                        return handle_not_found(original_text_input, "Pattern not found")
-
-                    processed_output = "\n".join(all_found_matches)
-                    return (processed_output, remaining_output)
-
-                else: # Find and Replace / Remove
-                    temp_processed_text = text_to_process
-                    replace_str = replace_with_text if "replace" in operation else ""
-                    match_count_total = 0
-
-                    for pattern in patterns:
-                        if use_regex:
-                            found = _normalize_regex_matches(re.findall(pattern, temp_processed_text, re.DOTALL))
-                            all_found_matches.extend(found)
-                            temp_processed_text, count = re.subn(pattern, replace_str, temp_processed_text, flags=re.DOTALL)
-                            match_count_total += count
-                        else:
-                            count = temp_processed_text.count(pattern)
-                            if count > 0:
-                                all_found_matches.extend([pattern] * count)
-                            temp_processed_text = temp_processed_text.replace(pattern, replace_str)
-                            match_count_total += count
-                    
-                    if match_count_total == 0:
-                         return handle_not_found(original_text_input, "Pattern not found for replacement")
-                    
-                    processed_output = temp_processed_text
-                    remaining_output = "\n".join(all_found_matches)
-                    return (processed_output, remaining_output)
-
-            elif "start text" in operation or "between" in operation:
-                
-                def get_index(txt, pattern, is_regex, start_from=0):
-                    if is_regex:
-                        match = re.search(pattern, txt[start_from:], re.DOTALL)
-                        if not match: return -1, -1
-                        return start_from + match.start(), start_from + match.end()
-                    else:
-                        idx = txt.find(pattern, start_from)
-                        if idx == -1: return -1, -1
-                        return idx, idx + len(pattern)
-
-                if "start text" in operation:
-                    if not start_text:
-                        return handle_not_found(original_text_input, "start_text input is missing")
-                    
-                    s_start, s_end = get_index(text_to_process, start_text, use_regex)
-                    if s_start == -1:
-                        return handle_not_found(original_text_input, f"Start text '{start_text}' not found")
-
-                    split_point = s_start 
-                    part_before = text_to_process[:split_point]
-                    part_after = text_to_process[split_point:]
-
-                    if "extract before" in operation: return (part_before, part_after)
-                    elif "remove before" in operation: return (part_after, part_before)
-                    elif "extract after" in operation: return (part_after, part_before)
-                    elif "remove after" in operation: return (part_before, part_after)
-
-                elif "between" in operation:
-                    if not start_text or not end_text:
-                        return handle_not_found(original_text_input, "start_text or end_text missing")
-
-                    s_start, s_end = get_index(text_to_process, start_text, use_regex)
-                    if s_start == -1:
-                        return handle_not_found(original_text_input, f"Start text '{start_text}' not found")
-                    
-                    e_start, e_end = get_index(text_to_process, end_text, use_regex, start_from=s_end)
-                    if e_start == -1:
-                        return handle_not_found(original_text_input, f"End text '{end_text}' not found after start")
-
-                    target_text = text_to_process[s_end:e_start]
-                    before_text = text_to_process[:s_end]
-                    after_text = text_to_process[e_start:]
-
-                    if operation == "extract between":
-                        return (target_text, before_text + after_text)
-                    else: # remove between
-                        return (before_text + after_text, target_text)
+            if use_regex and _uses_user_regex(operation) and (regex_timeout or regex_engine != "python"):
+                return self._process_guarded(
+                    {
+                        "text": text_to_process,
+                        "concat_mode": "disabled",
+                        "operation": operation,
+                        "start_text": start_text,
+                        "end_text": end_text,
+                        "optional_text_input": optional_text_input,
+                        "replace_with_text": replace_with_text,
+                        "use_regex": use_regex,
+                        "case_conversion": "disabled",
+                        "if_not_found": if_not_found,
+                        "replacement_rules": replacement_rules,
+                        "batch_replace_mode": batch_replace_mode,
+                        "rules_file": rules_file,
+                    },
+                    regex_timeout,
+                    regex_engine,
+                )
+
+            handler = _OPERATION_HANDLERS.get(operation)
+            if handler is None:
+                return (text_to_process, "Unknown operation")
+            started = time.perf_counter()
+            try:
+                return handler(request)
+            finally:
+                _OPERATION_STATS.record(operation, len(text_to_process), request.matches, time.perf_counter() - started)
 
         except re.error as e:
             print(f"[AdvancedTextFilter] Regex Error: {e}")
             return (original_text_input, f"REGEX ERROR: {e}")
 
-        except _IntentionalFilterError:
+        except _RegexTimeout as e:
+            print(f"[AdvancedTextFilter] Regex Timeout: {e}")
+            processed, _ = request.not_found(original_text_input, str(e))
+            return (processed, f"REGEX TIMEOUT: {e}")
+
+        except (_IntentionalFilterError, _LinearRegexUnsupported):
             raise
 
         except Exception as e:
             print(f"[AdvancedTextFilter] Generic Error: {e}")
             return (original_text_input, str(e)) 
 
-        return (text_to_process, "Unknown operation")
+    def _process_streaming(self, pieces, chunk_size: int, operation: str, optional_text_input: str,
+                           replace_with_text: str, use_regex: bool, case_conversion: str,
+                           request: "_FilterRequest") -> Optional[Tuple[str, str]]:
+        """
+        Chunked variant of the line cleanup, newline removal, and literal find
+        operations; returns None when the operation has to see the whole text.
+        Literal finds store their match count in request.matches.
+        """
+        if operation in STREAM_LITERAL_OPERATIONS:
+            patterns = [p.strip() for p in (optional_text_input or "").split(',') if p.strip()]
+            if use_regex or request.ignore_case or not patterns:
+                return None
+        elif operation not in STREAM_LINE_OPERATIONS and operation != "remove newlines":
+            return None
+
+        # Only lower() is context sensitive (final sigma), so literal and newline
+        # operations can cut anywhere unless the text is lowercased.
+        line_aligned = operation in STREAM_LINE_OPERATIONS or case_conversion == "to lowercase"
+        chunks = _iter_text_chunks(pieces, chunk_size, line_aligned)
+        if case_conversion == "to UPPERCASE":
+            chunks = (chunk.upper() for chunk in chunks)
+        elif case_conversion == "to lowercase":
+            chunks = (chunk.lower() for chunk in chunks)
+
+        if operation == "remove newlines":
+            return ("".join(map(_remove_newlines, chunks)), "")
+
+        if operation in STREAM_LINE_OPERATIONS:
+            processed = map(_LINE_CLEANERS[operation], chunks)
+            if operation in ("remove empty lines", "normalize whitespace (trim, collapse spaces, remove empty lines)"):
+                processed = filter(None, processed)
+            return ("\n".join(processed), "")
+
+        replace_str = replace_with_text if "replace" in operation else ""
+        counts = []
+        for pattern in patterns:
+            chunks = _stream_literal_replace(chunks, pattern, replace_str, counts)
+        processed_output = "".join(chunks)
+
+        request.matches = sum(counts)
+        if not request.matches:
+            return request.not_found(processed_output, "Pattern not found for replacement")
+        all_found_matches = []
+        for pattern, count in zip(patterns, counts):
+            all_found_matches.extend([pattern] * count)
+        return (processed_output, "\n".join(all_found_matches))
+
+    def _process_guarded(self, options: dict, regex_timeout: float, regex_engine: str) -> Tuple[str, str]:
+        """Run one already-prepared regex operation on the linear engine or under a deadline."""
+        if regex_engine != "python":
+            if _re2 is None:
+                _warn_missing_re2()
+            else:
+                try:
+                    with _linear_regex_backend():
+                        return self.process(**options)
+                except _LinearRegexUnsupported:
+                    pass
+        if regex_timeout and regex_timeout > 0:
+            # The worker process keeps its own counters; record the call here with its wall time
+            # and the match count the worker reported (none when it timed out or failed).
+            started = time.perf_counter()
+            matches = 0
+            try:
+                result, matches = _REGEX_WORKER.run(options, float(regex_timeout))
+                return result
+            finally:
+                _OPERATION_STATS.record(options["operation"], len(options["text"]), matches, time.perf_counter() - started)
+        return self.process(**options)
+
+
+def _first_value(value, default=None):
+    if isinstance(value, list):
+        return value[0] if value else default
+    return default if value is None else value
+
+
+class AdvancedTextFilterList(AdvancedTextFilter):
+    """
+    List variant of AdvancedTextFilter: one shared operation configuration is
+    applied to every incoming text, and both outputs are aligned lists.
+    Patterns and rule sets are compiled on the first item and reused from the
+    process-wide caches for the rest.
+    """
+
+    INPUT_IS_LIST = True
+    OUTPUT_IS_LIST = (True, True)
+    FUNCTION = "process_list"
+    DESCRIPTION = "Runs one Advanced Text Filter configuration over a list of texts and returns aligned output lists."
+    SEARCH_ALIASES = ["text filter list", "batch text filter", "caption batch", "list regex", "bulk clean text"]
+    OUTPUT_TOOLTIPS = (
+        "Processed target text for each input text, in input order.",
+        "Remaining text for each input text, in input order.",
+    )
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        input_types = super().INPUT_TYPES()
+        input_types["required"]["text"][1]["tooltip"] = "Text or list of texts processed with the shared operation settings."
+        input_types["optional"]["external_text"][1]["tooltip"] = (
+            "Optional upstream value or list; a list matching the text count is paired item by item, otherwise its first value is used."
+        )
+        input_types["optional"]["max_workers"] = ("INT", {
+            "default": 0,
+            "min": 0,
+            "max": 64,
+            "tooltip": "Worker threads for lists of at least 64 texts; 0 or 1 processes sequentially.",
+        })
+        return input_types
+
+    def process_list(self, text, external_text=None, max_workers=None, **kwargs):
+        texts = text if isinstance(text, list) else [text]
+        options = {name: _first_value(value) for name, value in kwargs.items()}
+
+        if isinstance(external_text, list) and len(external_text) == len(texts):
+            externals = external_text
+        else:
+            externals = [_first_value(external_text)] * len(texts)
+
+        def run(index):
+            return self.process(text=texts[index], external_text=externals[index], **options)
+
+        workers = _first_value(max_workers, 0) or 0
+        if workers > 1 and len(texts) >= LIST_PARALLEL_MIN_ITEMS:
+            # Prime the shared caches once so workers do not compile the same rules concurrently.
+            first = run(0)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = [first] + list(executor.map(run, range(1, len(texts))))
+        else:
+            results = [run(index) for index in range(len(texts))]
+
+        return ([result[0] for result in results], [result[1] for result in results])
+
+
+RECIPE_STEP_KEYS = {
+    "operation",
+    "start_text",
+    "end_text",
+    "optional_text_input",
+    "replace_with_text",
+    "use_regex",
+    "replacement_rules",
+    "batch_replace_mode",
+    "ignore_case",
+    "if_not_found",
+    "input",
+}
+RECIPE_STEP_INPUTS = ("processed", "remaining")
+_RECIPE_CACHE = _LRUCache(RECIPE_CACHE_SIZE)
+
+
+def _compile_recipe_step(index: int, step) -> dict:
+    label = f"[TextFilterRecipe] step {index}"
+    if not isinstance(step, dict):
+        raise ValueError(f"{label}: expected an object, got {type(step).__name__}")
+
+    unknown = sorted(set(step) - RECIPE_STEP_KEYS)
+    if unknown:
+        raise ValueError(f"{label}: unknown keys {unknown}")
+    if step.get("operation") not in OPERATION_MODES:
+        raise ValueError(f"{label}: unknown operation {step.get('operation')!r}")
+    if step.get("input", "processed") not in RECIPE_STEP_INPUTS:
+        raise ValueError(f"{label}: input must be one of {list(RECIPE_STEP_INPUTS)}")
+    if step.get("batch_replace_mode", BATCH_REPLACE_MODES[0]) not in BATCH_REPLACE_MODES:
+        raise ValueError(f"{label}: unknown batch_replace_mode {step.get('batch_replace_mode')!r}")
+    if "if_not_found" in step and step["if_not_found"] not in IF_NOT_FOUND_POLICIES:
+        raise ValueError(f"{label}: unknown if_not_found {step['if_not_found']!r}")
+    for key in ("use_regex", "ignore_case"):
+        if not isinstance(step.get(key, False), bool):
+            raise ValueError(f"{label}: {key} must be true or false, got {step[key]!r}")
+
+    compiled = {
+        "operation": step["operation"],
+        "start_text": str(step.get("start_text", "")),
+        "end_text": str(step.get("end_text", "")),
+        "optional_text_input": str(step.get("optional_text_input", "")),
+        "replace_with_text": str(step.get("replace_with_text", "")),
+        "use_regex": step.get("use_regex", False),
+        "replacement_rules": str(step.get("replacement_rules", "")),
+        "batch_replace_mode": step.get("batch_replace_mode", BATCH_REPLACE_MODES[0]),
+        "ignore_case": step.get("ignore_case", False),
+    }
+
+    # Compile every regex and rule set now so the recipe fails fast and later runs hit the caches.
+    try:
+        if compiled["operation"] == "batch replace (use replacement_rules)":
+            if compiled["replacement_rules"]:
+                _get_rule_set(compiled["replacement_rules"], compiled["use_regex"])
+        elif compiled["use_regex"]:
+            if compiled["operation"].startswith("find"):
+                patterns = [p.strip() for p in compiled["optional_text_input"].split(",") if p.strip()]
+            else:
+                patterns = [compiled["start_text"], compiled["end_text"]]
+            for pattern in patterns:
+                if pattern:
+                    _compile_regex(pattern, re.DOTALL)
+    except re.error as e:
+        raise ValueError(f"{label}: invalid regex: {e}") from e
+
+    return {"input": step.get("input", "processed"), "if_not_found": step.get("if_not_found"), "options": compiled}
+
+
+def _compile_recipe(recipe: str):
+    digest = hashlib.blake2b(recipe.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    steps = _RECIPE_CACHE.get(digest)
+    if steps is None:
+        try:
+            parsed = json.loads(recipe) if recipe.strip() else []
+        except json.JSONDecodeError as e:
+            raise ValueError(f"[TextFilterRecipe] recipe is not valid JSON: {e}") from e
+        if not isinstance(parsed, list):
+            raise ValueError("[TextFilterRecipe] recipe must be a JSON list of steps")
+        steps = tuple(_compile_recipe_step(index, step) for index, step in enumerate(parsed, start=1))
+        _RECIPE_CACHE.put(digest, steps)
+    return steps
+
+
+class TextFilterRecipe:
+    """
+    Runs an ordered list of Advanced Text Filter operations in one execution.
+    The recipe is parsed, validated, and compiled once per distinct recipe text.
+    """
+
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "text": ("STRING", {
+                    "multiline": True,
+                    "default": "",
+                    "tooltip": "Primary text fed into the first recipe step.",
+                }),
+                "recipe": ("STRING", {
+                    "multiline": True,
+                    "default": "[]",
+                    "placeholder": '[\n  {"operation": "LLM: extract JSON object ({...})"},\n  {"operation": "remove newlines"}\n]',
+                    "tooltip": "JSON list of steps; each step names an Advanced Text Filter operation and its settings.",
+                }),
+                "concat_mode": (
+                    ["disabled", "prepend_external_text", "append_external_text"],
+                    {"tooltip": "Optionally combine external_text with the primary text once, before the first step."},
+                ),
+                "case_conversion": (
+                    ["disabled", "to UPPERCASE", "to lowercase"],
+                    {"tooltip": "Optional case conversion applied once, before the first step."},
+                ),
+                "if_not_found": (
+                    IF_NOT_FOUND_POLICIES,
+                    {
+                        "default": "return original text",
+                        "tooltip": "Default missing-match policy for steps that do not set their own if_not_found.",
+                    },
+                ),
+            },
+            "optional": {
+                "external_text": (
+                    "*",
+                    {"tooltip": "Optional upstream value converted to text and combined according to concat_mode."},
+                ),
+            },
+        }
+
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("processed_text (Target)", "remaining_text")
+
+    FUNCTION = "process"
+    CATEGORY = "ComfyUI Text Processor"
+    DESCRIPTION = "Runs a multi-step Advanced Text Filter recipe in one node and returns the final target and remainder."
+    SEARCH_ALIASES = ["text recipe", "filter pipeline", "multi step filter", "text pipeline", "chain text filter"]
+    OUTPUT_TOOLTIPS = (
+        "Processed target text of the last recipe step.",
+        "Remaining text of the last recipe step.",
+    )
+
+    def process(self, text: str, recipe: str, concat_mode: str, case_conversion: str,
+                if_not_found: str, external_text: Optional[Any] = None) -> Tuple[str, str]:
+        steps = _compile_recipe(recipe or "")
+
+        current = "" if text is None else str(text)
+        if external_text is not None and concat_mode != "disabled":
+            if concat_mode == "prepend_external_text":
+                current = str(external_text) + current
+            elif concat_mode == "append_external_text":
+                current = current + str(external_text)
+        if case_conversion == "to UPPERCASE":
+            current = current.upper()
+        elif case_conversion == "to lowercase":
+            current = current.lower()
+
+        result = (current, "")
+        text_filter = AdvancedTextFilter()
+        for index, step in enumerate(steps, start=1):
+            step_input = result[0] if step["input"] == "processed" else result[1]
+            try:
+                result = text_filter.process(
+                    text=step_input,
+                    concat_mode="disabled",
+                    case_conversion="disabled",
+                    if_not_found=step["if_not_found"] or if_not_found,
+                    **step["options"],
+                )
+            except _IntentionalFilterError as e:
+                raise _IntentionalFilterError(f"[TextFilterRecipe] step {index}: {e}") from e
+        return result
+
+
+if __name__ == "__main__" and sys.argv[1:] == ["--regex-worker"]:
+    _regex_worker_main()
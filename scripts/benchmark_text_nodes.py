@@ -0,0 +1,499 @@
+"""Benchmarks for the text-processing nodes.
+
+Run from the repository root:
+
+    python scripts/benchmark_text_nodes.py
+    python scripts/benchmark_text_nodes.py --suite filter --sizes 1KB,100KB --json bench.json
+    python scripts/benchmark_text_nodes.py --json new.json --compare old.json
+
+Suites:
+  single-scan  one-scan find modes against a findall + sub baseline on 1 MB
+  filter       every AdvancedTextFilter operation at each --sizes input size
+  wildcards    process_wildcard_syntax with inline choices and nested template files
+  storage      TextStorageHandler key listing, reads, and writes at 10k keys
+  eval         EvaluateInts / EvaluateFloats / EvaluateStrs (needs simpleeval)
+
+Wildcard and storage files are created in a temporary directory, never in the
+ComfyUI or plugin folders. --json writes every result as machine-readable JSON;
+--compare reads an earlier --json file and exits with status 1 when a case got
+slower than --threshold.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from unittest import mock
+
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+from advanced_text_filter import OPERATION_MODES, AdvancedTextFilter  # noqa: E402
+
+
+SCHEMA_VERSION = 1
+SUITES = ("single-scan", "filter", "wildcards", "storage", "eval")
+SIZE_UNITS = {"B": 1, "KB": 1024, "MB": 1024 * 1024}
+STORAGE_KEYS = 10_000
+
+TRANSCRIPT_WORDS = [
+    "the", "model", "token", "json", "value", "result", "assistant", "context",
+    "prompt", "output", "reasoning", "step", "answer", "because", "therefore",
+]
+
+
+def make_transcript(size_bytes, seed=0):
+    """Synthetic LLM chat transcript with timestamps, speakers, and inline code."""
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size_bytes:
+        words = " ".join(rng.choice(TRANSCRIPT_WORDS) for _ in range(rng.randint(5, 25)))
+        line = f"[{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}] Speaker{rng.randint(1, 4)}: {words}"
+        if rng.random() < 0.05:
+            line += f" `id_{rng.randint(0, 999)}`"
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size_bytes]
+
+
+def make_llm_reply(size_bytes, seed=0):
+    """Synthetic LLM reply mixing prose, markdown, <think> spans, code fences, and JSON."""
+    rng = random.Random(seed)
+    blocks = []
+    total = 0
+    while total < size_bytes:
+        words = " ".join(rng.choice(TRANSCRIPT_WORDS) for _ in range(rng.randint(8, 30)))
+        kind = rng.random()
+        if kind < 0.15:
+            block = f"<think>{words}</think>"
+        elif kind < 0.25:
+            block = f"```python\nvalue_{rng.randint(0, 99)} = {rng.randint(0, 999)}  # {words}\n```"
+        elif kind < 0.35:
+            block = json.dumps({"step": rng.randint(0, 99), "note": words, "tags": words.split()[:3]})
+        elif kind < 0.45:
+            block = f"## {words[:30]}\n\nSome **{words[:12]}** and [a link](https://example.com/{rng.randint(0, 99)})."
+        else:
+            block = f"  {words}  \n"
+        blocks.append(block)
+        total += len(block) + 1
+    return "\n".join(blocks)[:size_bytes]
+
+
+def make_tag_prompt(size_bytes, seed=0):
+    """Synthetic comma-separated tag prompt with weights, duplicates, and groups."""
+    rng = random.Random(seed)
+    tags = []
+    total = 0
+    while total < size_bytes:
+        tag = f"tag_{rng.randint(0, 2000)}"
+        kind = rng.random()
+        if kind < 0.1:
+            tag = f"({tag}:1.{rng.randint(0, 9)})"
+        elif kind < 0.15:
+            tag = f"(({tag}))"
+        elif kind < 0.18:
+            tag = f"{{{tag}|tag_{rng.randint(0, 2000)}}}"
+        tags.append(tag)
+        total += len(tag) + 2
+    return ", ".join(tags)[:size_bytes]
+
+
+BATCH_RULES = "\n".join(f"{word} -> {word.upper()}" for word in TRANSCRIPT_WORDS)
+REGEX_BATCH_RULES = "\n".join(f"\\b{word}\\b -> {word.upper()}" for word in TRANSCRIPT_WORDS)
+
+# Options that make each operation do real work on make_llm_reply() text; operations
+# not listed here (and any added later) run with empty options.
+OPERATION_OPTIONS = {
+    "find and remove (use optional_text)": {"optional_text_input": "assistant"},
+    "find and replace (use optional_text, replace_with_text)": {
+        "optional_text_input": "assistant", "replace_with_text": "ASSISTANT",
+    },
+    "find all (extract) (use optional_text)": {"optional_text_input": "assistant"},
+    "batch replace (use replacement_rules)": {"replacement_rules": BATCH_RULES},
+    "extract between": {"start_text": "<think>", "end_text": "</think>"},
+    "remove between": {"start_text": "<think>", "end_text": "</think>"},
+    "extract all between": {"start_text": "<think>", "end_text": "</think>"},
+    "remove all between": {"start_text": "<think>", "end_text": "</think>"},
+    "extract before start text": {"start_text": "<think>"},
+    "extract after start text": {"start_text": "<think>"},
+    "remove before start text": {"start_text": "<think>"},
+    "remove after start text": {"start_text": "<think>"},
+}
+TAG_OPTIONS = {"optional_text_input": "tag_7, tag_8", "replacement_rules": "tag_1 -> alias_1\ntag_2 -> alias_2, extra"}
+
+# Regex variants reported as separate "<operation> [regex]" cases.
+REGEX_OPTIONS = {
+    "find and remove (use optional_text)": {"optional_text_input": r"\bassistant\b"},
+    "find and replace (use optional_text, replace_with_text)": {
+        "optional_text_input": r"value_(\d+)", "replace_with_text": r"v\1",
+    },
+    "find all (extract) (use optional_text)": {"optional_text_input": r"value_(\d+)"},
+    "batch replace (use replacement_rules)": {"replacement_rules": REGEX_BATCH_RULES},
+    "extract all between": {"start_text": r"<think>", "end_text": r"</think>"},
+    "remove all between": {"start_text": r"<think>", "end_text": r"</think>"},
+}
+
+
+def parse_size(label):
+    match = re.fullmatch(r"(\d+)\s*(B|KB|MB)", label.strip().upper())
+    if match is None:
+        raise argparse.ArgumentTypeError(f"invalid size {label!r}; use e.g. 1KB, 100KB, 10MB")
+    return int(match.group(1)) * SIZE_UNITS[match.group(2)]
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def measure(function, repeat):
+    """Best and mean wall time over repeat runs, after one warm-up run that fills the caches."""
+    function()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), statistics.fmean(timings)
+
+
+def result_row(suite, case, best, mean, runs, size_bytes=None, items=1):
+    return {
+        "suite": suite,
+        "case": case,
+        "size_bytes": size_bytes,
+        "items": items,
+        "runs": runs,
+        "best_ms": round(best * 1000, 4),
+        "mean_ms": round(mean * 1000, 4),
+    }
+
+
+def run_filter(text, operation, pattern, use_regex, replace_with_text=""):
+    return AdvancedTextFilter().process(
+        text=text,
+        concat_mode="disabled",
+        operation=operation,
+        start_text="",
+        end_text="",
+        optional_text_input=pattern,
+        replace_with_text=replace_with_text,
+        use_regex=use_regex,
+        case_conversion="disabled",
+        if_not_found="return original text",
+    )
+
+
+def two_scan_extract(text, pattern):
+    compiled = re.compile(pattern, re.DOTALL)
+    return compiled.findall(text), compiled.sub("", text)
+
+
+def two_scan_replace(text, pattern, replacement):
+    compiled = re.compile(pattern, re.DOTALL)
+    return compiled.findall(text), compiled.subn(replacement, text)
+
+
+def bench_single_scan(repeat):
+    """Two-scan findall+sub/subn baseline against the node's one-scan find modes on 1 MB."""
+    transcript = make_transcript(1_000_000)
+    cases = [
+        ("timestamps", r"\[\d\d:\d\d\]"),
+        ("speaker", r"Speaker3"),
+        ("inline code", r"`(id_\d+)`"),
+        ("absent", r"<tool_call>"),
+    ]
+    rows = []
+    for label, pattern in cases:
+        baseline = best_of(lambda: two_scan_extract(transcript, pattern), repeat)
+        current = best_of(
+            lambda: run_filter(transcript, "find all (extract) (use optional_text)", pattern, True),
+            repeat,
+        )
+        rows.append((f"extract {label}", baseline, current))
+
+        baseline = best_of(lambda: two_scan_replace(transcript, pattern, "#"), repeat)
+        current = best_of(
+            lambda: run_filter(
+                transcript,
+                "find and replace (use optional_text, replace_with_text)",
+                pattern,
+                True,
+                replace_with_text="#",
+            ),
+            repeat,
+        )
+        rows.append((f"replace {label}", baseline, current))
+    return rows
+
+
+def bench_filter(sizes, repeat):
+    """Every AdvancedTextFilter operation, plus regex variants, at each input size."""
+    cases = []
+    for operation in OPERATION_MODES:
+        if operation.startswith("tags:"):
+            cases.append((operation, operation, TAG_OPTIONS, make_tag_prompt))
+            continue
+        cases.append((operation, operation, OPERATION_OPTIONS.get(operation, {}), make_llm_reply))
+        if operation in REGEX_OPTIONS:
+            cases.append((f"{operation} [regex]", operation, dict(REGEX_OPTIONS[operation], use_regex=True), make_llm_reply))
+
+    rows = []
+    for size in sizes:
+        texts = {}
+        for label, operation, options, make_text in cases:
+            text = texts.get(make_text)
+            if text is None:
+                text = texts[make_text] = make_text(size)
+            kwargs = {
+                "text": text,
+                "concat_mode": "disabled",
+                "operation": operation,
+                "start_text": "",
+                "end_text": "",
+                "optional_text_input": "",
+                "replace_with_text": "",
+                "use_regex": False,
+                "case_conversion": "disabled",
+                "if_not_found": "return original text",
+            }
+            kwargs.update(options)
+            node = AdvancedTextFilter()
+            best, mean = measure(lambda: node.process(**kwargs), repeat)
+            rows.append(result_row("filter", label, best, mean, repeat, size_bytes=size))
+    return rows
+
+
+def write_wildcard_files(root):
+    """Nested wildcard templates: scene lines reference other files and inline choices."""
+    rng = random.Random(0)
+    files = {
+        "bench/color": [f"color_{index}" for index in range(1000)],
+        "bench/animal": [f"{{small|large|tiny}} animal_{index}" for index in range(1000)],
+        "bench/place": [f"place_{index} under a __bench/color__ sky" for index in range(500)],
+        "bench/scene": [
+            f"a __bench/color__ __bench/animal__ in __bench/place__, {{day|night|dusk}}, detail_{index}"
+            for index in range(500)
+        ],
+    }
+    # Chain level0 -> level1 -> ... so each expansion recurses to the depth limit's neighbourhood.
+    # Names must not contain "_": the wildcard pattern does not match them.
+    for level in range(8):
+        files[f"bench/level{level}"] = [
+            f"step{level}_{index} __bench/level{level + 1}__" for index in range(50)
+        ]
+    files["bench/level8"] = [f"leaf_{index}" for index in range(50)]
+
+    for name, lines in files.items():
+        path = Path(root, *name.split("/")).with_suffix(".txt")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        rng.shuffle(lines)
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def bench_wildcards(repeat, work_dir):
+    if importlib.util.find_spec("folder_paths") is None:
+        # Outside ComfyUI, give wildcards.py the host module it imports; all paths are redirected below.
+        folder_paths = types.ModuleType("folder_paths")
+        folder_paths.base_path = work_dir
+        sys.modules.setdefault("folder_paths", folder_paths)
+    import wildcards
+
+    wildcard_dir = os.path.join(work_dir, "wildcards")
+    write_wildcard_files(wildcard_dir)
+    templates = {
+        "inline choices x50": ", ".join(f"{{red|green|blue|option_{index}}}" for index in range(50)),
+        "nested inline choices": "{a {red|blue} {cat|dog}|b {big|small} {{x|y}|z}} " * 10,
+        "nested files": "__bench/scene__, __bench/scene__, __bench/scene__",
+        "file chain depth 8": "__bench/level0__",
+    }
+    seeds = range(200)
+    rows = []
+    with mock.patch.object(wildcards, "get_wildcard_dirs", return_value=[os.path.realpath(wildcard_dir)]):
+        for label, template in templates.items():
+            if "__" in template and wildcards.process_wildcard_syntax(template, 0) == template:
+                raise RuntimeError(f"wildcard benchmark case {label!r} does not expand any wildcard")
+            best, mean = measure(
+                lambda: [wildcards.process_wildcard_syntax(template, seed) for seed in seeds], repeat
+            )
+            rows.append(result_row("wildcards", label, best, mean, repeat, items=len(seeds)))
+    return rows
+
+
+def bench_storage(repeat, work_dir):
+    import text_storage
+
+    user_dir = os.path.join(work_dir, "storage_user")
+    legacy_dir = os.path.join(work_dir, "storage_legacy")
+    os.makedirs(user_dir)
+    os.makedirs(legacy_dir)
+    data = {f"key_{index:05d}": f"stored prompt {index} " * 8 for index in range(STORAGE_KEYS)}
+    with open(os.path.join(user_dir, "text_storage.json"), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+    rows = []
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(text_storage, "_resolve_user_storage_dir", return_value=user_dir))
+        stack.enter_context(mock.patch.object(text_storage, "PLUGIN_STORAGE_DIR", legacy_dir))
+        # The handler logs every read and write; keep the benchmark output readable.
+        stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")))
+        handler = text_storage.TextStorageHandler()
+        cases = {
+            "get_all_keys": handler.get_all_keys,
+            "read_content json key": lambda: handler.read_content("key_05000"),
+            "save_text add json": lambda: handler.save_text("bench_", "entry_***", "new content"),
+            "save_text overwrite json": lambda: handler.save_text("", "key_00001", "changed", mode="overwrite"),
+            "save_text overwrite txt": lambda: handler.save_text(
+                "", "bench_txt", "changed", mode="overwrite", storage_format="txt"
+            ),
+        }
+        for label, function in cases.items():
+            best, mean = measure(function, repeat)
+            rows.append(result_row("storage", f"{label} ({STORAGE_KEYS} keys)", best, mean, repeat))
+    return rows
+
+
+def bench_eval(repeat):
+    import simple_eval
+
+    calls = 1000
+    cases = [
+        ("EvaluateInts", simple_eval.EvaluateInts(), "((a + b) - c) // 2", {"a": 7, "b": 5, "c": 2}),
+        ("EvaluateFloats", simple_eval.EvaluateFloats(), "(a * b) / (c + 1.5)", {"a": 1.5, "b": 2.25, "c": 0.5}),
+        ("EvaluateStrs", simple_eval.EvaluateStrs(), "a + ' ' + b if len(c) < 5 else c", {"a": "red", "b": "cat", "c": "sky"}),
+    ]
+    rows = []
+    for label, node, expression, names in cases:
+        best, mean = measure(
+            lambda: [node.evaluate(expression, "False", **names) for _ in range(calls)], repeat
+        )
+        rows.append(result_row("eval", label, best, mean, repeat, items=calls))
+    return rows
+
+
+def compare_results(current, baseline, threshold, min_ms):
+    """Cases whose best time grew by more than threshold x against a baseline --json file."""
+    previous = {(row["suite"], row["case"], row["size_bytes"]): row for row in baseline["results"]}
+    regressions = []
+    for row in current:
+        old = previous.get((row["suite"], row["case"], row["size_bytes"]))
+        if old is None or max(old["best_ms"], row["best_ms"]) < min_ms:
+            continue
+        ratio = row["best_ms"] / max(old["best_ms"], 1e-9)
+        if ratio > threshold:
+            regressions.append((row, old, ratio))
+    return regressions
+
+
+def format_size(size_bytes):
+    if size_bytes is None:
+        return ""
+    for unit in ("MB", "KB"):
+        if size_bytes >= SIZE_UNITS[unit] and size_bytes % SIZE_UNITS[unit] == 0:
+            return f"{size_bytes // SIZE_UNITS[unit]}{unit}"
+    return f"{size_bytes}B"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--suite", action="append", choices=SUITES, help="suite to run; repeat for several (default: all)")
+    parser.add_argument("--sizes", default="1KB,100KB,10MB", help="comma-separated input sizes for the filter suite")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case; the best run is reported")
+    parser.add_argument("--json", metavar="PATH", help="write results as JSON to PATH ('-' for stdout)")
+    parser.add_argument("--compare", metavar="PATH", help="earlier --json file to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--min-ms", type=float, default=0.05, help="ignore cases faster than this in both runs")
+    args = parser.parse_args(argv)
+
+    suites = args.suite or list(SUITES)
+    sizes = [parse_size(label) for label in args.sizes.split(",") if label.strip()]
+    log = sys.stderr if args.json == "-" else sys.stdout
+    results = []
+    skipped = {}
+
+    if "single-scan" in suites:
+        print(f"{'case':<28}{'two-scan ms':>14}{'one-scan ms':>14}{'speedup':>10}", file=log)
+        for label, baseline, current in bench_single_scan(args.repeat):
+            print(f"{label:<28}{baseline * 1000:>14.2f}{current * 1000:>14.2f}{baseline / current:>9.2f}x", file=log)
+            results.append(result_row("single-scan", f"{label} two-scan", baseline, baseline, args.repeat, size_bytes=1_000_000))
+            results.append(result_row("single-scan", f"{label} one-scan", current, current, args.repeat, size_bytes=1_000_000))
+
+    work_dir = tempfile.mkdtemp(prefix="text_nodes_bench_")
+    try:
+        table = []
+        if "filter" in suites:
+            table += bench_filter(sizes, args.repeat)
+        if "wildcards" in suites:
+            table += bench_wildcards(args.repeat, work_dir)
+        if "storage" in suites:
+            table += bench_storage(args.repeat, work_dir)
+        if "eval" in suites:
+            if importlib.util.find_spec("simpleeval") is None:
+                skipped["eval"] = "simpleeval is not installed"
+            else:
+                table += bench_eval(args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if table:
+        print(f"\n{'suite':<10}{'case':<80}{'size':>7}{'best ms':>12}{'mean ms':>12}", file=log)
+        for row in table:
+            print(
+                f"{row['suite']:<10}{row['case'][:79]:<80}{format_size(row['size_bytes']):>7}"
+                f"{row['best_ms']:>12.3f}{row['mean_ms']:>12.3f}",
+                file=log,
+            )
+    for suite, reason in skipped.items():
+        print(f"skipped {suite}: {reason}", file=log)
+    results += table
+
+    report = {
+        "schema_version": SCHEMA_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": results,
+        "skipped": skipped,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare_results(results, json.load(f), args.threshold, args.min_ms)
+        for row, old, ratio in regressions:
+            print(
+                f"REGRESSION {row['suite']} {row['case']} {format_size(row['size_bytes'])}: "
+                f"{old['best_ms']:.3f} -> {row['best_ms']:.3f} ms ({ratio:.2f}x)",
+                file=log,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,13 @@
+import json
+import os
+import random
+import sys
+import tempfile
 import unittest
+from unittest import mock
 
-from advanced_text_filter import AdvancedTextFilter
+import advanced_text_filter
+from advanced_text_filter import AdvancedTextFilter, AdvancedTextFilterList, TextFilterRecipe
 
 
 class AdvancedTextFilterNotFoundTests(unittest.TestCase):
@@ -48,6 +55,826 @@ class AdvancedTextFilterNotFoundTests(unittest.TestCase):
 
         self.assertEqual(("", "hello world"), result)
 
+    def test_invalid_replacement_template_is_reported_with_or_without_matches(self):
+        for text in ("no digits here", "a1"):
+            with self.subTest(text=text):
+                processed, remaining = self.node.process(
+                    text=text,
+                    concat_mode="disabled",
+                    operation="find and replace (use optional_text, replace_with_text)",
+                    start_text="",
+                    end_text="",
+                    optional_text_input="\\d",
+                    replace_with_text="<\\1>",
+                    use_regex=True,
+                    case_conversion="disabled",
+                    if_not_found="return original text",
+                    external_text=None,
+                    replacement_rules="",
+                )
+
+                self.assertEqual(text, processed)
+                self.assertTrue(remaining.startswith("REGEX ERROR: invalid group reference"))
+
+
+class AdvancedTextFilterBatchReplaceTests(unittest.TestCase):
+    def setUp(self):
+        self.node = AdvancedTextFilter()
+
+    def run_batch(self, text, rules, mode, use_regex=False, if_not_found="return original text"):
+        return self.node.process(
+            text=text,
+            concat_mode="disabled",
+            operation="batch replace (use replacement_rules)",
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=use_regex,
+            case_conversion="disabled",
+            if_not_found=if_not_found,
+            external_text=None,
+            replacement_rules=rules,
+            batch_replace_mode=mode,
+        )
+
+    def test_sequential_mode_chains_rule_outputs(self):
+        rules = "cat -> dog\ndog -> bird"
+
+        self.assertEqual(("bird bird", ""), self.run_batch("cat dog", rules, "sequential (compatible)"))
+
+    def test_single_pass_never_rescans_replaced_text(self):
+        rules = "cat -> dog\ndog -> bird"
+
+        self.assertEqual(("dog bird", ""), self.run_batch("cat dog", rules, "single pass"))
+
+    def test_single_pass_prefers_leftmost_then_longest_rule(self):
+        rules = "red -> R\nred hair -> RH\nhair band -> HB"
+
+        processed, _ = self.run_batch("red hair band, red", rules, "single pass")
+
+        self.assertEqual("RH band, R", processed)
+
+    def test_single_pass_keeps_first_rule_for_duplicate_find_text(self):
+        rules = "bad -> first\nbad -> second"
+
+        self.assertEqual(("first", ""), self.run_batch("bad", rules, "single pass"))
+
+    def test_single_pass_without_matches_applies_not_found_policy(self):
+        with self.assertRaisesRegex(ValueError, "No batch rules matched"):
+            self.run_batch("clean", "bad -> good", "single pass", if_not_found="trigger error")
+
+    def test_rule_set_is_parsed_once_per_rules_text_and_regex_flag(self):
+        advanced_text_filter._RULE_SET_CACHE.clear()
+        rules = "cat -> dog\nbird -> fish"
+
+        self.run_batch("cat", rules, "single pass")
+        self.run_batch("bird", rules, "single pass")
+        self.run_batch("cat", rules, "sequential (compatible)", use_regex=True)
+
+        stats = advanced_text_filter.rule_set_cache_info()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(2, stats["misses"])
+        self.assertIs(
+            advanced_text_filter._get_rule_set(rules, False).automaton,
+            advanced_text_filter._get_rule_set(rules, False).automaton,
+        )
+
+    def test_invalid_regex_rule_is_reported_and_not_cached(self):
+        advanced_text_filter._RULE_SET_CACHE.clear()
+
+        processed, remaining = self.run_batch("text", "( -> x", "sequential (compatible)", use_regex=True)
+
+        self.assertEqual("text", processed)
+        self.assertTrue(remaining.startswith("REGEX ERROR"))
+        self.assertEqual(0, advanced_text_filter.rule_set_cache_info()["entries"])
+
+    def test_regex_single_pass_merges_rules_and_expands_rule_local_groups(self):
+        rules = "(\\w+)@old\\.com -> \\1@new.com\n(\\d+)px -> \\1 pixels\n(a)\\1 -> double-a"
+
+        processed, _ = self.run_batch("a@old.com 12px aa", rules, "single pass", use_regex=True)
+
+        self.assertEqual("a@new.com 12 pixels double-a", processed)
+
+    def test_regex_single_pass_indexes_rules_by_literal_prefix(self):
+        rules = "\\bcat\\b -> dog\n(?:red|blue) hair -> hair\ncat(s)? -> pets"
+
+        self.assertIsNone(advanced_text_filter._get_rule_set(rules, True).combined)
+        combined = advanced_text_filter._get_rule_set("\\bcat\\b -> dog\ncats? -> pets", True).combined
+        self.assertEqual({"cat": [0, 1]}, combined.rules_by_prefix)
+        self.assertEqual(("dog pets", 2), combined.replace("cat cats"))
+
+    def test_regex_single_pass_falls_back_for_unmergeable_rules(self):
+        cases = {
+            "no literal prefix": ("\\d+ -> #\nb -> y", "a12b"),
+            "chained outputs": ("cat -> dog\ndog -> bird", "cat dog"),
+            "inline ignorecase": ("(?i)cat -> dog\nbird -> fish", "CAT bird"),
+            "zero width": ("x* -> -\nb -> y", "ab"),
+            "later rule starts before an earlier match": ("b -> Y\nab -> X", "ab"),
+            "earlier prefix inside a later prefix": ("at -> X\ncat -> dog", "cat"),
+            "later tail reaches an earlier match": ("b -> Y\na\\w -> X", "ab"),
+            "match across a deletion": ("cat -> \nog -> Z", "dcatog"),
+            "match across an output edge": ("cat -> do\nog -> Z", "catg"),
+            "boundary next to a deletion": ("b -> \n\\ba\\b -> c", " ab"),
+            "lookahead at an earlier output": ("a -> z\nx(?=a) -> ", "xa"),
+            "lookahead after a repeat": ("a -> z\nxb*(?=a) -> y", "xa"),
+            "lookahead behind two earlier rules": ("aax -> y\na -> x\nc(?=a) -> z", "caax"),
+        }
+        for name, (rules, text) in cases.items():
+            with self.subTest(case=name):
+                expected = self.run_batch(text, rules, "sequential (compatible)", use_regex=True)
+
+                self.assertIsNone(advanced_text_filter._get_rule_set(rules, True).combined)
+                self.assertEqual(expected, self.run_batch(text, rules, "single pass", use_regex=True))
+
+    def test_regex_single_pass_matches_sequential_for_random_rule_sets(self):
+        rng = random.Random(4)
+        atoms = ["a", "b", "[ab]", "a+", "b?", "c*", "(a|b)", "\\w", ".", "(c)", "(?=a)", "(?!a)", "(?<=a)", "\\b", "\\B", "$"]
+        outputs = ["", "z", "a", "b", "ab", "X", "\\1", "Z\\1"]
+        merged = 0
+        for _ in range(600):
+            rules = []
+            for _ in range(rng.randint(2, 3)):
+                pattern = "".join(rng.choice("abcx") for _ in range(rng.randint(1, 2)))
+                pattern += "".join(rng.choice(atoms) for _ in range(rng.choice([0, 1, 2])))
+                output = rng.choice(outputs)
+                if "\\1" in output and "(" not in pattern.replace("(?", ""):
+                    output = "Q"
+                rules.append(f"{pattern} -> {output}")
+            rules = "\n".join(rules)
+            if advanced_text_filter._get_rule_set(rules, True).combined is None:
+                continue
+            merged += 1
+            for _ in range(8):
+                text = "".join(rng.choice("abcxZ ") for _ in range(rng.randint(0, 10)))
+                with self.subTest(rules=rules, text=text):
+                    self.assertEqual(
+                        self.run_batch(text, rules, "sequential (compatible)", use_regex=True),
+                        self.run_batch(text, rules, "single pass", use_regex=True),
+                    )
+        self.assertGreater(merged, 50)
+
+
+class AdvancedTextFilterRuleFileTests(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.rules_dir = os.path.realpath(temp_dir.name)
+        patcher = mock.patch.object(advanced_text_filter, "get_rule_dirs", return_value=[self.rules_dir])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        advanced_text_filter._RULE_FILE_CACHE.clear()
+
+    def write_rules(self, name, content):
+        path = os.path.join(self.rules_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        return path
+
+    def run_batch(self, text, rules_file, replacement_rules="", mode="single pass"):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation="batch replace (use replacement_rules)",
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=False,
+            case_conversion="disabled",
+            if_not_found="return original text",
+            replacement_rules=replacement_rules,
+            batch_replace_mode=mode,
+            rules_file=rules_file,
+        )
+
+    def test_tsv_csv_and_arrow_files_are_listed_and_applied(self):
+        self.write_rules("tags.tsv", "# comment line\nbad anatomy\tgood anatomy\n")
+        self.write_rules("sub/quoted.csv", '"a, b",c\nlone\n')
+        self.write_rules("arrows.txt", "cat -> dog\n")
+        self.write_rules("notes.md", "ignored -> file\n")
+
+        self.assertEqual(["arrows.txt", "sub/quoted.csv", "tags.tsv"], advanced_text_filter.get_rule_files())
+        self.assertEqual(("good anatomy", ""), self.run_batch("bad anatomy", "tags.tsv"))
+        self.assertEqual(("c", ""), self.run_batch("a, b", "sub/quoted.csv"))
+        self.assertEqual(("dog", ""), self.run_batch("cat", "arrows.txt"))
+
+    def test_upper_case_extensions_are_parsed_by_their_format(self):
+        self.write_rules("R.TXT", "cat -> dog\n")
+        self.write_rules("T.Tsv", "bird\tfish\n")
+
+        self.assertEqual(["R.TXT", "T.Tsv"], advanced_text_filter.get_rule_files())
+        self.assertEqual(("dog", ""), self.run_batch("cat", "R.TXT"))
+        self.assertEqual(("fish", ""), self.run_batch("bird", "T.Tsv"))
+
+    def test_file_is_compiled_once_and_reloaded_when_it_changes(self):
+        path = self.write_rules("tags.tsv", "cat\tdog\n")
+        self.run_batch("cat", "tags.tsv")
+        self.run_batch("cat", "tags.tsv")
+        self.assertEqual((1, 1), tuple(advanced_text_filter.rule_file_cache_info()[key] for key in ("hits", "misses")))
+
+        self.write_rules("tags.tsv", "cat\tbird\n")
+        os.utime(path, ns=(0, 0))
+
+        self.assertEqual(("bird", ""), self.run_batch("cat", "tags.tsv"))
+
+    def test_regex_timeout_worker_searches_the_same_rule_directories(self):
+        self.write_rules("mine.tsv", "c.t\tdog\n")
+        self.addCleanup(advanced_text_filter._REGEX_WORKER.close)
+
+        result = AdvancedTextFilter().process(
+            text="a cat",
+            concat_mode="disabled",
+            operation="batch replace (use replacement_rules)",
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=True,
+            case_conversion="disabled",
+            if_not_found="trigger error",
+            replacement_rules="",
+            rules_file="mine.tsv",
+            regex_timeout=5,
+        )
+
+        self.assertEqual(("a dog", ""), result)
+        self.assertGreater(advanced_text_filter.regex_worker_info()["calls"], 0)
+
+    def test_file_rules_run_before_inline_rules(self):
+        self.write_rules("tags.tsv", "cat\tdog\n")
+
+        self.assertEqual(("bird", ""), self.run_batch("cat", "tags.tsv", replacement_rules="dog -> bird"))
+
+    def test_names_outside_the_rule_directories_are_not_found(self):
+        outside = os.path.join(os.path.dirname(self.rules_dir), "outside.tsv")
+        self.assertIsNone(advanced_text_filter.resolve_rule_file("../outside.tsv"))
+        self.assertIsNone(advanced_text_filter.resolve_rule_file(outside))
+
+        with self.assertRaisesRegex(ValueError, "Rules file 'missing.tsv' not found"):
+            AdvancedTextFilter().process(
+                text="cat",
+                concat_mode="disabled",
+                operation="batch replace (use replacement_rules)",
+                start_text="",
+                end_text="",
+                optional_text_input="",
+                replace_with_text="",
+                use_regex=False,
+                case_conversion="disabled",
+                if_not_found="trigger error",
+                rules_file="missing.tsv",
+            )
+
+
+class AdvancedTextFilterStreamingTests(unittest.TestCase):
+    # Lines of varying width so chunk edges land mid-line, inside "\r\n", and inside matches.
+    TEXT = "".join(
+        f"  {'ab' * (index % 7)}Σ cat{index % 3}  \r\n" + ("\n" if index % 5 == 0 else "")
+        for index in range(900)
+    )
+
+    def run_node(self, operation, chunk_size_kb, pattern="", case_conversion="disabled", if_not_found="return original text"):
+        return AdvancedTextFilter().process(
+            text=self.TEXT,
+            concat_mode="append_external_text",
+            operation=operation,
+            start_text="",
+            end_text="",
+            optional_text_input=pattern,
+            replace_with_text="<CAT>",
+            use_regex=False,
+            case_conversion=case_conversion,
+            if_not_found=if_not_found,
+            external_text="tail cat",
+            chunk_size_kb=chunk_size_kb,
+        )
+
+    def test_chunked_operations_match_whole_text_results(self):
+        self.assertGreater(len(self.TEXT), 8 * 1024)
+        cases = [
+            ("strip lines (trim)", ""),
+            ("remove empty lines", ""),
+            ("remove all whitespace (keep newlines)", ""),
+            ("normalize whitespace (trim, collapse spaces, remove empty lines)", ""),
+            ("remove newlines", ""),
+            ("find and remove (use optional_text)", "abab"),
+            ("find and replace (use optional_text, replace_with_text)", "cat1, <CAT>ab, σ c"),
+        ]
+        for operation, pattern in cases:
+            for case_conversion in ("disabled", "to lowercase"):
+                with self.subTest(operation=operation, case_conversion=case_conversion):
+                    expected = self.run_node(operation, 0, pattern, case_conversion)
+
+                    self.assertEqual(expected, self.run_node(operation, 1, pattern, case_conversion))
+
+    def test_chunked_find_without_match_applies_if_not_found(self):
+        operation = "find and replace (use optional_text, replace_with_text)"
+
+        self.assertEqual((self.TEXT + "tail cat", ""), self.run_node(operation, 1, "missing"))
+        with self.assertRaisesRegex(ValueError, "Pattern not found"):
+            self.run_node(operation, 1, "missing", if_not_found="trigger error")
+
+    def test_chunks_end_after_newlines_when_line_aligned(self):
+        pieces = ("a\nbb", "b\ncc\nd")
+
+        self.assertEqual(["a\n", "bbb\n", "cc\n", "d"], list(advanced_text_filter._iter_text_chunks(pieces, 2, True)))
+        self.assertEqual(["a\n", "bbb", "\nc", "c\n", "d"], list(advanced_text_filter._iter_text_chunks(pieces, 2, False)))
+
+
+class AdvancedTextFilterWhitespaceTests(unittest.TestCase):
+    def run_node(self, operation, text):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=False,
+            case_conversion="disabled",
+            if_not_found="return original text",
+        )
+
+    def test_normalize_whitespace_trims_collapses_and_drops_blank_lines(self):
+        text = "  a \t  b  \r\n\n \t \n\u3000c\xa0 d\n"
+
+        self.assertEqual(
+            ("a b\nc d", ""),
+            self.run_node("normalize whitespace (trim, collapse spaces, remove empty lines)", text),
+        )
+
+    def test_ascii_fast_paths_match_per_line_results(self):
+        # Every ASCII line break and blank, including a trailing break and a blank last line.
+        for text in ("a b\tc\r\nd\re\x0bf\x0cg\x1ch\x1f i\n", "a\n ", "\r\n\r", "", " "):
+            lines = text.splitlines()
+            with self.subTest(text=text):
+                self.assertEqual(
+                    ("\n".join("".join(line.split()) for line in lines), ""),
+                    self.run_node("remove all whitespace (keep newlines)", text),
+                )
+                self.assertEqual(("\n".join(line.strip() for line in lines), ""), self.run_node("strip lines (trim)", text))
+
+    def test_remove_newlines_on_long_text_deletes_every_break(self):
+        text = "ab\r\ncd\re\n" * advanced_text_filter.TRANSLATE_MIN_CHARS
+
+        self.assertEqual(("abcde" * advanced_text_filter.TRANSLATE_MIN_CHARS, ""), self.run_node("remove newlines", text))
+
+
+class AdvancedTextFilterJsonExtractTests(unittest.TestCase):
+    REPLY = 'Plan: {"step": 1, "note": "use } and ] freely"} then [1, 2] and {not json} [see {"id": "a\\"b"}] done'
+
+    def run_extract(self, text, operation="LLM: extract all valid JSON ({...} / [...])"):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=False,
+            case_conversion="disabled",
+            if_not_found="return original text",
+        )
+
+    def test_extract_all_returns_every_balanced_top_level_block(self):
+        processed, remaining = self.run_extract(self.REPLY, "LLM: extract all JSON ({...} / [...])")
+
+        self.assertEqual(
+            '{"step": 1, "note": "use } and ] freely"}\n[1, 2]\n{not json}\n[see {"id": "a\\"b"}]',
+            processed,
+        )
+        self.assertEqual("Plan:  then  and   done", remaining)
+
+    def test_valid_mode_skips_invalid_blocks_but_keeps_valid_nested_ones(self):
+        expected = (
+            '{"step": 1, "note": "use } and ] freely"}\n[1, 2]\n{"id": "a\\"b"}',
+            "Plan:  then  and {not json} [see ] done",
+        )
+
+        self.assertEqual(expected, self.run_extract(self.REPLY))
+        with mock.patch.object(advanced_text_filter, "_orjson", None):
+            self.assertEqual(expected, self.run_extract(self.REPLY))
+
+    def test_mismatched_brackets_and_multiline_strings_do_not_swallow_later_blocks(self):
+        processed, _ = self.run_extract('{"a": [1, 2} and {"s": "x\ny"} then {"ok": true}')
+
+        self.assertEqual('{"ok": true}', processed)
+
+    def test_missing_json_applies_if_not_found(self):
+        self.assertEqual(("", "plain text"), self.run_extract("plain text"))
+
+
+class AdvancedTextFilterBetweenTests(unittest.TestCase):
+    TEXT = "x<a>1</a>y<a>22</a>z<a>open"
+
+    def run_between(self, operation, start_text="<a>", end_text="</a>", use_regex=False, text=TEXT):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text=start_text,
+            end_text=end_text,
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=use_regex,
+            case_conversion="disabled",
+            if_not_found="return original text",
+        )
+
+    def test_all_between_collects_every_closed_pair_and_keeps_the_markers(self):
+        self.assertEqual(("1\n22", "x<a></a>y<a></a>z<a>open"), self.run_between("extract all between"))
+        self.assertEqual(("x<a></a>y<a></a>z<a>open", "1\n22"), self.run_between("remove all between"))
+        self.assertEqual(
+            ("1\n22", "x<a></a>y<a></a>z<a>open"),
+            self.run_between("extract all between", r"<\w>", r"</\w>", use_regex=True),
+        )
+
+    def test_regex_search_sees_text_before_the_search_position(self):
+        # The end marker is searched in place, so lookbehinds and ^ see the real preceding text.
+        self.assertEqual(("b", "a[]c"), self.run_between("extract between", r"\[", r"(?<=b)\]", True, "a[b]c"))
+        self.assertEqual(("a", "[]"), self.run_between("extract all between", r"\[", r"^a|\]", True, "[a]"))
+
+    def test_zero_width_markers_terminate(self):
+        self.assertEqual(("\n\n\n", "abc"), self.run_between("extract all between", "x*", "y*", use_regex=True, text="abc"))
+
+    def test_no_closed_pair_applies_if_not_found(self):
+        self.assertEqual(("", "x<a>open"), self.run_between("extract all between", text="x<a>open"))
+        self.assertEqual(("x<a>open", ""), self.run_between("remove all between", text="x<a>open"))
+
+
+class AdvancedTextFilterIgnoreCaseTests(unittest.TestCase):
+    def run_node(self, operation, text, patterns="", replace_with_text="", start_text="", end_text="",
+                 rules="", mode="sequential (compatible)", use_regex=False):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text=start_text,
+            end_text=end_text,
+            optional_text_input=patterns,
+            replace_with_text=replace_with_text,
+            use_regex=use_regex,
+            case_conversion="disabled",
+            if_not_found="return original text",
+            replacement_rules=rules,
+            batch_replace_mode=mode,
+            ignore_case=True,
+        )
+
+    def test_find_operations_report_matches_in_original_case(self):
+        text = "Cat cat CAT dog"
+
+        self.assertEqual(
+            ("X X X dog", "Cat\ncat\nCAT"),
+            self.run_node("find and replace (use optional_text, replace_with_text)", text, "cat", "X"),
+        )
+        self.assertEqual(("Cat\ncat\nCAT", "   dog"), self.run_node("find all (extract) (use optional_text)", text, "cAt"))
+
+    def test_case_folding_maps_expanded_characters_back_to_the_original(self):
+        processed, found = self.run_node("find and replace (use optional_text, replace_with_text)", "Straße, STRASSE", "strasse", "road")
+        self.assertEqual(("road, road", "Straße\nSTRASSE"), (processed, found))
+
+        # A match covering only part of a folded character is not a match in the original.
+        self.assertEqual(("ß İx", ""), self.run_node("find and remove (use optional_text)", "ß İx", "s, i"))
+
+    def test_markers_are_found_case_insensitively(self):
+        self.assertEqual(
+            ("Body", "Begin [START][end] x"),
+            self.run_node("extract between", "Begin [START]Body[end] x", start_text="[start]", end_text="[END]"),
+        )
+        self.assertEqual(
+            ("a\nc", "<B></b> <b></B>"),
+            self.run_node("extract all between", "<B>a</b> <b>c</B>", start_text="<b>", end_text="</b>"),
+        )
+
+    def test_batch_modes_match_rules_ignoring_case(self):
+        rules = "dog -> cat\ndogs -> cats\ngroß -> big"
+        operation = "batch replace (use replacement_rules)"
+
+        self.assertEqual(("biger cat cat cats", ""), self.run_node(operation, "GROSSer Dog dog DOGS", rules=rules, mode="single pass"))
+        self.assertEqual(("biger cat cat cats", ""), self.run_node(operation, "Großer Dog dog DOGS", rules="dogs -> cats\n" + rules))
+
+    def test_regex_mode_is_unaffected(self):
+        self.assertEqual(("Cat", "cat"), self.run_node("find and remove (use optional_text)", "Catcat", "cat", use_regex=True))
+
+
+class AdvancedTextFilterPromptTagTests(unittest.TestCase):
+    PROMPT = "((masterpiece)), (long_hair:1.2), long hair, [bad hands], {red, blue|green}, artist \\(style\\), 1girl,, solo ,1girl"
+
+    def run_tags(self, text, blacklist="", rules="", sort=False):
+        operation = "tags: clean and sort" if sort else "tags: clean"
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation + " (dedupe, remove optional_text, alias replacement_rules)",
+            start_text="",
+            end_text="",
+            optional_text_input=blacklist,
+            replace_with_text="",
+            use_regex=False,
+            case_conversion="disabled",
+            if_not_found="return original text",
+            replacement_rules=rules,
+        )
+
+    def test_dedupe_keeps_first_spelling_and_weight(self):
+        self.assertEqual(
+            (
+                "((masterpiece)), (long_hair:1.2), [bad hands], {red, blue|green}, artist \\(style\\), 1girl, solo",
+                "long hair, 1girl",
+            ),
+            self.run_tags(self.PROMPT),
+        )
+
+    def test_blacklist_and_aliases_apply_inside_weight_syntax(self):
+        rules = "Long Hair -> very long hair\n1girl -> 1girl, female\nmasterpiece ->"
+
+        processed, dropped = self.run_tags(self.PROMPT, blacklist="solo, bad_hands", rules=rules)
+
+        self.assertEqual("(very long hair:1.2), {red, blue|green}, artist \\(style\\), 1girl, female", processed)
+        self.assertEqual(
+            "((masterpiece)), very long hair, [bad hands], solo, 1girl, female",
+            dropped,
+        )
+
+    def test_sort_orders_by_tag_name_ignoring_weight_syntax(self):
+        processed, _ = self.run_tags("(zebra:1.1), Apple, [mango], apple")
+
+        self.assertEqual("(zebra:1.1), Apple, [mango]", processed)
+        self.assertEqual(("Apple, [mango], (zebra:1.1)", "apple"), self.run_tags("(zebra:1.1), Apple, [mango], apple", sort=True))
+
+
+class AdvancedTextFilterMarkdownTests(unittest.TestCase):
+    REPLY = (
+        "# Title\n\nSome **bold** and _it_ text with [a link](http://x.y) and ![alt](i.png).\n"
+        "Keep snake_case, *args and 2 * 3.\n\n"
+        "```python\nx = a_b * 2  # **not bold**\n```\n"
+        "Use `foo_bar()` here."
+    )
+
+    def run_clean(self, text, operation="LLM: clean markdown formatting"):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text="",
+            end_text="",
+            optional_text_input="",
+            replace_with_text="",
+            use_regex=False,
+            case_conversion="disabled",
+            if_not_found="return original text",
+        )
+
+    def test_strips_formatting_but_keeps_code_and_identifiers_verbatim(self):
+        expected = (
+            "Title\n\nSome bold and it text with a link and alt.\n"
+            "Keep snake_case, *args and 2 * 3.\n\n"
+            "x = a_b * 2  # **not bold**\n"
+            "Use foo_bar() here."
+        )
+
+        self.assertEqual((expected, ""), self.run_clean(self.REPLY))
+
+    def test_keep_code_mode_leaves_fences_and_inline_code_untouched(self):
+        processed, _ = self.run_clean(self.REPLY, "LLM: clean markdown formatting (keep code)")
+
+        self.assertIn("```python\nx = a_b * 2  # **not bold**\n```\n", processed)
+        self.assertIn("Use `foo_bar()` here.", processed)
+        self.assertTrue(processed.startswith("Title\n\nSome bold and it text"))
+
+    def test_links_keep_their_text_for_every_destination_form(self):
+        cases = {
+            'See [docs](https://x.io "Docs").': "See docs.",
+            "See [a](<u v>) and ![pic](<my pic.png> 'Pic').": "See a and pic.",
+            "See [Foo](https://en.wikipedia.org/wiki/Foo_(bar)) now.": "See Foo now.",
+            'See [**bold** docs](https://x.io/a_(b) (Title)).': "See bold docs.",
+            "[a `](b)` c\n\n](d) e": "a ](b) c\n\n](d) e",
+        }
+        for text, expected in cases.items():
+            with self.subTest(text=text):
+                self.assertEqual((expected, ""), self.run_clean(text))
+
+    def test_unpaired_markers_are_kept(self):
+        text = "- item with a `stray tick and *one star\n#hashtag"
+
+        self.assertEqual((text, ""), self.run_clean(text))
+
+
+class AdvancedTextFilterOutputCacheTests(unittest.TestCase):
+    def setUp(self):
+        advanced_text_filter.clear_output_cache()
+        self.addCleanup(advanced_text_filter.clear_output_cache)
+
+    def run_cached(self, text, pattern="w(or)ld", cache_results=True):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation="find and replace (use optional_text, replace_with_text)",
+            start_text="",
+            end_text="",
+            optional_text_input=pattern,
+            replace_with_text="there",
+            use_regex=True,
+            case_conversion="disabled",
+            if_not_found="return original text",
+            cache_results=cache_results,
+        )
+
+    def test_repeated_inputs_skip_the_regex_engine(self):
+        expected = self.run_cached("hello world")
+
+        compile_regex = mock.Mock(wraps=advanced_text_filter._compile_regex)
+        with mock.patch.object(advanced_text_filter, "_compile_regex", compile_regex):
+            self.assertEqual(expected, self.run_cached("hello world"))
+            self.assertEqual(0, compile_regex.call_count)
+            self.run_cached("hello world", pattern="world")
+            self.assertGreater(compile_regex.call_count, 0)
+
+        stats = advanced_text_filter.output_cache_info()
+        self.assertEqual((1, 2, 2), (stats["hits"], stats["misses"], stats["entries"]))
+
+    def test_disabled_cache_is_not_consulted(self):
+        self.run_cached("hello world", cache_results=False)
+
+        self.assertEqual(0, advanced_text_filter.output_cache_info()["misses"])
+
+    def test_cache_is_bounded_in_bytes_and_evicts_oldest_results(self):
+        size = sum(sys.getsizeof(value) for value in self.run_cached("a" * 1000))
+        cache = advanced_text_filter._OutputCache(max_bytes=size * 2)
+        with mock.patch.object(advanced_text_filter, "_OUTPUT_CACHE", cache):
+            for index in range(3):
+                self.run_cached(str(index) + "a" * 999)
+            self.run_cached("a" * 100_000)
+
+        stats = cache.stats()
+        self.assertEqual(2, stats["entries"])
+        self.assertEqual(1, stats["evictions"])
+        self.assertLessEqual(stats["bytes"], stats["max_bytes"])
+
+
+class AdvancedTextFilterOperationStatsTests(unittest.TestCase):
+    def setUp(self):
+        advanced_text_filter.reset_operation_stats()
+        self.addCleanup(advanced_text_filter.reset_operation_stats)
+
+    def run_node(self, text, operation, pattern="", **options):
+        return AdvancedTextFilter().process(
+            text=text,
+            concat_mode="disabled",
+            operation=operation,
+            start_text="",
+            end_text="",
+            optional_text_input=pattern,
+            replace_with_text="",
+            use_regex=options.pop("use_regex", False),
+            case_conversion="disabled",
+            if_not_found="return original text",
+            **options,
+        )
+
+    def test_every_operation_mode_has_a_handler(self):
+        self.assertEqual(set(advanced_text_filter.OPERATION_MODES), set(advanced_text_filter._OPERATION_HANDLERS))
+        self.assertEqual(("text", "Unknown operation"), self.run_node("text", "not an operation"))
+
+    def test_calls_are_recorded_with_input_size_and_matches(self):
+        self.run_node("a cat, a cat", "find and remove (use optional_text)", "cat")
+        self.run_node("no match", "find and remove (use optional_text)", "cat")
+        self.run_node("x\n\ny", "remove empty lines")
+
+        stats = advanced_text_filter.operation_stats()
+        find = stats["find and remove (use optional_text)"]
+        self.assertEqual((2, 20, 2), (find["calls"], find["input_chars"], find["matches"]))
+        self.assertGreaterEqual(find["total_seconds"], find["max_seconds"])
+        self.assertEqual(1, stats["remove empty lines"]["calls"])
+        self.assertEqual(set(stats), set(json.loads(advanced_text_filter.dump_operation_stats())))
+
+    def test_clean_tags_counts_dropped_tags_not_separators(self):
+        operation = "tags: clean (dedupe, remove optional_text, alias replacement_rules)"
+        processed, _ = self.run_node("(a, b), {red, blue|green}, (a, b), {red, blue|green}, c", operation, "c")
+
+        self.assertEqual("(a, b), {red, blue|green}", processed)
+        self.assertEqual(3, advanced_text_filter.operation_stats()[operation]["matches"])
+
+    def test_streamed_calls_record_their_matches(self):
+        self.run_node("a cat, a dog, a cat", "find and remove (use optional_text)", "cat, dog", chunk_size_kb=1)
+
+        find = advanced_text_filter.operation_stats()["find and remove (use optional_text)"]
+        self.assertEqual((1, 19, 3), (find["calls"], find["input_chars"], find["matches"]))
+
+    def test_timeout_guarded_calls_record_the_worker_matches(self):
+        result = self.run_node("a cat, a cot", "find and remove (use optional_text)", "c.t", use_regex=True, regex_timeout=5)
+
+        self.assertEqual(("a , a ", "cat\ncot"), result)
+        find = advanced_text_filter.operation_stats()["find and remove (use optional_text)"]
+        self.assertEqual((1, 2), (find["calls"], find["matches"]))
+
+
+class AdvancedTextFilterListTests(unittest.TestCase):
+    def run_list(self, texts, external_text=None, max_workers=0):
+        return AdvancedTextFilterList().process_list(
+            text=texts,
+            concat_mode=["append_external_text"],
+            operation=["batch replace (use replacement_rules)"],
+            start_text=[""],
+            end_text=[""],
+            optional_text_input=[""],
+            replace_with_text=[""],
+            use_regex=[False],
+            case_conversion=["disabled"],
+            if_not_found=["return empty string"],
+            external_text=external_text,
+            replacement_rules=["bad -> good"],
+            batch_replace_mode=["single pass"],
+            max_workers=[max_workers],
+        )
+
+    def test_outputs_are_aligned_lists(self):
+        processed, remaining = self.run_list(["bad cat", "clean", "bad bad"])
+
+        self.assertEqual(["good cat", "clean", "good good"], processed)
+        self.assertEqual(["", "", ""], remaining)
+
+    def test_external_text_pairs_by_item_or_broadcasts_single_value(self):
+        self.assertEqual(["a1", "b2"], self.run_list(["a", "b"], external_text=["1", "2"])[0])
+        self.assertEqual(["a!", "b!"], self.run_list(["a", "b"], external_text=["!"])[0])
+
+    def test_thread_pool_preserves_input_order(self):
+        texts = [f"bad {index}" for index in range(advanced_text_filter.LIST_PARALLEL_MIN_ITEMS * 2)]
+
+        processed, _ = self.run_list(texts, max_workers=4)
+
+        self.assertEqual([f"good {index}" for index in range(len(texts))], processed)
+
+
+class TextFilterRecipeTests(unittest.TestCase):
+    def run_recipe(self, text, steps, if_not_found="return original text", **kwargs):
+        options = {"concat_mode": "disabled", "case_conversion": "disabled", "external_text": None}
+        options.update(kwargs)
+        return TextFilterRecipe().process(
+            text=text,
+            recipe=json.dumps(steps),
+            if_not_found=if_not_found,
+            **options,
+        )
+
+    def test_steps_run_in_order_and_can_continue_from_remaining_text(self):
+        steps = [
+            {"operation": "extract between", "start_text": "<a>", "end_text": "</a>"},
+            {"operation": "find and replace (use optional_text, replace_with_text)",
+             "optional_text_input": "x", "replace_with_text": "y", "input": "remaining"},
+        ]
+
+        self.assertEqual(("<a></a> y", "x"), self.run_recipe("<a>inner</a> x", steps))
+
+    def test_preamble_runs_once_before_first_step(self):
+        steps = [{"operation": "find and remove (use optional_text)", "optional_text_input": "B"}]
+
+        processed, _ = self.run_recipe(
+            "a b", steps,
+            concat_mode="append_external_text", external_text=" b", case_conversion="to UPPERCASE",
+        )
+
+        self.assertEqual("A  ", processed)
+
+    def test_recipe_is_compiled_once_per_recipe_text(self):
+        advanced_text_filter._RECIPE_CACHE.clear()
+        steps = [{"operation": "remove newlines"}]
+
+        self.run_recipe("a\nb", steps)
+        self.run_recipe("c\nd", steps)
+
+        self.assertEqual(1, advanced_text_filter._RECIPE_CACHE.stats()["hits"])
+
+    def test_invalid_recipes_fail_before_processing(self):
+        cases = {
+            "not json": "[{",
+            "unknown operation": json.dumps([{"operation": "explode"}]),
+            "unknown key": json.dumps([{"operation": "remove newlines", "colour": "red"}]),
+            "bad regex": json.dumps([{"operation": "find and remove (use optional_text)",
+                                      "optional_text_input": "(", "use_regex": True}]),
+            "string flag": json.dumps([{"operation": "find and remove (use optional_text)",
+                                        "optional_text_input": "A", "ignore_case": "false"}]),
+            "number flag": json.dumps([{"operation": "remove newlines", "use_regex": 1}]),
+        }
+        for name, recipe in cases.items():
+            with self.subTest(case=name):
+                with self.assertRaisesRegex(ValueError, r"\[TextFilterRecipe\]"):
+                    TextFilterRecipe().process("text", recipe, "disabled", "disabled", "return original text")
+
+    def test_trigger_error_reports_failing_step(self):
+        steps = [
+            {"operation": "remove newlines"},
+            {"operation": "find and remove (use optional_text)", "optional_text_input": "missing"},
+        ]
+
+        with self.assertRaisesRegex(ValueError, "step 2: .*Pattern not found"):
+            self.run_recipe("text", steps, if_not_found="trigger error")
+
 
 if __name__ == "__main__":
     unittest.main()
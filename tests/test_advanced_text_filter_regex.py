@@ -1,5 +1,6 @@
 import unittest
 
+import advanced_text_filter
 from advanced_text_filter import AdvancedTextFilter
 
 
@@ -48,6 +49,147 @@ class AdvancedTextFilterRegexTests(unittest.TestCase):
         self.assertEqual("alpha\nbeta", processed)
         self.assertEqual("", remaining)
 
+    def test_regex_extract_with_optional_group_reports_empty_text(self):
+        processed, remaining = self.run_extract("a1 b a2", r"a(\d)|b")
+
+        self.assertEqual("1\n\n2", processed)
+        self.assertEqual("  ", remaining)
+
+    def test_regex_extract_later_pattern_still_reads_full_text(self):
+        processed, remaining = self.run_extract("cat catalog", r"cat\w*, cat")
+
+        self.assertEqual("cat\ncatalog\ncat\ncat", processed)
+        self.assertEqual(" ", remaining)
+
+    def test_regex_replace_templates_and_inline_flags_use_one_scan_results(self):
+        node_result = self.node.process(
+            text="Cat=1 cat=2",
+            concat_mode="disabled",
+            operation="find and replace (use optional_text, replace_with_text)",
+            start_text="",
+            end_text="",
+            optional_text_input=r"(?i)(cat)=(\d)",
+            replace_with_text=r"\2:\1",
+            use_regex=True,
+            case_conversion="disabled",
+            if_not_found="trigger error",
+            external_text=None,
+            replacement_rules="",
+        )
+
+        self.assertEqual(("1:Cat 2:cat", "Cat | 1\ncat | 2"), node_result)
+
+
+class RegexCacheTests(unittest.TestCase):
+    def setUp(self):
+        advanced_text_filter.clear_regex_cache()
+        self.node = AdvancedTextFilter()
+
+    def run_replace(self, pattern):
+        return self.node.process(
+            text="a1 b2 c3",
+            concat_mode="disabled",
+            operation="find and replace (use optional_text, replace_with_text)",
+            start_text="",
+            end_text="",
+            optional_text_input=pattern,
+            replace_with_text="#",
+            use_regex=True,
+            case_conversion="disabled",
+            if_not_found="trigger error",
+            external_text=None,
+            replacement_rules="",
+        )
+
+    def test_repeated_runs_reuse_compiled_pattern(self):
+        first = self.run_replace(r"\d")
+        misses_after_first_run = advanced_text_filter.regex_cache_info().misses
+        second = self.run_replace(r"\d")
+
+        info = advanced_text_filter.regex_cache_info()
+        self.assertEqual(("a# b# c#", "1\n2\n3"), first)
+        self.assertEqual(first, second)
+        self.assertEqual(misses_after_first_run, info.misses)
+        self.assertGreaterEqual(info.hits, 1)
+
+    def test_cache_is_bounded(self):
+        for index in range(advanced_text_filter.REGEX_CACHE_SIZE + 10):
+            advanced_text_filter._compile_regex(f"x{index}", 0)
+
+        info = advanced_text_filter.regex_cache_info()
+        self.assertEqual(advanced_text_filter.REGEX_CACHE_SIZE, info.maxsize)
+        self.assertEqual(advanced_text_filter.REGEX_CACHE_SIZE, info.currsize)
+
+
+class RegexGuardTests(unittest.TestCase):
+    CATASTROPHIC = "a" * 40 + "!"
+
+    def setUp(self):
+        self.node = AdvancedTextFilter()
+
+    @classmethod
+    def tearDownClass(cls):
+        advanced_text_filter._REGEX_WORKER.close()
+
+    def run_extract(self, text, pattern, if_not_found="return original text", **options):
+        return self.node.process(
+            text=text,
+            concat_mode="disabled",
+            operation="find all (extract) (use optional_text)",
+            start_text="",
+            end_text="",
+            optional_text_input=pattern,
+            replace_with_text="",
+            use_regex=True,
+            case_conversion="disabled",
+            if_not_found=if_not_found,
+            **options,
+        )
+
+    def test_guarded_run_matches_unguarded_result_and_reuses_worker(self):
+        expected = self.run_extract("id=42 id=99", r"id=(\d+)")
+
+        first = self.run_extract("id=42 id=99", r"id=(\d+)", regex_timeout=5.0)
+        starts = advanced_text_filter.regex_worker_info()["starts"]
+        second = self.run_extract("id=42 id=99", r"id=(\d+)", regex_timeout=5.0)
+
+        self.assertEqual(expected, first)
+        self.assertEqual(expected, second)
+        self.assertEqual(starts, advanced_text_filter.regex_worker_info()["starts"])
+
+    def test_timeout_applies_if_not_found_policy_with_error(self):
+        timeouts = advanced_text_filter.regex_worker_info()["timeouts"]
+
+        processed, remaining = self.run_extract(self.CATASTROPHIC, r"(a+)+(?=b)", regex_timeout=0.3)
+
+        self.assertEqual("", processed)
+        self.assertTrue(remaining.startswith("REGEX TIMEOUT:"))
+        self.assertEqual(timeouts + 1, advanced_text_filter.regex_worker_info()["timeouts"])
+        self.assertEqual(("b", "x"), self.run_extract("xb", r"b", regex_timeout=5.0))
+
+    def test_timeout_with_trigger_error_policy_raises(self):
+        with self.assertRaisesRegex(ValueError, "did not finish within"):
+            self.run_extract(self.CATASTROPHIC, r"(a+)+(?=b)", if_not_found="trigger error", regex_timeout=0.3)
+
+    def test_intentional_errors_from_worker_are_raised(self):
+        with self.assertRaisesRegex(ValueError, "Pattern not found"):
+            self.run_extract("abc", r"\d", if_not_found="trigger error", regex_timeout=5.0)
+
+    @unittest.skipIf(advanced_text_filter._re2 is None, "re2 is not installed")
+    def test_linear_engine_handles_catastrophic_pattern(self):
+        result = self.run_extract(self.CATASTROPHIC + " aab", r"(a+)+b", regex_engine="re2 (linear time)")
+
+        self.assertEqual(("aa", self.CATASTROPHIC + " "), result)
+
+    @unittest.skipIf(advanced_text_filter._re2 is None, "re2 is not installed")
+    def test_linear_engine_falls_back_for_python_only_semantics(self):
+        for pattern in (r"b$", r"(\w)\1", r"x*"):
+            with self.subTest(pattern=pattern):
+                self.assertEqual(
+                    self.run_extract("abb\n", pattern),
+                    self.run_extract("abb\n", pattern, regex_engine="re2 (linear time)"),
+                )
+
 
 if __name__ == "__main__":
     unittest.main()
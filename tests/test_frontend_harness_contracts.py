@@ -158,7 +158,7 @@ class FrontendHarnessContractTests(unittest.TestCase):
         )
 
         node_contracts = _read_json("tests/fixtures/node_contracts_v1.json")
-        self.assertEqual(18, len(node_contracts["nodes"]))
+        self.assertEqual(20, len(node_contracts["nodes"]))
         self.assertIn("Global_RandomSeed", node_contracts["nodes"])
 
 
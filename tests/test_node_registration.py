@@ -8,6 +8,8 @@ from pathlib import Path
 
 EXPECTED_NODE_IDS = {
     "AdvancedTextFilter",
+    "AdvancedTextFilterList",
+    "TextFilterRecipe",
     "TextInput",
     "TextScraper",
     "WildcardsNode",
@@ -206,7 +206,7 @@ class V3MigrationContractTests(unittest.TestCase):
         with PackageImportContext() as package:
             self.assertEqual(set(package.NODE_CLASS_MAPPINGS), set(classifications))
 
-        self.assertEqual(18, len(classifications))
+        self.assertEqual(20, len(classifications))
         counts = Counter()
         selected = []
         for node_id, entry in classifications.items():
@@ -225,7 +225,7 @@ class V3MigrationContractTests(unittest.TestCase):
         self.assertEqual(
             {
                 "stateless": 8,
-                "external_stateful": 4,
+                "external_stateful": 6,
                 "class_stateful": 2,
                 "instance_stateful": 4,
             },
@@ -250,6 +250,8 @@ class V3MigrationContractTests(unittest.TestCase):
             "WildcardsNode": {"wildcard_filesystem", "seeded_randomness"},
             "AddTextToImage": {"font_registry", "font_filesystem"},
             "TP_LoadMask": {"input_filesystem"},
+            "AdvancedTextFilter": {"rules_filesystem"},
+            "AdvancedTextFilterList": {"rules_filesystem"},
         }
         for node_id, required in expected_seams.items():
             with self.subTest(node_id=node_id):
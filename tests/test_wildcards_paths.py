@@ -1,5 +1,8 @@
+import os
+import random
 import sys
 import tempfile
+import time
 import types
 import unittest
 from pathlib import Path
@@ -81,5 +84,213 @@ class WildcardsPathTests(unittest.TestCase):
             self.assertEqual("__../secret__", output)
 
 
+class WildcardFileCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        dirs_patch = patch.object(wildcards, "get_wildcard_dirs", return_value=[str(self.root)])
+        dirs_patch.start()
+        self.addCleanup(dirs_patch.stop)
+        wildcards.clear_wildcard_cache()
+        self.addCleanup(wildcards.clear_wildcard_cache)
+
+    def test_repeated_references_read_the_file_once(self):
+        (self.root / "artist.txt").write_text("  alpha \n\nbeta\n", encoding="utf-8")
+        reader = patch.object(wildcards, "_read_wildcard_lines", wraps=wildcards._read_wildcard_lines)
+
+        with reader as read:
+            outputs = {wildcards.process_wildcard_syntax("__artist__, __artist__", seed) for seed in range(20)}
+
+        self.assertEqual(1, read.call_count)
+        self.assertTrue(outputs <= {"alpha, alpha", "alpha, beta", "beta, alpha", "beta, beta"})
+        info = wildcards.wildcard_cache_info()
+        self.assertEqual((39, 1), (info["hits"], info["misses"]))
+        self.assertAlmostEqual(39 / 40, info["hit_rate"])
+
+    def test_changed_file_is_reloaded(self):
+        path = self.root / "style.txt"
+        path.write_text("old\n", encoding="utf-8")
+        self.assertEqual("old", wildcards.process_wildcard_syntax("__style__", 0))
+
+        path.write_text("newer\n", encoding="utf-8")
+
+        self.assertEqual("newer", wildcards.process_wildcard_syntax("__style__", 0))
+        self.assertEqual(1, wildcards.wildcard_cache_info()["reloads"])
+
+    def test_memory_cap_evicts_least_recently_used_files(self):
+        cache = wildcards._WildcardFileCache(max_bytes=2000)
+        paths = []
+        for index in range(3):
+            path = self.root / f"list_{index}.txt"
+            path.write_text("\n".join(f"entry {index} {line}" for line in range(10)), encoding="utf-8")
+            paths.append(str(path))
+
+        for path in paths:
+            cache.lines(path)
+        cache.lines(paths[-1])
+
+        stats = cache.stats()
+        self.assertGreater(stats["evictions"], 0)
+        self.assertLessEqual(stats["bytes"], 2000)
+        self.assertEqual(1, stats["hits"])
+
+
+class WildcardLineIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name) / "wildcards"
+        self.root.mkdir()
+        for target, value in (
+            ("get_wildcard_dirs", lambda: [str(self.root)]),
+            ("LINE_INDEX_MIN_BYTES", 1),
+            ("_LINE_INDEX_DIR", str(Path(self.tmp.name) / "fallback")),
+        ):
+            patcher = patch.object(wildcards, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        wildcards.clear_wildcard_cache()
+        self.addCleanup(wildcards.clear_wildcard_cache)
+        self.path = self.root / "names.txt"
+        self.path.write_bytes("  alpha \r\n\r\n\t\nbeta\rgamma_é\n\u3000\n  delta  ".encode("utf-8"))
+
+    def test_index_serves_the_same_lines_as_a_full_read(self):
+        lines = wildcards._WILDCARD_FILES.lines(str(self.path))
+
+        self.assertIsInstance(lines, wildcards._IndexedLines)
+        self.assertEqual(list(wildcards._read_wildcard_lines(str(self.path))), [lines[i] for i in range(len(lines))])
+        self.assertTrue((self.root / ".names.txt.idx").exists())
+
+    def test_seeded_picks_match_the_loaded_line_list(self):
+        expected = wildcards._read_wildcard_lines(str(self.path))
+        for seed in range(20):
+            self.assertEqual(
+                random.Random(seed).choice(expected),
+                wildcards.process_wildcard_syntax("__names__", seed),
+            )
+
+    def test_sidecar_is_reused_until_the_file_changes(self):
+        wildcards.process_wildcard_syntax("__names__", 0)
+        wildcards.clear_wildcard_cache()
+
+        with patch.object(wildcards, "_build_line_offsets", wraps=wildcards._build_line_offsets) as build:
+            wildcards.process_wildcard_syntax("__names__", 0)
+            self.assertEqual(0, build.call_count)
+
+            self.path.write_text("only\n", encoding="utf-8")
+            self.assertEqual("only", wildcards.process_wildcard_syntax("__names__", 0))
+            self.assertEqual(1, build.call_count)
+
+    def test_weighted_file_keeps_its_alias_table_in_the_sidecar(self):
+        self.path.write_text("9::often\nrare\n0::never\n", encoding="utf-8")
+        small = self.root / "small.txt"
+        small.write_text("9::often\nrare\n0::never\n", encoding="utf-8")
+
+        lines = wildcards._WILDCARD_FILES.lines(str(self.path))
+        picks = [wildcards.process_wildcard_syntax("__names__", seed) for seed in range(400)]
+
+        self.assertTrue(lines.weighted)
+        self.assertEqual(["often", "rare", "never"], [lines[i] for i in range(3)])
+        self.assertNotIn("never", picks)
+        self.assertGreater(picks.count("often"), picks.count("rare") * 4)
+        with patch.object(wildcards, "LINE_INDEX_MIN_BYTES", 1 << 30):
+            self.assertEqual(picks, [wildcards.process_wildcard_syntax("__small__", seed) for seed in range(400)])
+
+    def test_unwritable_folder_falls_back_to_the_temp_index(self):
+        sidecar = wildcards._line_index_paths(str(self.path))[0]
+        os.mkdir(sidecar)
+
+        self.assertEqual("beta", wildcards.process_wildcard_syntax("__names__", 4))
+        self.assertEqual(1, len(os.listdir(wildcards._LINE_INDEX_DIR)))
+
+
+class WildcardIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        for name in ("style", "nested/a/one", "nested/b/two"):
+            path = self.root / (name + ".txt")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text("x", encoding="utf-8")
+        # Directories modified moments ago are always rescanned; age them so only real changes count.
+        for directory in (self.root, self.root / "nested", self.root / "nested" / "a", self.root / "nested" / "b"):
+            os.utime(directory, (time.time() - 60, time.time() - 60))
+        dirs_patch = patch.object(wildcards, "get_wildcard_dirs", return_value=[str(self.root)])
+        dirs_patch.start()
+        self.addCleanup(dirs_patch.stop)
+
+    def test_lookups_within_the_check_interval_do_not_touch_the_filesystem(self):
+        names = wildcards.get_all_wildcards()
+
+        with patch.object(wildcards.os, "scandir", side_effect=AssertionError("walked")):
+            with patch.object(wildcards.os, "stat", side_effect=AssertionError("checked")):
+                self.assertIs(names, wildcards.get_all_wildcards())
+        self.assertEqual(["nested/a/one", "nested/b/two", "style"], names)
+
+    def test_only_changed_directories_are_rescanned(self):
+        wildcards.get_all_wildcards()
+        before = wildcards.wildcard_index_info()["rescanned_directories"]
+        (self.root / "nested" / "b" / "three.txt").write_text("x", encoding="utf-8")
+        (self.root / "style.txt").unlink()
+
+        wildcards.invalidate_wildcard_index()
+
+        self.assertEqual(["nested/a/one", "nested/b/three", "nested/b/two"], wildcards.get_all_wildcards())
+        self.assertEqual(before + 2, wildcards.wildcard_index_info()["rescanned_directories"])
+
+    def test_changes_are_picked_up_after_the_check_interval(self):
+        wildcards.get_all_wildcards()
+        (self.root / "added.txt").write_text("x", encoding="utf-8")
+
+        with patch.object(wildcards, "WILDCARD_INDEX_CHECK_INTERVAL", 0.0):
+            self.assertIn("added", wildcards.get_all_wildcards())
+
+
+class WildcardPathCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.base = Path(self.tmp.name)
+        self.root = self.base / "wildcards"
+        (self.root / "nested").mkdir(parents=True)
+        (self.root / "nested" / "style.txt").write_text("x", encoding="utf-8")
+        dirs_patch = patch.object(wildcards, "get_wildcard_dirs", return_value=[str(self.root)])
+        dirs_patch.start()
+        self.addCleanup(dirs_patch.stop)
+        wildcards.invalidate_wildcard_index()
+
+    def test_repeated_lookups_skip_path_resolution(self):
+        expected = str(self.root / "nested" / "style.txt")
+        self.assertEqual(expected, wildcards.resolve_wildcard_path("nested/style"))
+        hits = wildcards.wildcard_index_info()["resolve_hits"]
+
+        with patch.object(wildcards.os.path, "realpath", side_effect=AssertionError("resolved again")):
+            self.assertEqual(expected, wildcards.resolve_wildcard_path("nested/style"))
+            self.assertEqual(expected, wildcards.resolve_wildcard_path("nested/style"))
+        self.assertEqual(hits + 2, wildcards.wildcard_index_info()["resolve_hits"])
+
+    def test_missing_names_are_cached_until_the_index_changes(self):
+        self.assertIsNone(wildcards.resolve_wildcard_path("later"))
+        (self.root / "later.txt").write_text("x", encoding="utf-8")
+        self.assertIsNone(wildcards.resolve_wildcard_path("later"))
+
+        wildcards.invalidate_wildcard_index()
+
+        self.assertEqual(str(self.root / "later.txt"), wildcards.resolve_wildcard_path("later"))
+
+    def test_cached_lookups_keep_rejecting_paths_outside_the_roots(self):
+        (self.base / "secret.txt").write_text("x", encoding="utf-8")
+        try:
+            os.symlink(self.base / "secret.txt", self.root / "escape.txt")
+        except (OSError, NotImplementedError):
+            self.skipTest("symlinks are not available")
+
+        for _ in range(2):
+            self.assertIsNone(wildcards.resolve_wildcard_path("../secret"))
+            self.assertIsNone(wildcards.resolve_wildcard_path("escape"))
+            self.assertEqual("__escape__", wildcards.process_wildcard_syntax("__escape__", 0))
+
 if __name__ == "__main__":
     unittest.main()
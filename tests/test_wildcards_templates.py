@@ -0,0 +1,111 @@
+import random
+import sys
+import tempfile
+import types
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+
+if "folder_paths" not in sys.modules:
+    folder_paths = types.ModuleType("folder_paths")
+    folder_paths.base_path = tempfile.gettempdir()
+    sys.modules["folder_paths"] = folder_paths
+
+import wildcards
+
+
+class WildcardTemplateTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        root = Path(self.tmp.name)
+        for name, content in {"animal": "cat\ndog\nfox\n", "plant": "oak\nfern\n", "color": "red\ndark_blue\n"}.items():
+            (root / (name + ".txt")).write_text(content, encoding="utf-8")
+        dirs_patch = patch.object(wildcards, "get_wildcard_dirs", return_value=[str(root)])
+        dirs_patch.start()
+        self.addCleanup(dirs_patch.stop)
+        wildcards.clear_template_cache()
+
+    def expand_seeds(self, template):
+        return [wildcards.process_wildcard_syntax(template, seed) for seed in range(6)]
+
+    def test_seeded_results_match_the_regex_expansion(self):
+        # Expected values are the outputs of the previous re.sub based expansion.
+        self.assertEqual(
+            ["green dog, big", "red cat, small", "red cat, big", "red cat, small", "red dog, big", "blue dog, small"],
+            self.expand_seeds("{red|green|blue} {cat|dog}, {big|small}"),
+        )
+        self.assertEqual(
+            ["a plain dog", "a red cat", "a red cat", "a red cat", "a dark_blue cat", "a plain fox"],
+            self.expand_seeds("a {__color__|plain} __animal__"),
+        )
+
+    def test_choice_inside_a_reference_selects_the_wildcard_file(self):
+        self.assertEqual(["fern", "cat", "cat", "cat", "cat", "fern"], self.expand_seeds("__{animal|plant}__"))
+        self.assertEqual(
+            ["__missing__ and z", "cat and x_y", "cat and x_y", "cat and x_y", "cat and z", "__missing__ and z"],
+            self.expand_seeds("__{animal|missing}__ and {x_y|z}"),
+        )
+
+    def test_template_is_parsed_once_for_many_seeds(self):
+        template = "{red|green|blue} __animal__"
+        for seed in range(100):
+            wildcards.process_wildcard_syntax(template, seed)
+
+        info = wildcards.template_cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(99, info.hits)
+
+    def test_compiled_template_separates_choices_and_references(self):
+        template = wildcards.compile_template("a {x|y} __animal__, __{p|q}lant__")
+
+        self.assertEqual(["a ", 0, " ", ("animal",), ", ", (1, "lant")], template.nodes)
+
+    def test_underscore_tags_keep_the_parsed_form(self):
+        results = self.expand_seeds("{long_hair|short_hair}, __animal__, {blue_eyes|red_eyes}")
+
+        self.assertEqual({"walks": 6, "fallbacks": 0}, wildcards.template_expansion_info())
+        self.assertTrue(all(result.split(", ")[1] in ("cat", "dog", "fox") for result in results))
+        wildcards.process_wildcard_syntax("{a_|b_}_animal__", 0)
+        self.assertEqual(1, wildcards.template_expansion_info()["fallbacks"])
+
+    def test_weighted_choices_follow_their_weights(self):
+        counts = {"cat": 0, "dog": 0, "fox": 0}
+        for seed in range(4000):
+            counts[wildcards.process_wildcard_syntax("{3::cat|dog|0::fox}", seed)] += 1
+
+        self.assertEqual(0, counts["fox"])
+        self.assertAlmostEqual(0.75, counts["cat"] / 4000, delta=0.03)
+
+    def test_alias_table_is_built_once_per_template(self):
+        template = wildcards.compile_template("{2::a|1::b} __animal__")
+        table = template.choices[0][0]
+
+        self.assertIsInstance(table, wildcards._WeightedOptions)
+        self.assertEqual(("a", "b"), table.options)
+        for seed in range(10):
+            wildcards.process_wildcard_syntax("{2::a|1::b} __animal__", seed)
+        self.assertIs(table, wildcards.compile_template("{2::a|1::b} __animal__").choices[0][0])
+
+    def test_alias_table_matches_the_weights_exactly(self):
+        weights = [5.0, 0.0, 1.0, 2.5, 1.5]
+        probability, alias = wildcards._alias_table(weights)
+        share = [0.0] * len(weights)
+        for column in range(len(weights)):
+            share[column] += probability[column]
+            share[alias[column]] += 1.0 - probability[column]
+
+        for expected, actual in zip(weights, share):
+            self.assertAlmostEqual(expected / sum(weights) * len(weights), actual)
+
+    def test_options_without_weights_keep_their_seeded_picks(self):
+        self.assertEqual("a:b", wildcards.process_wildcard_syntax("{a:b}", 0))
+        self.assertEqual(
+            [random.Random(seed).choice(["x", "2 ::y"]) for seed in range(6)],
+            self.expand_seeds("{x|2 ::y}"),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,36 @@
+import hashlib
+import mmap
 import os
 import random
 import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
 import folder_paths
 
 
 PLUGIN_WILDCARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'wildcards')
+WILDCARD_RECURSION_LIMIT = 10
+TEMPLATE_CACHE_SIZE = 1024
+WILDCARD_CACHE_MAX_BYTES = 32 * 1024 * 1024
+LINE_INDEX_MIN_BYTES = 8 * 1024 * 1024
+WILDCARD_INDEX_CHECK_INTERVAL = 1.0
+RESOLVED_PATH_CACHE_SIZE = 4096
+# A directory modified this recently may change again within the same mtime tick.
+_SETTLED_MTIME_NS = 2 * 10**9
+
+_CHOICE_PATTERN = re.compile(r'\{([^{}]+)\}')
+_WEIGHT_PATTERN = re.compile(r'(\d+(?:\.\d*)?|\.\d+)::(.*)', re.S)
+_WILDCARD_PATTERN = re.compile(r'__([^_\\/][^__]*?)__')
+# Stands in for a {a|b} group while the wildcard references of a template are located.
+_CHOICE_SLOT = '\ue000'
+# Template expansions that walked the parsed form, and those that fell back to the regex scan.
+_TEMPLATE_EXPANSIONS = {"walks": 0, "fallbacks": 0}
 
 
 def get_comfyui_base_path():
@@ -21,9 +47,8 @@ def get_wildcard_dir():
             pass
     return wildcard_path
 
-def get_wildcard_dirs():
-    """Return wildcard search roots in precedence order."""
-    roots = [get_wildcard_dir(), PLUGIN_WILDCARD_DIR]
+@lru_cache(maxsize=8)
+def _unique_real_roots(roots):
     unique_roots = []
     seen = set()
     for root in roots:
@@ -31,7 +56,11 @@ def get_wildcard_dirs():
         if real_root not in seen:
             seen.add(real_root)
             unique_roots.append(real_root)
-    return unique_roots
+    return tuple(unique_roots)
+
+def get_wildcard_dirs():
+    """Return wildcard search roots in precedence order."""
+    return list(_unique_real_roots((get_wildcard_dir(), PLUGIN_WILDCARD_DIR)))
 
 def _normalize_wildcard_name(wildcard_name):
     wildcard_name = str(wildcard_name).strip().replace('\\', '/')
@@ -58,13 +87,13 @@ def _is_within_directory(path, base_directory):
     except (OSError, ValueError):
         return False
 
-def resolve_wildcard_path(wildcard_name):
+def _resolve_in_roots(wildcard_name, roots):
     normalized_name = _normalize_wildcard_name(wildcard_name)
     if normalized_name is None:
         return None
 
     relative_parts = normalized_name.split('/')
-    for root in get_wildcard_dirs():
+    for root in roots:
         candidate = os.path.realpath(os.path.join(root, *relative_parts) + ".txt")
         # CRITICAL: wildcard names are workflow-controlled; never allow traversal outside roots.
         if _is_within_directory(candidate, root) and os.path.exists(candidate):
@@ -72,84 +101,656 @@ def resolve_wildcard_path(wildcard_name):
 
     return None
 
+def _scan_wildcard_dir(directory, root):
+    """List one directory the way os.walk would: (wildcard names, subdirectories)."""
+    names, subdirs = [], []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    # os.walk lists linked directories but does not descend into them.
+                    if not entry.is_symlink():
+                        subdirs.append(entry.path)
+                elif entry.name.endswith('.txt'):
+                    rel_path = os.path.relpath(entry.path, root)
+                    clean_name = os.path.splitext(rel_path)[0].replace('\\', '/')
+                    normalized_name = _normalize_wildcard_name(clean_name)
+                    if normalized_name:
+                        names.append(normalized_name)
+    except OSError:
+        pass
+    return names, subdirs
+
+
+class _WildcardIndex:
+    """
+    Names of the .txt files under the wildcard roots.
+    Every directory is remembered with its mtime_ns; a refresh stats the known
+    directories and rescans only those whose entries changed, or whose mtime was
+    too recent to rule out a later change within the same timestamp tick. Refreshes run at
+    most once per WILDCARD_INDEX_CHECK_INTERVAL, so lookups in between are free.
+    """
+
+    def __init__(self):
+        self._roots = ()
+        self._dirs = {}
+        self._names = []
+        self._resolved = OrderedDict()
+        self._generation = 0
+        self._checked = None
+        self.refreshes = 0
+        self.rescanned_directories = 0
+        self.resolve_hits = 0
+        self.resolve_misses = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, roots):
+        changed = roots != self._roots
+        if changed:
+            self._dirs = {root: {} for root in roots}
+            self._roots = roots
+        for root in roots:
+            known = self._dirs[root]
+            seen = set()
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                seen.add(directory)
+                entry = known.get(directory)
+                if entry is None or entry[0] != mtime:
+                    settled = time.time_ns() - mtime >= _SETTLED_MTIME_NS
+                    entry = (mtime if settled else None,) + _scan_wildcard_dir(directory, root)
+                    known[directory] = entry
+                    self.rescanned_directories += 1
+                    changed = True
+                stack.extend(entry[2])
+            for directory in [directory for directory in known if directory not in seen]:
+                del known[directory]
+                changed = True
+
+        if changed or self._checked is None:
+            names = set()
+            for root in roots:
+                for _, directory_names, _ in self._dirs[root].values():
+                    names.update(directory_names)
+            self._names = sorted(names)
+            # Resolved and missing names are only valid for the tree they were looked up in.
+            self._resolved.clear()
+            self._generation += 1
+            self.refreshes += 1
+
+    def _current(self):
+        roots = tuple(get_wildcard_dirs())
+        now = time.monotonic()
+        with self._lock:
+            if roots != self._roots or self._checked is None or now - self._checked >= WILDCARD_INDEX_CHECK_INTERVAL:
+                self._refresh(roots)
+                self._checked = now
+            return self
+
+    def names(self):
+        return self._current()._names
+
+    def resolve(self, wildcard_name):
+        """Cached _resolve_in_roots(); names that resolve to nothing are cached as None too."""
+        self._current()
+        with self._lock:
+            if wildcard_name in self._resolved:
+                self.resolve_hits += 1
+                return self._resolved[wildcard_name]
+            self.resolve_misses += 1
+            roots, generation = self._roots, self._generation
+        path = _resolve_in_roots(wildcard_name, roots)
+        with self._lock:
+            if generation == self._generation:
+                self._resolved[wildcard_name] = path
+                if len(self._resolved) > RESOLVED_PATH_CACHE_SIZE:
+                    self._resolved.popitem(last=False)
+        return path
+
+    def invalidate(self):
+        _unique_real_roots.cache_clear()
+        with self._lock:
+            self._checked = None
+            self._resolved.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "names": len(self._names),
+                "directories": sum(len(known) for known in self._dirs.values()),
+                "refreshes": self.refreshes,
+                "rescanned_directories": self.rescanned_directories,
+                "resolved_names": len(self._resolved),
+                "resolve_hits": self.resolve_hits,
+                "resolve_misses": self.resolve_misses,
+            }
+
+
+_WILDCARD_INDEX = _WildcardIndex()
+
+
 def get_all_wildcards():
     """
-    Scan for .txt files in all configured wildcard directories.
+    Sorted names of the .txt files in all configured wildcard directories.
+    The list is shared by every caller until the index changes; copy it before modifying.
     """
-    files_list = set()
-    for wildcards_path in get_wildcard_dirs():
-        if os.path.exists(wildcards_path):
-            for root, dirs, files in os.walk(wildcards_path):
-                dirs[:] = [d for d in dirs if d not in {".", ".."}]
-                for file in files:
-                    if file.endswith('.txt'):
-                        full_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(full_path, wildcards_path)
-                        clean_name = os.path.splitext(rel_path)[0].replace('\\', '/')
-                        normalized_name = _normalize_wildcard_name(clean_name)
-                        if normalized_name:
-                            files_list.add(normalized_name)
-    return sorted(files_list)
+    return _WILDCARD_INDEX.names()
+
+def resolve_wildcard_path(wildcard_name):
+    """Path of the named wildcard file in the first root that has it, or None; cached with the index."""
+    if not isinstance(wildcard_name, str):
+        return _resolve_in_roots(wildcard_name, tuple(get_wildcard_dirs()))
+    return _WILDCARD_INDEX.resolve(wildcard_name)
+
+def wildcard_index_info():
+    """Return name/directory counts, refresh counters, and name-resolution counters of the wildcard index."""
+    return _WILDCARD_INDEX.stats()
+
+def invalidate_wildcard_index():
+    """Make the next lookup re-check every wildcard directory and resolve names again."""
+    _WILDCARD_INDEX.invalidate()
+
+def _split_weight(option):
+    """'3::text' -> (3.0, 'text'); options without a weight prefix return (None, option)."""
+    match = _WEIGHT_PATTERN.fullmatch(option)
+    if match is None:
+        return None, option
+    return float(match.group(1)), match.group(2).strip()
+
+def _alias_table(weights, typecode="I"):
+    """Walker/Vose alias table: (probability, alias) arrays for constant-time weighted picks."""
+    count = len(weights)
+    total = sum(weights)
+    probability = array('d', [1.0]) * count
+    alias = array(typecode, range(count))
+    if total <= 0:
+        return probability, alias
+    scaled = [weight * count / total for weight in weights]
+    small = [index for index, value in enumerate(scaled) if value < 1.0]
+    large = [index for index, value in enumerate(scaled) if value >= 1.0]
+    while small and large:
+        low = small.pop()
+        high = large[-1]
+        probability[low] = scaled[low]
+        alias[low] = high
+        scaled[high] -= 1.0 - scaled[low]
+        if scaled[high] < 1.0:
+            small.append(large.pop())
+    return probability, alias
+
+def _alias_pick(rng, count, column_of):
+    """Draw one index from an alias table; column_of(column) returns (probability, alias)."""
+    position = rng.random() * count
+    column = min(int(position), count - 1)
+    probability, alias = column_of(column)
+    return column if position - column < probability else alias
+
+class _WeightedOptions:
+    """Options with explicit weights, picked in constant time through a precomputed alias table."""
+
+    __slots__ = ("options", "probability", "alias")
+
+    def __init__(self, options, weights):
+        self.options = options
+        self.probability, self.alias = _alias_table(weights)
+
+    def __len__(self):
+        return len(self.options)
+
+    def __getitem__(self, position):
+        return self.options[position]
+
+    def pick(self, rng):
+        index = _alias_pick(rng, len(self.options), lambda column: (self.probability[column], self.alias[column]))
+        return self.options[index]
+
+    def memory_size(self):
+        return (sys.getsizeof(self.options) + sum(map(sys.getsizeof, self.options))
+                + sys.getsizeof(self.probability) + sys.getsizeof(self.alias))
+
+def _weighted_options(options):
+    """Return the options unchanged when none has a 'weight::' prefix, else a _WeightedOptions."""
+    if not any('::' in option for option in options):
+        return options
+    parsed = [_split_weight(option) for option in options]
+    if all(weight is None for weight, _ in parsed):
+        return options
+    return _WeightedOptions(tuple(text for _, text in parsed), [1.0 if weight is None else weight for weight, _ in parsed])
+
+def _choose(rng, options):
+    """Seeded pick: uniform options keep random.choice(), weighted ones use their alias table."""
+    if isinstance(options, tuple):
+        return rng.choice(options)
+    return options.pick(rng)
 
 def process_random_options(text, seed):
     """Handle {option1|option2} syntax."""
     rng = random.Random(seed)
     
     def replace_options(match):
-        options = [opt.strip() for opt in match.group(1).split('|')]
+        options = tuple(opt.strip() for opt in match.group(1).split('|'))
         if not options: return ""
-        selected = rng.choice(options)
+        selected = _choose(rng, _weighted_options(options))
         
         if '__' in selected or '{' in selected:
             return process_wildcard_syntax(selected, seed + 1)
         return selected
     
-    return re.sub(r'\{([^{}]+)\}', replace_options, text)
+    return _CHOICE_PATTERN.sub(replace_options, text)
+
+def _read_wildcard_lines(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return tuple(line for line in map(str.strip, f.read().split('\n')) if line)
+
+
+# Sidecar layout: header, then one little-endian start offset per non-empty line, then for
+# files with 'weight::line' entries the alias table (float64 probabilities, then aliases).
+_LINE_INDEX_HEADER = struct.Struct("<8sqqqq")
+_LINE_INDEX_MAGIC = {"I": b"WCLIDX4\0", "Q": b"WCLIDX8\0"}
+_LINE_INDEX_DIR = os.path.join(tempfile.gettempdir(), "ComfyUI_Text_Processor_line_index")
+_LINE_TEXT = re.compile(rb"[^\r\n]+")
+_LINE_END = re.compile(rb"[\r\n]")
+_ASCII_WHITESPACE = b" \t\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+def _line_index_paths(file_path):
+    """Sidecar next to the wildcard file, then a per-file fallback in the temp folder."""
+    directory, name = os.path.split(file_path)
+    digest = hashlib.blake2b(file_path.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+    return [os.path.join(directory, "." + name + ".idx"), os.path.join(_LINE_INDEX_DIR, digest + ".idx")]
+
+
+def _build_line_offsets(file_path):
+    """
+    Byte offsets of the lines _read_wildcard_lines would keep, in file order, and
+    their weights, or None when no line has a 'weight::' prefix.
+    """
+    weighted = []
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        offsets = array("I" if len(data) < 2**32 else "Q")
+        for match in _LINE_TEXT.finditer(data):
+            line = match.group()
+            if line.strip(_ASCII_WHITESPACE) if line.isascii() else line.decode("utf-8").strip():
+                if b"::" in line:
+                    weight, _ = _split_weight(line.decode("utf-8").strip())
+                    if weight is not None:
+                        weighted.append((len(offsets), weight))
+                offsets.append(match.start())
+    if not weighted:
+        return offsets, None
+    weights = [1.0] * len(offsets)
+    for position, weight in weighted:
+        weights[position] = weight
+    return offsets, weights
+
+
+class _IndexedLines:
+    """
+    Sequence of the non-empty, stripped lines of a large wildcard file.
+    Only the line start offsets are indexed; reading item i reads one offset
+    from the sidecar and one line from the memory-mapped file, so seeded
+    random.choice() picks the same line as on the full line list. Weighted
+    files keep their alias table in the sidecar and pick() reads one column.
+    """
+
+    __slots__ = ("file_path", "index_path", "typecode", "count", "weighted")
+
+    def __init__(self, file_path, index_path, typecode, count, weighted):
+        self.file_path = file_path
+        self.index_path = index_path
+        self.typecode = typecode
+        self.count = count
+        self.weighted = weighted
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if not 0 <= position < self.count:
+            raise IndexError("wildcard line index out of range")
+        itemsize = 4 if self.typecode == "I" else 8
+        with open(self.index_path, "rb") as f:
+            f.seek(_LINE_INDEX_HEADER.size + position * itemsize)
+            offset, = struct.unpack("<" + self.typecode, f.read(itemsize))
+        with open(self.file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = _LINE_END.search(data, offset)
+            line = data[offset:end.start() if end else len(data)]
+        return _split_weight(line.decode("utf-8").strip())[1]
+
+    def pick(self, rng):
+        if not self.weighted:
+            return rng.choice(self)
+        itemsize = 4 if self.typecode == "I" else 8
+        table_start = _LINE_INDEX_HEADER.size + self.count * itemsize
+        with open(self.index_path, "rb") as f:
+            def column_of(column):
+                f.seek(table_start + column * 8)
+                probability, = struct.unpack("<d", f.read(8))
+                f.seek(table_start + self.count * 8 + column * itemsize)
+                alias, = struct.unpack("<" + self.typecode, f.read(itemsize))
+                return probability, alias
+            index = _alias_pick(rng, self.count, column_of)
+        return self[index]
+
+    def memory_size(self):
+        return sys.getsizeof(self)
+
+
+def _read_line_index(index_path, stamp):
+    try:
+        with open(index_path, "rb") as f:
+            magic, mtime_ns, size, count, weighted = _LINE_INDEX_HEADER.unpack(f.read(_LINE_INDEX_HEADER.size))
+            index_size = os.fstat(f.fileno()).st_size
+    except (OSError, struct.error):
+        return None
+    for typecode, expected_magic in _LINE_INDEX_MAGIC.items():
+        itemsize = 4 if typecode == "I" else 8
+        expected_size = _LINE_INDEX_HEADER.size + count * itemsize + (count * (8 + itemsize) if weighted else 0)
+        if magic == expected_magic and (mtime_ns, size) == stamp and index_size == expected_size:
+            return typecode, count, bool(weighted)
+    return None
+
+
+def _load_line_index(file_path, stamp):
+    """Open the sidecar index of a large wildcard file, rebuilding it when the file changed."""
+    index_paths = _line_index_paths(file_path)
+    for index_path in index_paths:
+        found = _read_line_index(index_path, stamp)
+        if found is not None:
+            return _IndexedLines(file_path, index_path, *found)
+
+    offsets, weights = _build_line_offsets(file_path)
+    tables = [offsets]
+    if weights is not None:
+        tables.extend(_alias_table(weights, offsets.typecode))
+    if sys.byteorder == "big":
+        for table in tables:
+            table.byteswap()
+    header = _LINE_INDEX_HEADER.pack(
+        _LINE_INDEX_MAGIC[offsets.typecode], stamp[0], stamp[1], len(offsets), weights is not None
+    )
+    for index_path in index_paths:
+        temp_path = f"{index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(header)
+                for table in tables:
+                    table.tofile(f)
+            os.replace(temp_path, index_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            continue
+        return _IndexedLines(file_path, index_path, offsets.typecode, len(offsets), weights is not None)
+    raise OSError(f"[Wildcards] cannot write a line index for {file_path}")
+
+
+class _WildcardFileCache:
+    """
+    Thread-safe LRU of parsed wildcard files keyed by path.
+    An entry is reused while the file's (mtime_ns, size) is unchanged, and the
+    cache is bounded by the memory of the stored lines. Files of at least
+    LINE_INDEX_MIN_BYTES are not loaded; they are served by an _IndexedLines view.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lines(self, file_path):
+        stat = os.stat(file_path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(file_path)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(file_path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.reloads += 1
+
+        if stamp[1] >= LINE_INDEX_MIN_BYTES:
+            lines = _load_line_index(file_path, stamp)
+        else:
+            lines = _weighted_options(_read_wildcard_lines(file_path))
+        if isinstance(lines, tuple):
+            size = sys.getsizeof(lines) + sum(map(sys.getsizeof, lines))
+        else:
+            size = lines.memory_size()
+        with self._lock:
+            previous = self._entries.pop(file_path, None)
+            if previous is not None:
+                self.bytes -= previous[2]
+            if size <= self.max_bytes:
+                self._entries[file_path] = (stamp, lines, size)
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                    self.bytes -= evicted_size
+                    self.evictions += 1
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.reloads = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_WILDCARD_FILES = _WildcardFileCache(WILDCARD_CACHE_MAX_BYTES)
+
+
+def wildcard_cache_info():
+    """Return hit rate, reload/eviction counters, and memory use of the wildcard file cache."""
+    return _WILDCARD_FILES.stats()
+
+def clear_wildcard_cache():
+    _WILDCARD_FILES.clear()
+
+def _expand_wildcard(wildcard_name, match_seed, debug=False, recursion_depth=0):
+    """
+    Pick a line of the named wildcard file.
+    Returns (text or None when the reference stays as written, whether a line was drawn).
+    """
+    file_path = resolve_wildcard_path(wildcard_name)
+    if not file_path:
+        return None, False
+    drawn = False
+    try:
+        lines = _WILDCARD_FILES.lines(file_path)
+        if lines:
+            selected = _choose(random.Random(match_seed), lines)
+            drawn = True
+            if '__' in selected or '{' in selected:
+                return process_wildcard_syntax(selected, match_seed, debug, recursion_depth + 1), drawn
+            return selected, drawn
+    except Exception:
+        pass
+    return None, drawn
 
 def find_and_replace_wildcards(prompt, offset_seed, debug=False, recursion_depth=0):
     """Handle __wildcard__ syntax."""
-    regex_pattern = r'__([^_\\/][^__]*?)__'
-    
     wildcard_count = 0
     
     def replacement_func(match):
         nonlocal wildcard_count
-        wildcard_name = match.group(1) 
-        
-        file_path = resolve_wildcard_path(wildcard_name)
-        
-        if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    lines = [line.strip() for line in f.readlines() if line.strip()]
-                
-                if lines:
-                    match_seed = offset_seed + wildcard_count
-                    match_rng = random.Random(match_seed)
-                    selected = match_rng.choice(lines)
-                    
+        selected, drawn = _expand_wildcard(match.group(1), offset_seed + wildcard_count, debug, recursion_depth)
+        if drawn:
+            wildcard_count += 1
+        return match.group(0) if selected is None else selected
+
+    return _WILDCARD_PATTERN.sub(replacement_func, prompt)
+
+
+class _CompiledTemplate:
+    """
+    A prompt parsed once into literal text, {a|b} choices, and __name__ references.
+
+    items is the template with every choice replaced by its index, as read by
+    process_random_options. nodes is the same text after find_and_replace_wildcards
+    located the references: strings, choice indexes, and tuples holding the parts
+    of a reference name. The references were located with every choice standing
+    in for one plain character, so nodes only apply to seeds whose selections
+    keep that tokenization (see _keeps_references). named holds the indexes of
+    the choices that are part of a reference name.
+    """
+
+    __slots__ = ("text", "items", "choices", "nodes", "named")
+
+    def __init__(self, text):
+        self.text = text
+        self.items = []
+        self.choices = []
+        last = 0
+        for match in _CHOICE_PATTERN.finditer(text):
+            if match.start() > last:
+                self.items.append(text[last:match.start()])
+            self.items.append(len(self.choices))
+            self.choices.append(_weighted_options(tuple(option.strip() for option in match.group(1).split('|'))))
+            last = match.end()
+        if last < len(text):
+            self.items.append(text[last:])
+
+        self.nodes = None
+        self.named = frozenset()
+        if _CHOICE_SLOT in text:
+            self.choices = [(options, False) for options in self.choices]
+            return
+        skeleton = "".join(_CHOICE_SLOT if isinstance(item, int) else item for item in self.items)
+        # A choice inside a word (no underscore on either side) can be empty or start with a slash
+        # without changing which words find_and_replace_wildcards treats as references.
+        self.choices = [
+            (options, 0 < position < len(skeleton) - 1 and skeleton[position - 1] != '_' and skeleton[position + 1] != '_')
+            for options, position in zip(self.choices, (i for i, char in enumerate(skeleton) if char == _CHOICE_SLOT))
+        ]
+        next_choice = iter(range(len(self.choices)))
+
+        def parts(segment):
+            fragments = segment.split(_CHOICE_SLOT)
+            result = [fragments[0]]
+            for fragment in fragments[1:]:
+                result.append(next(next_choice))
+                result.append(fragment)
+            return [part for part in result if part != ""]
+
+        self.nodes = []
+        last = 0
+        for match in _WILDCARD_PATTERN.finditer(skeleton):
+            self.nodes.extend(parts(skeleton[last:match.start()]))
+            self.nodes.append(tuple(parts(match.group(1))))
+            last = match.end()
+        self.nodes.extend(parts(skeleton[last:]))
+        self.named = frozenset(part for node in self.nodes if isinstance(node, tuple) for part in node if isinstance(part, int))
+
+    def _keeps_references(self, outputs):
+        """
+        True when no selection adds, removes, or moves a __name__ reference boundary.
+        Names cannot hold an underscore; elsewhere one only matters when it can pair
+        up with another, so tags like long_hair keep the parsed form.
+        """
+        for index, ((_, inside_word), selected) in enumerate(zip(self.choices, outputs)):
+            if '_' in selected and (
+                index in self.named or selected[0] == '_' or selected[-1] == '_' or '__' in selected
+            ):
+                return False
+            if not inside_word and (not selected or selected[0] in '/\\'):
+                return False
+        return True
+
+    def expand(self, seed, debug=False, recursion_depth=0):
+        outputs = []
+        if self.choices:
+            rng = random.Random(seed)
+            for options, _ in self.choices:
+                selected = _choose(rng, options)
+                if '__' in selected or '{' in selected:
+                    selected = process_wildcard_syntax(selected, seed + 1)
+                outputs.append(selected)
+
+        if self.nodes is None or not self._keeps_references(outputs):
+            _TEMPLATE_EXPANSIONS["fallbacks"] += 1
+            text = "".join(outputs[item] if isinstance(item, int) else item for item in self.items)
+            return find_and_replace_wildcards(text, seed, debug, recursion_depth)
+
+        _TEMPLATE_EXPANSIONS["walks"] += 1
+        pieces = []
+        wildcard_count = 0
+        for node in self.nodes:
+            if isinstance(node, str):
+                pieces.append(node)
+            elif isinstance(node, int):
+                pieces.append(outputs[node])
+            else:
+                wildcard_name = "".join(part if isinstance(part, str) else outputs[part] for part in node)
+                selected, drawn = _expand_wildcard(wildcard_name, seed + wildcard_count, debug, recursion_depth)
+                if drawn:
                     wildcard_count += 1
-                    
-                    if '__' in selected or '{' in selected:
-                        return process_wildcard_syntax(selected, match_seed, debug, recursion_depth + 1)
-                    return selected
-            except Exception:
-                pass
-        
-        return match.group(0)
+                pieces.append("__" + wildcard_name + "__" if selected is None else selected)
+        return "".join(pieces)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(text):
+    """Parse a prompt once; the result is cached by template text and expanded per seed."""
+    return _CompiledTemplate(text)
+
+def template_cache_info():
+    """Return hit/miss/size counters of the compiled-template cache."""
+    return compile_template.cache_info()
 
-    return re.sub(regex_pattern, replacement_func, prompt)
+def template_expansion_info():
+    """Return how many expansions walked a parsed template and how many fell back to the regex scan."""
+    return dict(_TEMPLATE_EXPANSIONS)
+
+def clear_template_cache():
+    compile_template.cache_clear()
+    _TEMPLATE_EXPANSIONS.update(walks=0, fallbacks=0)
 
 def process_wildcard_syntax(text, seed, debug=False, recursion_depth=0):
     """Main processing pipeline."""
-    if recursion_depth > 10: # 防止無限迴圈
+    if recursion_depth > WILDCARD_RECURSION_LIMIT: # 防止無限迴圈
         return text
     if not text:
         return ""
-        
-    text = process_random_options(text, seed)
-    text = find_and_replace_wildcards(text, seed, debug, recursion_depth)
-    return text
+    if '{' not in text and '__' not in text:
+        return text
+    return compile_template(text).expand(seed, debug, recursion_depth)
 
 
 class WildcardsNode: